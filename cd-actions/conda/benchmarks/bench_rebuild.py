@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Benchmark rebuild_conda_index.py end to end against a local fake Nexus.
+
+For each channel size, the fake Nexus is seeded by publishing a synthetic
+channel, then a small batch of new packages is published in every requested
+mode. Per-step metrics, peak memory and Nexus traffic are written as JSON.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fake_nexus import start_server
+from generate_channel import STANDARD_ARCHS, generate_channel
+
+REBUILD_SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "rebuild_conda_index.py"
+MODES = {"legacy": [], "native-cache": ["--native-cache"], "incremental": ["--incremental"]}
+
+
+def run_rebuild(package_dir: Path, nexus_url: str, extra_args: list[str], scratch: Path) -> dict:
+    """Run rebuild_conda_index.py in a child process and measure it."""
+    metrics_file = scratch / "metrics.json"
+    metrics_file.unlink(missing_ok=True)
+    cmd = [
+        sys.executable,
+        str(REBUILD_SCRIPT),
+        "--package-dir",
+        str(package_dir),
+        "--nexus-url",
+        nexus_url,
+        "--metrics-file",
+        str(metrics_file),
+        *extra_args,
+    ]
+
+    start = time.perf_counter()
+    with open(scratch / "rebuild.log", "w") as log:
+        process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the resource usage of this child and its own children (conda_index)
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    returncode = os.waitstatus_to_exitcode(status)
+
+    if returncode != 0:
+        print((scratch / "rebuild.log").read_text(), file=sys.stderr)
+        print(f"Error: rebuild_conda_index.py exited with {returncode}", file=sys.stderr)
+        sys.exit(1)
+
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "peak_rss_kib": usage.ru_maxrss,
+        "steps": json.loads(metrics_file.read_text())["steps"],
+    }
+
+
+def bench_channel_size(args, packages_per_arch: int, scratch: Path) -> list[dict]:
+    """Seed a fake Nexus with a channel of the given size and time publishing new packages to it."""
+    results = []
+    for mode in args.modes:
+        print(f"\n=== {packages_per_arch} package(s) per arch, {mode} ===")
+        run_dir = scratch / f"{packages_per_arch}-{mode}"
+        remote = run_dir / "remote"
+        server = start_server(remote, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth)
+        try:
+            seed = run_dir / "seed"
+            generate_channel(seed, packages_per_arch, args.payload_size, args.arch, prefix="seed")
+            print(f"Seeding fake Nexus with {packages_per_arch * len(args.arch)} package(s)...")
+            run_rebuild(seed, server.url, [], run_dir)
+
+            new = run_dir / "new"
+            generate_channel(new, args.new_packages, args.payload_size, args.arch, prefix="new")
+            server.reset_stats()
+            print(f"Publishing {args.new_packages * len(args.arch)} new package(s)...")
+            measurement = run_rebuild(new, server.url, MODES[mode], run_dir)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        result = {
+            "packages_per_arch": packages_per_arch,
+            "new_packages_per_arch": args.new_packages,
+            "mode": mode,
+            **measurement,
+            "nexus": server.stats(),
+        }
+        print(
+            f"  ✓ {result['wall_seconds']:.2f}s wall, {result['cpu_seconds']:.2f}s CPU, "
+            f"peak RSS {result['peak_rss_kib'] // 1024} MiB, {sum(result['nexus']['requests'].values())} request(s)"
+        )
+        results.append(result)
+        shutil.rmtree(run_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rebuild_conda_index.py against a fake Nexus")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100], help="Packages per arch in the channel")
+    parser.add_argument("--new-packages", type=int, default=1, help="New packages per arch to publish")
+    parser.add_argument("--payload-size", type=int, default=64 * 1024, help="Payload bytes per package")
+    parser.add_argument("--arch", action="append", choices=STANDARD_ARCHS, help="Architectures (default: all)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every Nexus request")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Maximum random extra latency in seconds")
+    parser.add_argument("--bandwidth", type=int, default=0, help="Nexus bytes per second (0: unlimited)")
+    parser.add_argument("--output", type=Path, default=Path("bench-results.json"), help="JSON results file")
+    args = parser.parse_args()
+    args.arch = args.arch or STANDARD_ARCHS
+
+    scratch = Path(tempfile.mkdtemp(prefix="conda-index-bench-"))
+    try:
+        results = []
+        for size in args.sizes:
+            results.extend(bench_channel_size(args, size, scratch))
+    finally:
+        shutil.rmtree(scratch)
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {
+            "payload_size": args.payload_size,
+            "architectures": args.arch,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "bandwidth": args.bandwidth,
+        },
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Local stand-in for a Nexus conda repository, with latency and bandwidth injection"""
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FakeNexus(ThreadingHTTPServer):
+    """HTTP server storing files under root, answering GET/HEAD/PUT like a raw Nexus repository.
+
+    Every request is delayed by latency seconds (plus up to jitter seconds), and
+    bodies are throttled to bandwidth bytes per second when it is set.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, root: Path, latency=0.0, jitter=0.0, bandwidth=0, fail_rate=0.0):
+        super().__init__(address, FakeNexusHandler)
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def record(self, method: str) -> None:
+        with self.lock:
+            self.requests[method] += 1
+
+    def record_traffic(self, sent: int = 0, received: int = 0) -> None:
+        with self.lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+
+class FakeNexusHandler(BaseHTTPRequestHandler):
+    server: FakeNexus
+
+    def log_message(self, format, *args):
+        pass
+
+    def local_path(self) -> Path | None:
+        relative = unquote(urlparse(self.path).path).lstrip("/")
+        path = (self.server.root / relative).resolve()
+        if not path.is_relative_to(self.server.root.resolve()):
+            return None
+        return path
+
+    def delay(self) -> bool:
+        """Sleep for the injected latency. Returns False if the request should fail."""
+        time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if self.server.fail_rate and random.random() < self.server.fail_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return False
+        return True
+
+    def throttle(self, size: int) -> None:
+        if self.server.bandwidth:
+            time.sleep(size / self.server.bandwidth)
+
+    def send_file_headers(self, path: Path | None) -> bool:
+        if path is None or not path.is_file():
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return False
+        self.send_response(200)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.send_header("ETag", f'"{{SHA1{{{hashlib.sha1(path.read_bytes()).hexdigest()}}}}}"')
+        self.end_headers()
+        return True
+
+    def do_HEAD(self):
+        self.server.record("HEAD")
+        if self.delay():
+            self.send_file_headers(self.local_path())
+
+    def do_GET(self):
+        self.server.record("GET")
+        if not self.delay():
+            return
+        path = self.local_path()
+        if not self.send_file_headers(path):
+            return
+        sent = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                self.throttle(len(chunk))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        self.server.record_traffic(sent=sent)
+
+    def do_PUT(self):
+        self.server.record("PUT")
+        if not self.delay():
+            return
+        path = self.local_path()
+        if path is None:
+            self.send_response(400)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        remaining = int(self.headers.get("Content-Length", 0))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".part")
+        with open(partial, "wb") as f:
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.throttle(len(chunk))
+                f.write(chunk)
+                remaining -= len(chunk)
+        partial.replace(path)
+        self.server.record_traffic(received=path.stat().st_size)
+
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_server(root: Path, port=0, latency=0.0, jitter=0.0, bandwidth=0, fail_rate=0.0) -> FakeNexus:
+    """Start a FakeNexus serving root in a background thread."""
+    root.mkdir(parents=True, exist_ok=True)
+    server = FakeNexus(("127.0.0.1", port), root, latency, jitter, bandwidth, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a directory as a fake Nexus conda repository")
+    parser.add_argument("root", type=Path, help="Directory holding the repository contents")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random extra latency in seconds")
+    parser.add_argument("--bandwidth", type=int, default=0, help="Bytes per second for bodies (0: unlimited)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = start_server(args.root, args.port, args.latency, args.jitter, args.bandwidth, args.fail_rate)
+    print(f"Serving {args.root} at {server.url} (latency {args.latency}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Generate synthetic conda packages for benchmarking the conda index pipeline"""
+
+import argparse
+import io
+import json
+import os
+import tarfile
+import time
+from pathlib import Path
+
+STANDARD_ARCHS = ["linux-64", "osx-64", "osx-arm64", "win-64", "noarch"]
+
+
+def add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def make_package(dest_dir: Path, arch: str, name: str, version: str, payload_size: int) -> Path:
+    """Write a minimal but valid .tar.bz2 conda package with an incompressible payload."""
+    build = "0"
+    index_json = {
+        "name": name,
+        "version": version,
+        "build": build,
+        "build_number": 0,
+        "depends": [],
+        "license": "Apache-2.0",
+        "subdir": arch,
+        "timestamp": int(time.time() * 1000),
+    }
+    if arch == "noarch":
+        index_json["noarch"] = "generic"
+    payload_path = f"share/{name}/payload.bin"
+    paths_json = {
+        "paths": [{"_path": payload_path, "path_type": "hardlink", "size_in_bytes": payload_size}],
+        "paths_version": 1,
+    }
+    about_json = {"summary": f"Synthetic benchmark package {name}", "license": "Apache-2.0"}
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    package = dest_dir / f"{name}-{version}-{build}.tar.bz2"
+    with tarfile.open(package, "w:bz2") as tar:
+        add_member(tar, "info/index.json", json.dumps(index_json).encode())
+        add_member(tar, "info/paths.json", json.dumps(paths_json).encode())
+        add_member(tar, "info/about.json", json.dumps(about_json).encode())
+        add_member(tar, payload_path, os.urandom(payload_size))
+    return package
+
+
+def generate_channel(
+    dest: Path,
+    packages_per_arch: int,
+    payload_size: int,
+    architectures: list[str] = STANDARD_ARCHS,
+    prefix: str = "bench",
+    version: str = "1.0",
+) -> list[Path]:
+    """Generate packages_per_arch packages for each architecture in dest/<arch>/."""
+    packages = []
+    for arch in architectures:
+        for i in range(packages_per_arch):
+            packages.append(make_package(dest / arch, arch, f"{prefix}-{arch}-{i}", version, payload_size))
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic conda channel")
+    parser.add_argument("dest", type=Path, help="Directory to write the channel to")
+    parser.add_argument("--packages-per-arch", type=int, default=10)
+    parser.add_argument("--payload-size", type=int, default=64 * 1024, help="Payload bytes per package")
+    parser.add_argument("--arch", action="append", choices=STANDARD_ARCHS, help="Architectures (default: all)")
+    parser.add_argument("--prefix", default="bench", help="Package name prefix")
+    args = parser.parse_args()
+
+    packages = generate_channel(
+        args.dest, args.packages_per_arch, args.payload_size, args.arch or STANDARD_ARCHS, args.prefix
+    )
+    print(f"✓ Generated {len(packages)} package(s) in {args.dest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,52 @@
 
 import argparse
 import json
+import os
+import re
+import statistics
 import sys
 import time
+import uuid
 from datetime import datetime, timezone
 from urllib.error import HTTPError
+from urllib.parse import quote
 from urllib.request import Request, urlopen
 
 # Configuration
 LOCK_REPO = "ecmwf/reusable-workflows"
 LOCK_WORKFLOW = "conda-index-lock.yml"
 MAX_WAIT = 1800  # 30 minutes
-POLL_INTERVAL = 10  # seconds
+POLL_INTERVAL = 10  # seconds, while queued or when no history is available
+MAX_POLL_INTERVAL = 60  # seconds
+DISPATCH_TIMEOUT = 120  # seconds to wait for the dispatched run to appear
+DISPATCH_POLL_INTERVAL = 2  # seconds
+HISTORY_RUNS = 10  # successful runs used to estimate the expected duration
+COALESCED_ARTIFACT_PREFIX = "conda-index-coalesced-"  # marker uploaded by a run that took over our request
+COLLECT_JOB = "Collect Queued Requests"  # job of the lock workflow that takes over queued requests
+CLAIM_GRACE = 120  # seconds for a run to upload its claim markers once its collect job finished
 GITHUB_API = "https://api.github.com"
+WAITING_STATUSES = {"requested", "queued", "pending", "waiting"}
 
+# Must match the run-name of conda-index-lock.yml
+RUN_NAME_RE = re.compile(
+    r"^Conda index \[(?P<correlation_id>[0-9a-f]+)\] "
+    r"(?P<caller_repo>\S+)#(?P<caller_run_id>\d+) -> (?P<nexus_url>\S+)(?: \((?P<mode>[a-z+-]+)\))?: "
+    r"(?P<artifact_name>.+)$"
+)
 
-def gh_api_request(endpoint, method="GET", data=None, token=None):
+
+def index_mode(incremental, native_cache, skip_unchanged):
+    """Indexing options of a lock run, as shown in its run-name.
+
+    Only requests with the same mode can be indexed in one run.
+    """
+    mode = "incremental" if incremental else "native-cache" if native_cache else "full"
+    return mode + "+skip-unchanged" if skip_unchanged else mode
+
+
+def gh_api_request(endpoint, method="GET", data=None, token=None, api_url=GITHUB_API):
     """Make GitHub API request"""
-    url = f"{GITHUB_API}{endpoint}"
+    url = f"{api_url}{endpoint}"
     headers = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
@@ -41,6 +70,188 @@ def gh_api_request(endpoint, method="GET", data=None, token=None):
         raise Exception(f"GitHub API error {e.code}: {error_body}") from e
 
 
+def parse_time(value):
+    """Parse a GitHub API timestamp"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def find_dispatched_run(correlation_id, dispatched_at, token, api_url):
+    """Find the lock workflow run carrying our correlation ID in its name"""
+    created_after = datetime.fromtimestamp(dispatched_at - 60, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    deadline = time.monotonic() + DISPATCH_TIMEOUT
+
+    while time.monotonic() < deadline:
+        runs = gh_api_request(
+            f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/runs"
+            f"?event=workflow_dispatch&per_page=50&created={quote('>=' + created_after)}",
+            token=token,
+            api_url=api_url,
+        )
+        for run in runs.get("workflow_runs", []):
+            title = run.get("display_title") or run.get("name") or ""
+            if correlation_id in title:
+                return run["id"]
+        time.sleep(DISPATCH_POLL_INTERVAL)
+
+    return None
+
+
+def expected_duration(token, api_url):
+    """Estimate how long an indexing run takes from recent successful runs"""
+    runs = gh_api_request(
+        f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/runs?status=success&per_page={HISTORY_RUNS}",
+        token=token,
+        api_url=api_url,
+    )
+    durations = [
+        parse_time(run["updated_at"]) - parse_time(run["run_started_at"])
+        for run in runs.get("workflow_runs", [])
+        if run.get("run_started_at") and run.get("updated_at")
+    ]
+    return statistics.median(durations) if durations else None
+
+
+def next_poll_interval(running_for, expected, interval, tight_interval, tight_window):
+    """Decide how long to sleep before the next status check.
+
+    While the run is far from its expected finish we sleep until the tight
+    window starts, then poll every tight_interval seconds. Without history,
+    or once the run is well past its expected duration, back off exponentially.
+    """
+    if expected is None or running_for is None or running_for > expected * 1.5 + tight_window:
+        return min(int(interval * 1.5), MAX_POLL_INTERVAL)
+    until_window = expected - tight_window - running_for
+    if until_window > 0:
+        return max(min(until_window, MAX_POLL_INTERVAL), tight_interval)
+    return tight_interval
+
+
+def wait_for_completion(run_id, expected, token, api_url, tight_interval, tight_window):
+    """Wait for the lock workflow run to complete, returning its conclusion"""
+    start = time.monotonic()
+    interval = POLL_INTERVAL
+
+    while time.monotonic() - start < MAX_WAIT:
+        data = gh_api_request(f"/repos/{LOCK_REPO}/actions/runs/{run_id}", token=token, api_url=api_url)
+
+        status = data["status"]
+        conclusion = data.get("conclusion")
+        running_for = None
+        if status == "in_progress" and data.get("run_started_at"):
+            running_for = datetime.now(timezone.utc).timestamp() - parse_time(data["run_started_at"])
+
+        print(
+            f"[{datetime.now(timezone.utc).strftime('%H:%M:%S')}] "
+            f"Status: {status}, Conclusion: {conclusion} (elapsed: {int(time.monotonic() - start)}s)"
+        )
+
+        if status == "completed":
+            return conclusion
+
+        if running_for is None:
+            # Still queued behind another indexing run
+            interval = POLL_INTERVAL
+        else:
+            interval = next_poll_interval(running_for, expected, interval, tight_interval, tight_window)
+        time.sleep(interval)
+
+    return None
+
+
+def collect_finished_at(run_id, token, api_url):
+    """When the collect job of a lock run finished, or None if it has not"""
+    jobs = gh_api_request(f"/repos/{LOCK_REPO}/actions/runs/{run_id}/jobs", token=token, api_url=api_url)
+    for job in jobs.get("jobs", []):
+        if job["name"] == COLLECT_JOB and job["status"] == "completed" and job.get("completed_at"):
+            return parse_time(job["completed_at"])
+    return None
+
+
+def possible_claimers(run, nexus_url, mode, token, api_url):
+    """Find the lock runs that may take over our cancelled run.
+
+    Only runs for the same Nexus repository and mode whose collect job had not
+    finished when our run was created can claim it. Returns the IDs of those that have
+    not collected yet, and when the last of the others finished collecting.
+    """
+    created = parse_time(run["created_at"])
+    created_after = datetime.fromtimestamp(created - MAX_WAIT, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    runs = gh_api_request(
+        f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/runs"
+        f"?event=workflow_dispatch&per_page=100&created={quote('>=' + created_after)}",
+        token=token,
+        api_url=api_url,
+    )
+
+    collecting = []
+    collected_at = None
+    for other in runs.get("workflow_runs", []):
+        match = RUN_NAME_RE.match(other.get("display_title") or other.get("name") or "")
+        if other["id"] == run["id"] or not match or (match["nexus_url"], match["mode"]) != (nexus_url, mode):
+            continue
+        if other["status"] in WAITING_STATUSES:
+            collecting.append(other["id"])
+            continue
+        finished = collect_finished_at(other["id"], token, api_url)
+        if finished is None:
+            # Runs cancelled before they started never collect
+            if other["status"] != "completed":
+                collecting.append(other["id"])
+        elif finished >= created:
+            collected_at = max(collected_at or finished, finished)
+
+    return collecting, collected_at
+
+
+def find_coalescing_run(run, correlation_id, nexus_url, mode, token, api_url, timeout):
+    """Find the lock run that took over our cancelled run.
+
+    Waits while a lock run for the same Nexus repository and mode may still claim it,
+    and for up to CLAIM_GRACE seconds after the last one finished collecting.
+    Returns None as soon as no run can claim it anymore, or after timeout.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        artifacts = gh_api_request(
+            f"/repos/{LOCK_REPO}/actions/artifacts?name={COALESCED_ARTIFACT_PREFIX}{correlation_id}",
+            token=token,
+            api_url=api_url,
+        )
+        for artifact in artifacts.get("artifacts", []):
+            return artifact["workflow_run"]["id"]
+
+        collecting, collected_at = possible_claimers(run, nexus_url, mode, token, api_url)
+        if not collecting:
+            if collected_at is None:
+                return None
+            if datetime.now(timezone.utc).timestamp() >= collected_at + CLAIM_GRACE:
+                return None
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+def report_lock_timing(run_id, token, api_url):
+    """Print how long the lock run waited for the lock and how long it held it"""
+    run = gh_api_request(f"/repos/{LOCK_REPO}/actions/runs/{run_id}", token=token, api_url=api_url)
+    if not run.get("run_started_at"):
+        return
+    queued = parse_time(run["run_started_at"]) - parse_time(run["created_at"])
+    running = parse_time(run["updated_at"]) - parse_time(run["run_started_at"])
+    print(f"Waited {int(queued)}s for the lock, indexing took {int(running)}s")
+
+    summary_path = os.environ.get("GITHUB_STEP_SUMMARY")
+    if summary_path:
+        with open(summary_path, "a", encoding="utf-8") as f:
+            f.write(
+                "### Conda index lock\n\n"
+                "| Run | Waiting for lock | Indexing | Conclusion |\n"
+                "| --- | ---: | ---: | --- |\n"
+                f"| [{run_id}]({run['html_url']}) | {int(queued)}s | {int(running)}s | {run.get('conclusion')} |\n\n"
+            )
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--nexus-url", required=True)
@@ -49,7 +260,45 @@ def main():
     parser.add_argument("--caller-run-id", required=True)
     parser.add_argument("--caller-repo", required=True)
     parser.add_argument("--gh-pat", required=True)
+    parser.add_argument("--github-api", default=GITHUB_API, help="GitHub API base URL")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only index the new packages and merge them into the existing remote index",
+    )
+    parser.add_argument(
+        "--native-cache",
+        action="store_true",
+        help="Write cache.db rows for new packages directly and run conda_index only once",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Skip uploading files that Nexus confirms are unchanged",
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        type=float,
+        default=0,
+        help="Seconds the lock run waits for more queued requests to index with ours (0 disables coalescing)",
+    )
+    parser.add_argument(
+        "--tight-poll-interval",
+        type=float,
+        default=2,
+        help="Seconds between status checks close to the expected finish time",
+    )
+    parser.add_argument(
+        "--tight-poll-window",
+        type=float,
+        default=30,
+        help="Seconds before the expected finish time to start tight polling",
+    )
     args = parser.parse_args()
+    if args.incremental and args.native_cache:
+        parser.error("--incremental and --native-cache are mutually exclusive")
+
+    correlation_id = uuid.uuid4().hex
 
     print("=" * 50)
     print("Conda Index Lock Acquisition")
@@ -57,10 +306,12 @@ def main():
     print(f"Caller: {args.caller_repo} (run {args.caller_run_id})")
     print(f"Artifact: {args.artifact_name}")
     print(f"Nexus: {args.nexus_url}")
+    print(f"Correlation ID: {correlation_id}")
     print()
 
     # Dispatch workflow
     print("Dispatching lock workflow...")
+    dispatched_at = datetime.now(timezone.utc).timestamp()
     gh_api_request(
         f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/dispatches",
         method="POST",
@@ -72,70 +323,76 @@ def main():
                 "package_artifact_name": args.artifact_name,
                 "caller_run_id": args.caller_run_id,
                 "caller_repo": args.caller_repo,
+                "correlation_id": correlation_id,
+                "incremental": str(args.incremental).lower(),
+                "native_cache": str(args.native_cache).lower(),
+                "skip_unchanged": str(args.skip_unchanged).lower(),
+                "coalesce_window": f"{args.coalesce_window:g}",
             },
         },
         token=args.gh_pat,
+        api_url=args.github_api,
     )
 
-    time.sleep(5)  # Wait for workflow to appear
-
-    # Find the workflow run
-    start_time = datetime.now(timezone.utc).timestamp()
-    run_id = None
-
-    for _ in range(30):
-        runs = gh_api_request(
-            f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/runs?per_page=5", token=args.gh_pat
-        )
-
-        for run in runs.get("workflow_runs", []):
-            created = datetime.fromisoformat(run["created_at"].replace("Z", "+00:00")).timestamp()
-            if created >= start_time - 30:
-                run_id = run["id"]
-                break
-
-        if run_id:
-            break
-        time.sleep(1)
-
+    run_id = find_dispatched_run(correlation_id, dispatched_at, args.gh_pat, args.github_api)
     if not run_id:
         print("Error: Could not find dispatched workflow run")
         sys.exit(1)
 
     print(f"Found workflow run: {run_id}")
     print(f"URL: https://github.com/{LOCK_REPO}/actions/runs/{run_id}")
+
+    expected = expected_duration(args.gh_pat, args.github_api)
+    if expected is not None:
+        print(f"Expected indexing duration: {int(expected)}s (median of recent runs)")
     print()
 
     # Wait for completion
-    elapsed = 0
-    interval = POLL_INTERVAL
-
-    while elapsed < MAX_WAIT:
-        data = gh_api_request(f"/repos/{LOCK_REPO}/actions/runs/{run_id}", token=args.gh_pat)
+    started = time.monotonic()
+    conclusion = wait_for_completion(
+        run_id, expected, args.gh_pat, args.github_api, args.tight_poll_interval, args.tight_poll_window
+    )
 
-        status = data["status"]
-        conclusion = data.get("conclusion")
+    # A run cancelled while queued may have been coalesced into another lock run
+    holder_id = None
+    if conclusion == "cancelled":
+        if args.coalesce_window > 0:
+            print("\nLock run was cancelled, looking for a run that took over this request...")
+            run = gh_api_request(
+                f"/repos/{LOCK_REPO}/actions/runs/{run_id}", token=args.gh_pat, api_url=args.github_api
+            )
+            remaining = max(MAX_WAIT - (time.monotonic() - started), 0)
+            mode = index_mode(args.incremental, args.native_cache, args.skip_unchanged)
+            holder_id = find_coalescing_run(
+                run, correlation_id, args.nexus_url, mode, args.gh_pat, args.github_api, remaining
+            )
+        if not holder_id:
+            print(
+                "\n✗ Lock run was cancelled and no lock run took over this request. It was cancelled by hand, "
+                "or by the concurrency group in favour of a request for another Nexus repository "
+                "or with other indexing options. "
+                "Rerun this job to publish the packages."
+            )
+            sys.exit(1)
 
-        print(
-            f"[{datetime.now(timezone.utc).strftime('%H:%M:%S')}] "
-            f"Status: {status}, Conclusion: {conclusion} (elapsed: {elapsed}s)"
+        print(f"Coalesced into workflow run: {holder_id}")
+        print(f"URL: https://github.com/{LOCK_REPO}/actions/runs/{holder_id}")
+        conclusion = wait_for_completion(
+            holder_id, expected, args.gh_pat, args.github_api, args.tight_poll_interval, args.tight_poll_window
         )
 
-        if status == "completed":
-            print()
-            if conclusion == "success":
-                print("✓ Conda indexing successful")
-                sys.exit(0)
-            else:
-                print(f"✗ Failed with conclusion: {conclusion}")
-                sys.exit(1)
-
-        time.sleep(interval)
-        elapsed += interval
-        interval = min(int(interval * 1.5), 60)  # Exponential backoff, max 60s
+    if conclusion is None:
+        print(f"\n✗ Timeout after {MAX_WAIT}s")
+        sys.exit(1)
 
-    print(f"\n✗ Timeout after {MAX_WAIT}s")
-    sys.exit(1)
+    print()
+    report_lock_timing(holder_id or run_id, args.gh_pat, args.github_api)
+    if conclusion == "success":
+        print("✓ Conda indexing successful")
+        sys.exit(0)
+    else:
+        print(f"✗ Failed with conclusion: {conclusion}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
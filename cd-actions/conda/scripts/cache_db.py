@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Maintain conda_index cache.db files directly through sqlite3.
+
+conda_index stores the metadata of every indexed package in a per-subdir
+SQLite database. Writing the rows of new packages ourselves lets us skip the
+conda_index --update-cache passes, which re-read every archive in the subdir,
+and run a single --no-update-cache pass to render the index files.
+
+The schema and row helpers below are private to conda_index, so the lock
+workflow pins the conda-index version this module was tested against.
+"""
+
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+from conda_index.index.cache import _cache_post_install_details, _cache_recipe
+from conda_index.index.convert_cache import create as create_schema
+from conda_package_streaming.package_streaming import stream_conda_info
+
+INDEX_JSON = "info/index.json"
+ICON = "info/icon.png"
+PATHS = "info/paths.json"
+RECIPES = ["info/recipe/meta.yaml.rendered", "info/recipe/meta.yaml", "info/meta.yaml"]
+MEMBER_TO_TABLE = {
+    "info/about.json": "about",
+    "info/run_exports.json": "run_exports",
+    **{recipe: "recipe" for recipe in RECIPES},
+}
+
+# Same fields conda_index drops from index.json before caching it
+FILTERED_FIELDS = {
+    "arch",
+    "has_prefix",
+    "mtime",
+    "platform",
+    "ucs",
+    "requires_features",
+    "binstar",
+    "target-triplet",
+    "machine",
+    "operatingsystem",
+}
+
+BATCH_SIZE = 100
+CHUNK_SIZE = 1024 * 1024
+
+
+def read_package_metadata(package: Path) -> dict:
+    """Read the info/ members of a .tar.bz2 or .conda package that conda_index caches."""
+    wanted = {INDEX_JSON, ICON, PATHS, *MEMBER_TO_TABLE}
+    members = {}
+    with open(package, "rb") as f:
+        for tar, member in stream_conda_info(package.name, f):
+            if member.name not in wanted:
+                continue
+            reader = tar.extractfile(member)
+            if reader is not None:
+                members[member.name] = reader.read()
+
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(package, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            md5.update(chunk)
+            sha256.update(chunk)
+
+    stat = package.stat()
+    raw_index_json = json.loads(members[INDEX_JSON])
+    index_json = {
+        **{k: v for k, v in raw_index_json.items() if k not in FILTERED_FIELDS},
+        "md5": md5.hexdigest(),
+        "sha256": sha256.hexdigest(),
+        "size": stat.st_size,
+    }
+
+    tables = {"post_install": _cache_post_install_details(members.get(PATHS, ""))}
+    for name, table in MEMBER_TO_TABLE.items():
+        if name in members and table not in tables:
+            tables[table] = _cache_recipe(members[name]) if table == "recipe" else members[name].decode()
+
+    return {
+        "path": package.name,
+        "mtime": stat.st_mtime,
+        "index_json": index_json,
+        "tables": tables,
+        "icon": members.get(ICON) if raw_index_json.get("icon") else None,
+    }
+
+
+def insert_packages(db_path: Path, packages: list[Path]) -> int:
+    """Insert the cache rows of the given packages into cache.db, creating it if needed.
+
+    Stat rows are written for both the 'indexed' and the 'fs' stage, so that a
+    --no-update-cache conda_index pass treats the packages as already indexed.
+    Rows are written in batched transactions.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    inserted = 0
+
+    with sqlite3.connect(db_path) as conn:
+        create_schema(conn)
+
+        for start in range(0, len(packages), BATCH_SIZE):
+            batch = [read_package_metadata(package) for package in packages[start : start + BATCH_SIZE]]
+            with conn:
+                for table in ["about", "run_exports", "recipe", "post_install"]:
+                    conn.executemany(
+                        f"INSERT OR REPLACE INTO {table} (path, {table}) VALUES (?, json(?))",
+                        [(meta["path"], meta["tables"][table]) for meta in batch if table in meta["tables"]],
+                    )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO icon (path, icon_png) VALUES (?, ?)",
+                    [(meta["path"], meta["icon"]) for meta in batch if meta["icon"] is not None],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO index_json (path, index_json) VALUES (?, json(?))",
+                    [(meta["path"], json.dumps(meta["index_json"])) for meta in batch],
+                )
+                conn.executemany(
+                    """INSERT OR REPLACE INTO stat (stage, path, mtime, size, sha256, md5)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                    [
+                        (
+                            stage,
+                            meta["path"],
+                            meta["mtime"],
+                            meta["index_json"]["size"],
+                            meta["index_json"]["sha256"],
+                            meta["index_json"]["md5"],
+                        )
+                        for stage in ("indexed", "fs")
+                        for meta in batch
+                    ],
+                )
+            inserted += len(batch)
+
+    return inserted
+
+
+def compact(db_path: Path) -> tuple[int, int]:
+    """Refresh the query planner statistics and vacuum cache.db.
+
+    Returns the size of the database before and after compaction.
+    """
+    size_before = db_path.stat().st_size
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return size_before, db_path.stat().st_size
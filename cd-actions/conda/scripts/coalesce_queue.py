@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Collect conda index lock runs queued behind this one, so they can be indexed in a single pass"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from acquire_lock import (
+    COALESCED_ARTIFACT_PREFIX,
+    GITHUB_API,
+    LOCK_REPO,
+    LOCK_WORKFLOW,
+    MAX_WAIT,
+    RUN_NAME_RE,
+    WAITING_STATUSES,
+    gh_api_request,
+    index_mode,
+)
+
+
+def is_claimed(correlation_id, token, api_url):
+    """Check whether another lock run already took over this request"""
+    artifacts = gh_api_request(
+        f"/repos/{LOCK_REPO}/actions/artifacts?name={COALESCED_ARTIFACT_PREFIX}{correlation_id}",
+        token=token,
+        api_url=api_url,
+    )
+    return bool(artifacts.get("artifacts"))
+
+
+def collect_queued_requests(run_id, nexus_url, token, api_url):
+    """Find lock runs for the same Nexus repository that are waiting for the lock,
+    or were cancelled by the concurrency group before they could run"""
+    created_after = datetime.fromtimestamp(time.time() - MAX_WAIT, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    runs = gh_api_request(
+        f"/repos/{LOCK_REPO}/actions/workflows/{LOCK_WORKFLOW}/runs"
+        f"?event=workflow_dispatch&per_page=100&created={quote('>=' + created_after)}",
+        token=token,
+        api_url=api_url,
+    )
+
+    queued = []
+    for run in runs.get("workflow_runs", []):
+        if run["id"] == run_id:
+            continue
+        waiting = run["status"] in WAITING_STATUSES
+        cancelled = run["status"] == "completed" and run.get("conclusion") == "cancelled"
+        if not (waiting or cancelled):
+            continue
+
+        match = RUN_NAME_RE.match(run.get("display_title") or run.get("name") or "")
+        if not match or match["nexus_url"] != nexus_url:
+            continue
+        if is_claimed(match["correlation_id"], token, api_url):
+            continue
+
+        queued.append({"run_id": run["id"], "waiting": waiting, **match.groupdict()})
+
+    return queued
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run-id", required=True, type=int, help="ID of this lock workflow run")
+    parser.add_argument("--correlation-id", default="")
+    parser.add_argument("--nexus-url", required=True)
+    parser.add_argument("--artifact-name", required=True)
+    parser.add_argument("--caller-run-id", required=True)
+    parser.add_argument("--caller-repo", required=True)
+    parser.add_argument("--incremental", action="store_true", help="This run indexes incrementally")
+    parser.add_argument("--native-cache", action="store_true", help="This run writes cache.db rows directly")
+    parser.add_argument("--skip-unchanged", action="store_true", help="This run skips uploading unchanged files")
+    # Workflow number inputs may be rendered as floats, e.g. 15.0
+    parser.add_argument("--window", type=float, default=0, help="Seconds to wait for more requests to queue up")
+    parser.add_argument("--github-api", default=GITHUB_API, help="GitHub API base URL")
+    args = parser.parse_args()
+
+    token = os.environ["GH_TOKEN"]
+    batch = [
+        {
+            "correlation_id": args.correlation_id,
+            "caller_repo": args.caller_repo,
+            "caller_run_id": args.caller_run_id,
+            "artifact_name": args.artifact_name,
+        }
+    ]
+    absorbed = []
+    mode = index_mode(args.incremental, args.native_cache, args.skip_unchanged)
+
+    if args.window > 0:
+        print(f"Waiting {args.window:g}s for more requests to queue up...")
+        time.sleep(args.window)
+
+        for request in collect_queued_requests(args.run_id, args.nexus_url, token, args.github_api):
+            if request["mode"] != mode:
+                # Indexed with other options, it cannot share our conda_index pass
+                caller = f"{request['caller_repo']}#{request['caller_run_id']}"
+                if request["waiting"]:
+                    print(f"  Leaving {caller} queued, it uses mode {request['mode']} and this run {mode}")
+                else:
+                    print(
+                        f"::warning::Not coalescing cancelled request {caller} ({request['artifact_name']}), "
+                        f"it uses mode {request['mode']} and this run {mode}. Rerun its job to publish it."
+                    )
+                continue
+            if request["waiting"]:
+                # Cancel before claiming, so the run never starts indexing on its own
+                gh_api_request(
+                    f"/repos/{LOCK_REPO}/actions/runs/{request['run_id']}/cancel",
+                    method="POST",
+                    token=token,
+                    api_url=args.github_api,
+                )
+            print(f"  ✓ Coalescing {request['caller_repo']}#{request['caller_run_id']} ({request['artifact_name']})")
+            batch.append({k: request[k] for k in ["correlation_id", "caller_repo", "caller_run_id", "artifact_name"]})
+            absorbed.append(request["correlation_id"])
+
+    print(f"Indexing {len(batch)} request(s) in this run")
+
+    with open(os.environ["GITHUB_OUTPUT"], "a", encoding="utf-8") as f:
+        f.write(f"batch={json.dumps(batch)}\n")
+        f.write(f"absorbed={json.dumps(absorbed)}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Per-step metrics for rebuild_conda_index.py.
+
+Each step records wall and CPU time (including child processes such as
+conda_index), HTTP requests and bytes exchanged with Nexus, upload retries
+and the time spent in conda_index itself. The results can be written as a
+JSON file and as a GitHub step summary table.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+import requests
+
+
+@dataclass
+class StepMetrics:
+    """Resources used by a single step."""
+
+    title: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    conda_index_seconds: float = 0.0
+    http_requests: int = 0
+    retries: int = 0
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+
+
+def cpu_time() -> float:
+    """CPU time used by this process and its terminated children."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def format_size(size: int) -> str:
+    """Format a byte count for humans."""
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class Metrics:
+    """Collects StepMetrics. Counters are thread safe and attributed to the running step."""
+
+    def __init__(self):
+        self.steps: list[StepMetrics] = []
+        self._current: StepMetrics | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, title: str):
+        """Print a step header and record the resources the step used."""
+        print(f"\n=== {title} ===")
+        current = StepMetrics(title)
+        self.steps.append(current)
+        self._current = current
+        start_wall = time.perf_counter()
+        start_cpu = cpu_time()
+        try:
+            yield current
+        finally:
+            current.wall_seconds = time.perf_counter() - start_wall
+            current.cpu_seconds = cpu_time() - start_cpu
+            self._current = None
+
+    def _add(self, **counters) -> None:
+        with self._lock:
+            if self._current is None:
+                return
+            for name, value in counters.items():
+                setattr(self._current, name, getattr(self._current, name) + value)
+
+    def record_response(self, response: requests.Response, *args, **kwargs) -> None:
+        """requests response hook counting requests and the bytes they carried."""
+        downloaded = int(response.headers.get("Content-Length") or 0) if response.request.method != "HEAD" else 0
+        uploaded = int(response.request.headers.get("Content-Length") or 0)
+        self._add(http_requests=1, bytes_downloaded=downloaded, bytes_uploaded=uploaded)
+
+    def record_retries(self, count: int) -> None:
+        self._add(retries=count)
+
+    def record_conda_index(self, seconds: float) -> None:
+        self._add(conda_index_seconds=seconds)
+
+    def totals(self) -> StepMetrics:
+        total = StepMetrics("Total")
+        for step in self.steps:
+            for field in fields(StepMetrics)[1:]:
+                setattr(total, field.name, getattr(total, field.name) + getattr(step, field.name))
+        return total
+
+    def print_summary(self) -> None:
+        """Print a summary table of the recorded steps."""
+        rows = [*self.steps, self.totals()]
+        width = max(len(step.title) for step in rows)
+        print("\nStep metrics:")
+        print(f"  {'':<{width}}  {'wall':>9}  {'cpu':>9}  {'index':>9}  {'reqs':>5}  {'down':>10}  {'up':>10}")
+        for step in rows:
+            print(
+                f"  {step.title:<{width}}  {step.wall_seconds:8.2f}s  {step.cpu_seconds:8.2f}s  "
+                f"{step.conda_index_seconds:8.2f}s  {step.http_requests:>5}  "
+                f"{format_size(step.bytes_downloaded):>10}  {format_size(step.bytes_uploaded):>10}"
+            )
+
+    def write_json(self, path: Path, **extra) -> None:
+        """Write the recorded metrics, plus any extra top-level fields, as JSON."""
+        data = {
+            **extra,
+            "steps": [asdict(step) for step in self.steps],
+            "total": asdict(self.totals()),
+        }
+        path.write_text(json.dumps(data, indent=2))
+
+    def write_step_summary(self, heading: str) -> None:
+        """Append a markdown table to $GITHUB_STEP_SUMMARY, if running in GitHub Actions."""
+        summary_path = os.environ.get("GITHUB_STEP_SUMMARY")
+        if not summary_path:
+            return
+
+        lines = [
+            f"### {heading}",
+            "",
+            "| Step | Wall | CPU | conda_index | Requests | Retries | Downloaded | Uploaded |",
+            "| --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: |",
+        ]
+        for step in [*self.steps, self.totals()]:
+            title = f"**{step.title}**" if step.title == "Total" else step.title
+            lines.append(
+                f"| {title} | {step.wall_seconds:.2f}s | {step.cpu_seconds:.2f}s | "
+                f"{step.conda_index_seconds:.2f}s | {step.http_requests} | {step.retries} | "
+                f"{format_size(step.bytes_downloaded)} | {format_size(step.bytes_uploaded)} |"
+            )
+        with open(summary_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
@@ -1,17 +1,40 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import json
+import os
+import re
 import shutil
 import sqlite3
 import subprocess
 import sys
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+
+import cache_db
+from metrics import Metrics, format_size
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 STANDARD_ARCHS = ["linux-64", "osx-64", "osx-arm64", "win-64", "noarch"]
+PACKAGE_KEYS = ["packages", "packages.conda"]
+RETRY_BACKOFF = 2  # seconds, doubled after every failed attempt
+CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # from linux/fs.h
+UPLOAD_MANIFEST = ".cache/upload-manifest.json"
+CHECKSUM_HEADERS = {"X-Checksum-Sha256": "sha256", "X-Checksum-Sha1": "sha1", "X-Checksum-Md5": "md5"}
 
 
 def parse_auth(auth: str) -> tuple[str, str] | None:
@@ -24,38 +47,56 @@ def parse_auth(auth: str) -> tuple[str, str] | None:
     return None
 
 
-def fetch_cache_db(nexus_url: str, auth: str, arch: str, dest_dir: Path) -> bool:
-    """Fetch cache.db for a specific architecture from Nexus."""
+def create_session(auth_tuple: tuple[str, str] | None, max_connections: int) -> requests.Session:
+    """Create an HTTP session with a connection pool shared between worker threads."""
+    session = requests.Session()
+    session.auth = auth_tuple
+    adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_cache_db(session: requests.Session, nexus_url: str, arch: str, dest_dir: Path) -> bool:
+    """Fetch cache.db for a specific architecture from Nexus, streaming it to disk."""
     cache_url = urljoin(nexus_url, f"{arch}/.cache/cache.db")
     cache_path = dest_dir / arch / ".cache" / "cache.db"
     cache_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = cache_path.with_suffix(".db.part")
 
     print(f"Fetching {cache_url}...")
     try:
-        response = requests.get(cache_url, auth=parse_auth(auth), timeout=30)
-        response.raise_for_status()
-        cache_path.write_bytes(response.content)
-        print(f"  ✓ Downloaded cache.db for {arch}")
+        with session.get(cache_url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            with open(partial_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        partial_path.replace(cache_path)
+        print(f"  ✓ Downloaded cache.db for {arch} ({format_size(cache_path.stat().st_size)})")
         return True
     except requests.RequestException:
+        partial_path.unlink(missing_ok=True)
         print(f"  ℹ No existing cache.db for {arch} (will create new)")
         return False
 
 
-def discover_remote_architectures(nexus_url: str, auth_tuple: tuple[str, str] | None) -> list[str]:
+def discover_remote_architectures(session: requests.Session, nexus_url: str) -> list[str]:
     """Discover all available architectures in the remote Nexus repository."""
-    available_archs = []
 
-    print("Discovering available architectures in remote repository...")
-    for arch in STANDARD_ARCHS:
-        repodata_url = urljoin(nexus_url, f"{arch}/repodata.json")
+    def has_repodata(arch: str) -> bool:
         try:
-            response = requests.head(repodata_url, auth=auth_tuple, timeout=10)
-            if response.status_code == 200:
-                available_archs.append(arch)
-                print(f"  ✓ Found {arch}")
+            response = session.head(urljoin(nexus_url, f"{arch}/repodata.json"), timeout=10)
+            return response.status_code == 200
         except requests.RequestException:
-            pass
+            return False
+
+    print("Discovering available architectures in remote repository...")
+    with ThreadPoolExecutor(max_workers=len(STANDARD_ARCHS)) as executor:
+        found = list(executor.map(has_repodata, STANDARD_ARCHS))
+
+    available_archs = [arch for arch, exists in zip(STANDARD_ARCHS, found) if exists]
+    for arch in available_archs:
+        print(f"  ✓ Found {arch}")
 
     if not available_archs:
         print("  ℹ No existing architectures found in remote (new repository)")
@@ -63,13 +104,8 @@ def discover_remote_architectures(nexus_url: str, auth_tuple: tuple[str, str] |
     return available_archs
 
 
-def prepare_directory_structure(
-    packages: list[Path],
-    nexus_url: str,
-    auth_tuple: tuple[str, str] | None,
-    work_dir: Path,
-) -> list[str]:
-    """Prepare directory structure with cache.db files and packages."""
+def detect_package_architectures(packages: list[Path]) -> set[str]:
+    """Detect the architectures (subdirs) the given packages belong to."""
     package_architectures = set()
     for package in packages:
         arch = package.parent.name
@@ -82,29 +118,100 @@ def prepare_directory_structure(
         sys.exit(1)
 
     print(f"Detected architectures in packages: {sorted(package_architectures)}")
+    return package_architectures
 
-    remote_architectures = discover_remote_architectures(nexus_url, auth_tuple)
 
-    all_architectures = set(package_architectures) | set(remote_architectures)
-    print(f"Total architectures to process: {sorted(all_architectures)}")
+def reflink(src: Path, dest: Path) -> None:
+    """Clone a file with copy-on-write semantics (Linux FICLONE ioctl)."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    try:
+        with open(src, "rb") as s, open(dest, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        dest.unlink(missing_ok=True)
+        raise
+    shutil.copystat(src, dest)
 
-    print("\nFetching cache.db files...")
-    auth_str = f"{auth_tuple[0]}:{auth_tuple[1]}" if auth_tuple else ""
-    for arch in sorted(all_architectures):
-        fetch_cache_db(nexus_url, auth_str, arch, work_dir)
 
-    print("\nCopying packages...")
+STAGING_STRATEGIES = {
+    "hardlink": os.link,
+    "reflink": reflink,
+    "copy": shutil.copy2,
+}
+
+
+def stage_packages(packages: list[Path], work_dir: Path, strategy: str = "auto") -> None:
+    """Stage packages into their architecture subdirectory of the work dir.
+
+    In 'auto' mode each package is hardlinked, then reflinked, then copied,
+    whichever works first. Strategies that failed once are not retried.
+    """
+    candidates = list(STAGING_STRATEGIES) if strategy == "auto" else [strategy]
+    used = dict.fromkeys(STAGING_STRATEGIES, 0)
+
+    print("\nStaging packages...")
     for package in packages:
         arch = package.parent.name
         dest = work_dir / arch / package.name
         dest.parent.mkdir(parents=True, exist_ok=True)
-        print(f"  Copying {package.name} to {arch}/")
-        shutil.copy2(package, dest)
+        dest.unlink(missing_ok=True)
+
+        for name in list(candidates):
+            try:
+                STAGING_STRATEGIES[name](package, dest)
+            except OSError as e:
+                if name == candidates[-1]:
+                    print(f"Error: Could not stage {package.name} using {name}: {e}", file=sys.stderr)
+                    sys.exit(1)
+                print(f"  ℹ Cannot {name} {package.name} ({e.strerror or e}), falling back")
+                candidates.remove(name)
+                continue
+            used[name] += 1
+            print(f"  Staged {package.name} to {arch}/ ({name})")
+            break
+
+    summary = ", ".join(f"{count} {name}" for name, count in used.items() if count)
+    print(f"  Staged {len(packages)} package(s): {summary or 'none'}")
+
+
+def prepare_directory_structure(
+    packages: list[Path],
+    nexus_url: str,
+    session: requests.Session,
+    work_dir: Path,
+    max_connections: int = 8,
+    staging: str = "auto",
+) -> list[str]:
+    """Prepare directory structure with cache.db files and packages."""
+    package_architectures = detect_package_architectures(packages)
+
+    start = time.perf_counter()
+    remote_architectures = discover_remote_architectures(session, nexus_url)
+    print(f"  Discovery took {time.perf_counter() - start:.2f}s")
+
+    all_architectures = set(package_architectures) | set(remote_architectures)
+    print(f"Total architectures to process: {sorted(all_architectures)}")
+
+    print("\nFetching cache.db files...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        list(executor.map(lambda arch: fetch_cache_db(session, nexus_url, arch, work_dir), sorted(all_architectures)))
+    print(f"  Fetching cache.db files took {time.perf_counter() - start:.2f}s")
+
+    stage_packages(packages, work_dir, staging)
 
     return sorted(all_architectures)
 
 
-def run_conda_index(work_dir: Path, update_cache: bool = True) -> None:
+def prepare_incremental_structure(packages: list[Path], work_dir: Path, staging: str = "auto") -> list[str]:
+    """Prepare a work dir holding only the new packages, without any remote cache."""
+    package_architectures = detect_package_architectures(packages)
+    stage_packages(packages, work_dir, staging)
+    return sorted(package_architectures)
+
+
+def run_conda_index(work_dir: Path, update_cache: bool = True, metrics: Metrics | None = None) -> None:
     """Run conda_index with specified options."""
     cmd = [sys.executable, "-m", "conda_index", str(work_dir)]
     if update_cache:
@@ -114,7 +221,10 @@ def run_conda_index(work_dir: Path, update_cache: bool = True) -> None:
     cmd.extend(["--channeldata", "--no-rss"])
 
     print(f"Running: {' '.join(cmd)}")
+    start = time.perf_counter()
     result = subprocess.run(cmd, capture_output=True, text=True)
+    if metrics is not None:
+        metrics.record_conda_index(time.perf_counter() - start)
     if result.returncode != 0:
         print("Error running conda_index:", file=sys.stderr)
         print(result.stdout, file=sys.stderr)
@@ -164,78 +274,493 @@ def update_cache_db_stages(work_dir: Path, architectures: list[str]) -> None:
             print(f"    Updated {rows_affected} entries")
 
 
-def upload_to_nexus(
+def insert_new_packages(work_dir: Path, packages: list[Path]) -> None:
+    """Write cache.db rows for the new packages directly, without running conda_index.
+
+    The rows are written for both stages, so no update_cache_db_stages pass is needed.
+    """
+    by_arch: dict[str, list[Path]] = {}
+    for package in packages:
+        by_arch.setdefault(package.parent.name, []).append(work_dir / package.parent.name / package.name)
+
+    for arch, arch_packages in sorted(by_arch.items()):
+        db_path = work_dir / arch / ".cache" / "cache.db"
+        inserted = cache_db.insert_packages(db_path, arch_packages)
+        print(f"  ✓ Inserted {inserted} package(s) into {arch}/.cache/cache.db")
+
+
+def compact_cache_dbs(work_dir: Path, architectures: list[str]) -> None:
+    """Run ANALYZE and VACUUM on every cache.db before it is uploaded."""
+    print("Compacting cache.db files...")
+    for arch in architectures:
+        db_path = work_dir / arch / ".cache" / "cache.db"
+        if db_path.exists():
+            size_before, size_after = cache_db.compact(db_path)
+            print(f"  {arch}/.cache/cache.db: {format_size(size_before)} -> {format_size(size_after)}")
+
+
+def fetch_remote_json(session: requests.Session, nexus_url: str, path: str) -> dict | None:
+    """Fetch a JSON index file from Nexus, returning None if it does not exist."""
+    url = urljoin(nexus_url, path)
+    try:
+        response = session.get(url, timeout=60)
+    except requests.RequestException as e:
+        print(f"Error fetching {url}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if response.status_code == 404:
+        return None
+    if not response.ok:
+        print(f"Error fetching {url}: HTTP {response.status_code}", file=sys.stderr)
+        sys.exit(1)
+    return response.json()
+
+
+def merge_repodata(remote: dict, local: dict) -> dict:
+    """Merge newly indexed package entries into an existing per-arch index file.
+
+    Works for every per-arch file keyed by package filename (repodata.json,
+    current_repodata.json, repodata_from_packages.json, run_exports.json).
+    Note that current_repodata.json ends up as a superset of the latest
+    versions, which conda handles by falling back to repodata.json.
+    """
+    merged = dict(remote)
+    for key in PACKAGE_KEYS:
+        if key in remote or key in local:
+            merged[key] = {**remote.get(key, {}), **local.get(key, {})}
+    if "removed" in remote or "removed" in local:
+        new_names = set().union(*(local.get(key, {}) for key in PACKAGE_KEYS))
+        merged["removed"] = sorted(set(remote.get("removed", [])) - new_names)
+    return merged
+
+
+def merge_channeldata(remote: dict, local: dict) -> dict:
+    """Merge newly indexed package entries into an existing channeldata.json."""
+    merged = dict(remote)
+    packages = dict(remote.get("packages", {}))
+    for name, entry in local.get("packages", {}).items():
+        existing = packages.get(name)
+        if existing is None:
+            packages[name] = entry
+            continue
+        # Keep the metadata of the most recent build, but advertise all subdirs
+        newest = entry if entry.get("timestamp", 0) >= existing.get("timestamp", 0) else existing
+        packages[name] = {
+            **newest,
+            "subdirs": sorted(set(existing.get("subdirs", [])) | set(entry.get("subdirs", []))),
+        }
+    merged["packages"] = packages
+    merged["subdirs"] = sorted(set(remote.get("subdirs", [])) | set(local.get("subdirs", [])))
+    return merged
+
+
+def merge_cache_db(remote_db: Path, new_db: Path) -> None:
+    """Insert the rows of a freshly built cache.db into the remote cache.db."""
+    with sqlite3.connect(remote_db) as conn:
+        conn.execute("ATTACH DATABASE ? AS new", (str(new_db),))
+        tables = conn.execute("SELECT name, sql FROM new.sqlite_master WHERE type = 'table'").fetchall()
+        for table, create_sql in tables:
+            main_columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+            if not main_columns:
+                conn.execute(create_sql)
+                main_columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+            new_columns = {row[1] for row in conn.execute(f"PRAGMA new.table_info({table})")}
+            columns = ", ".join(c for c in main_columns if c in new_columns)
+            cursor = conn.execute(f"INSERT OR REPLACE INTO main.{table} ({columns}) SELECT {columns} FROM new.{table}")
+            print(f"    Merged {cursor.rowcount} rows into {table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE new")
+
+
+def file_listing_entry(path: Path) -> dict:
+    """Size, time and checksums of an index file, as listed in index.html."""
+    digests = file_digests(path, ("sha256", "md5"))
+    stat = path.stat()
+    return {"size": stat.st_size, "timestamp": int(stat.st_mtime), "sha256": digests["sha256"], "md5": digests["md5"]}
+
+
+def write_subdir_index_html(arch_dir: Path, channel_name: str) -> None:
+    """Regenerate the index.html of an architecture from its merged repodata.json.
+
+    Uses the templates of conda_index, so the listing looks like the one it
+    generates for a full rebuild. These are conda_index internals; if they are
+    missing, the generated listing (which only covers the new packages) is
+    dropped and the remote index.html is left as it is.
+    """
+    try:
+        from conda_index.index import _get_jinja2_environment
+    except ImportError as e:
+        print(f"    Warning: cannot regenerate {arch_dir.name}/index.html ({e}), keeping the remote one")
+        (arch_dir / "index.html").unlink(missing_ok=True)
+        return
+
+    repodata = json.loads((arch_dir / "repodata.json").read_text())
+    packages = {**repodata.get("packages", {}), **repodata.get("packages.conda", {})}
+    extra_paths = {
+        name: file_listing_entry(arch_dir / name)
+        for name in ("repodata.json", "repodata.json.bz2", "repodata_from_packages.json", "patch_instructions.json")
+        if (arch_dir / name).exists()
+    }
+    html = (
+        _get_jinja2_environment()
+        .get_template("subdir-index.html.j2")
+        .render(
+            title=f"{channel_name}/{arch_dir.name}",
+            packages=packages,
+            current_time=datetime.now(timezone.utc),
+            extra_paths=extra_paths,
+            html_dependencies=False,
+        )
+    )
+    (arch_dir / "index.html").write_text(html)
+    print(f"    ✓ Regenerated {arch_dir.name}/index.html ({len(packages)} packages)")
+
+
+def write_channel_index_html(work_dir: Path, channel_name: str) -> None:
+    """Regenerate the top-level index.html from the merged channeldata.json."""
+    try:
+        from conda_index.index import _make_channeldata_index_html
+    except ImportError as e:
+        print(f"  Warning: cannot regenerate index.html ({e}), keeping the remote one")
+        (work_dir / "index.html").unlink(missing_ok=True)
+        return
+
+    channeldata = json.loads((work_dir / "channeldata.json").read_text())
+    (work_dir / "index.html").write_text(_make_channeldata_index_html(channel_name, channeldata))
+    print("  ✓ Regenerated index.html")
+
+
+def merge_with_remote_index(
     work_dir: Path,
     nexus_url: str,
-    auth_tuple: tuple[str, str] | None,
-    architectures: list[str],
-    dry_run: bool = False,
-) -> None:
-    """Upload packages and index files to Nexus."""
-    print("\nUploading to Nexus...")
+    session: requests.Session,
+    package_architectures: list[str],
+) -> list[str]:
+    """Merge the index generated for the new packages into the remote index.
+
+    Returns the architectures whose index files need uploading.
+    """
+    remote_architectures = set(discover_remote_architectures(session, nexus_url))
+    upload_architectures = []
+    # conda_index names the channel after the work dir, use the Nexus repository instead
+    channel_name = urlparse(nexus_url).path.rstrip("/").rsplit("/", 1)[-1]
+
+    for arch_dir in sorted(p for p in work_dir.iterdir() if p.is_dir() and p.name in STANDARD_ARCHS):
+        arch = arch_dir.name
+        if arch not in package_architectures:
+            if arch in remote_architectures:
+                # conda_index creates empty subdirs (e.g. noarch); never overwrite existing ones
+                print(f"  Skipping {arch} (no new packages)")
+                shutil.rmtree(arch_dir)
+            else:
+                upload_architectures.append(arch)
+            continue
 
-    def upload_file(local_path: Path, remote_url: str) -> bool:
-        """Upload a single file to Nexus."""
-        if dry_run:
-            print(f"  [DRY RUN] Would upload {local_path.relative_to(work_dir)} to {remote_url}")
-            return True
+        upload_architectures.append(arch)
+        if arch not in remote_architectures:
+            print(f"  {arch} is new in remote, using generated index as-is")
+            continue
 
+        print(f"  Merging index files for {arch}")
+        for json_file in sorted(arch_dir.glob("*.json")):
+            remote = fetch_remote_json(session, nexus_url, f"{arch}/{json_file.name}")
+            if remote is None:
+                continue
+            local = json.loads(json_file.read_text())
+            json_file.write_text(json.dumps(merge_repodata(remote, local), indent=2, sort_keys=True))
+            print(f"    ✓ Merged {arch}/{json_file.name}")
+
+        new_db = arch_dir / ".cache" / "cache.db"
+        remote_dir = work_dir / ".remote"
+        if new_db.exists() and fetch_cache_db(session, nexus_url, arch, remote_dir):
+            remote_db = remote_dir / arch / ".cache" / "cache.db"
+            merge_cache_db(remote_db, new_db)
+            shutil.move(remote_db, new_db)
+
+        # The generated listing only covers the new packages
+        if (arch_dir / "repodata.json").exists():
+            write_subdir_index_html(arch_dir, channel_name)
+
+    shutil.rmtree(work_dir / ".remote", ignore_errors=True)
+
+    channeldata_file = work_dir / "channeldata.json"
+    if channeldata_file.exists():
+        remote = fetch_remote_json(session, nexus_url, "channeldata.json")
+        if remote is not None:
+            local = json.loads(channeldata_file.read_text())
+            channeldata_file.write_text(json.dumps(merge_channeldata(remote, local), indent=2, sort_keys=True))
+            print("  ✓ Merged channeldata.json")
+            write_channel_index_html(work_dir, channel_name)
+
+    return upload_architectures
+
+
+@dataclass
+class UploadResult:
+    """Outcome of uploading a single file."""
+
+    path: str
+    ok: bool
+    attempts: int
+    seconds: float
+    size: int = 0
+    error: str = ""
+    skipped: bool = False
+
+
+def upload_file(
+    session: requests.Session,
+    local_path: Path,
+    remote_url: str,
+    work_dir: Path,
+    retries: int,
+) -> UploadResult:
+    """Upload a single file to Nexus, retrying transient failures with exponential backoff."""
+    relative = str(local_path.relative_to(work_dir))
+    start = time.perf_counter()
+    error = ""
+
+    for attempt in range(1, retries + 2):
         try:
             with open(local_path, "rb") as f:
-                response = requests.put(remote_url, data=f, auth=auth_tuple, timeout=300)
-                response.raise_for_status()
-            print(f"  ✓ Uploaded {local_path.relative_to(work_dir)}")
-            return True
+                response = session.put(remote_url, data=f, timeout=300)
+            if response.ok:
+                print(f"  ✓ Uploaded {relative}")
+                return UploadResult(relative, True, attempt, time.perf_counter() - start, local_path.stat().st_size)
+            error = f"HTTP {response.status_code}"
+            if response.status_code < 500 and response.status_code != 429:
+                break
         except requests.RequestException as e:
-            print(f"  Error uploading {local_path.name}: {e}", file=sys.stderr)
-            return False
+            error = str(e)
 
-    print("\nUploading packages...")
-    for arch in architectures:
-        arch_dir = work_dir / arch
-        if not arch_dir.exists():
-            continue
+        if attempt <= retries:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            print(f"  ↻ Retrying {relative} in {delay}s ({error})")
+            time.sleep(delay)
+
+    print(f"  Error uploading {relative}: {error}", file=sys.stderr)
+    return UploadResult(relative, False, attempt, time.perf_counter() - start, error=error)
+
+
+def file_digests(path: Path, algorithms: tuple[str, ...] = ("sha256", "sha1", "md5")) -> dict[str, str]:
+    """Compute checksums of a file in a single pass, by default all those Nexus may report."""
+    hashes = {name: hashlib.new(name) for name in algorithms}
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            for h in hashes.values():
+                h.update(chunk)
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+def fetch_upload_manifest(session: requests.Session, nexus_url: str) -> dict[str, dict]:
+    """Fetch the sidecar manifest of previously uploaded files, if any."""
+    try:
+        response = session.get(urljoin(nexus_url, UPLOAD_MANIFEST), timeout=60)
+        if response.ok:
+            return response.json()
+    except (requests.RequestException, ValueError):
+        pass
+    print("  ℹ No upload manifest found, comparing against remote checksums")
+    return {}
+
+
+def publish_upload_manifest(session: requests.Session, nexus_url: str, manifest: dict[str, dict]) -> None:
+    """Upload the sidecar manifest. A failure only disables skipping on the next run."""
+    try:
+        response = session.put(
+            urljoin(nexus_url, UPLOAD_MANIFEST),
+            data=json.dumps(manifest, indent=2, sort_keys=True),
+            timeout=60,
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"  Warning: could not update {UPLOAD_MANIFEST}: {e}", file=sys.stderr)
+
+
+def remote_is_identical(
+    session: requests.Session,
+    remote_url: str,
+    local_path: Path,
+    sha256: str,
+    manifest_entry: dict | None,
+) -> bool:
+    """Check whether the remote copy of a file matches the local one.
+
+    Every file is checked with a HEAD request, so files deleted or replaced on
+    Nexus since the manifest was written are uploaded again. The remote size
+    must match, then a sha256 checksum header decides, or else the manifest
+    entry of the file. Without either, the other checksum headers or the ETag
+    are compared, computing the sha1 and md5 of the file only then.
+    """
+    try:
+        response = session.head(remote_url, timeout=30)
+    except requests.RequestException:
+        return False
+    if not response.ok:
+        return False
+
+    length = response.headers.get("Content-Length")
+    if length is not None and length != str(local_path.stat().st_size):
+        return False
+
+    remote_digests = {
+        algorithm: response.headers[header].lower()
+        for header, algorithm in CHECKSUM_HEADERS.items()
+        if header in response.headers
+    }
+    if "sha256" in remote_digests:
+        return remote_digests["sha256"] == sha256
+    if manifest_entry is not None and length is not None:
+        return manifest_entry.get("sha256") == sha256
+
+    # Nexus reports ETags such as "{SHA1{<hex>}}", so look for any known digest inside it
+    etag_digests = [d.lower() for d in re.findall(r"[0-9a-fA-F]{32,64}", response.headers.get("ETag", ""))]
+    if not remote_digests and not etag_digests:
+        return False
+    digests = {"sha256": sha256, **file_digests(local_path, ("sha1", "md5"))}
+    if remote_digests:
+        algorithm, digest = next(iter(remote_digests.items()))
+        return digest == digests[algorithm]
+    return any(d in digests.values() for d in etag_digests)
 
-        for package in list(arch_dir.glob("*.tar.bz2")) + list(arch_dir.glob("*.conda")):
-            remote_url = urljoin(nexus_url, f"{arch}/{package.name}")
-            if not upload_file(package, remote_url):
-                sys.exit(1)
 
-    print("\nUploading index files...")
+def collect_upload_phases(work_dir: Path, architectures: list[str]) -> list[tuple[str, list[Path]]]:
+    """Group the files to upload into phases that must complete in order.
 
+    Packages go first, then the per-arch index files, then the top-level
+    channeldata, so that clients never see an index pointing at missing files.
+    """
+    packages = []
+    arch_index_files = []
     for arch in architectures:
         arch_dir = work_dir / arch
         if not arch_dir.exists():
             continue
 
-        for json_file in arch_dir.glob("*.json"):
-            remote_url = urljoin(nexus_url, f"{arch}/{json_file.name}")
-            if not upload_file(json_file, remote_url):
-                sys.exit(1)
+        packages.extend(list(arch_dir.glob("*.tar.bz2")) + list(arch_dir.glob("*.conda")))
+        arch_index_files.extend(arch_dir.glob("*.json"))
+        for path in (arch_dir / "index.html", arch_dir / ".cache" / "cache.db"):
+            if path.exists():
+                arch_index_files.append(path)
+
+    channel_files = list(work_dir.glob("*.json"))
+    if (work_dir / "index.html").exists():
+        channel_files.append(work_dir / "index.html")
+
+    return [
+        ("packages", packages),
+        ("architecture index files", arch_index_files),
+        ("channel index files", channel_files),
+    ]
+
+
+def print_upload_report(results: list[UploadResult]) -> None:
+    """Print a per-file summary of the upload."""
+    print("\nUpload report:")
+    for result in results:
+        if result.skipped:
+            print(f"  = {result.path} (unchanged, skipped)")
+            continue
+        status = "✓" if result.ok else "✗"
+        line = f"  {status} {result.path} ({result.attempts} attempt(s), {result.seconds:.2f}s)"
+        if result.error:
+            line += f": {result.error}"
+        print(line)
+
+    failed = sum(1 for result in results if not result.ok)
+    sent = [result for result in results if result.ok and not result.skipped]
+    skipped = [result for result in results if result.skipped]
+    print(f"  {len(results) - failed} succeeded, {failed} failed")
+    print(
+        f"  Sent {len(sent)} file(s) ({format_size(sum(r.size for r in sent))}), "
+        f"skipped {len(skipped)} unchanged file(s) ({format_size(sum(r.size for r in skipped))})"
+    )
 
-        index_html = arch_dir / "index.html"
-        if index_html.exists():
-            remote_url = urljoin(nexus_url, f"{arch}/index.html")
-            if not upload_file(index_html, remote_url):
-                sys.exit(1)
 
-        cache_db = arch_dir / ".cache" / "cache.db"
-        if cache_db.exists():
-            remote_url = urljoin(nexus_url, f"{arch}/.cache/cache.db")
-            if not upload_file(cache_db, remote_url):
-                sys.exit(1)
+def upload_to_nexus(
+    work_dir: Path,
+    nexus_url: str,
+    session: requests.Session,
+    architectures: list[str],
+    dry_run: bool = False,
+    workers: int = 8,
+    retries: int = 3,
+    skip_unchanged: bool = False,
+    metrics: Metrics | None = None,
+) -> None:
+    """Upload packages and index files to Nexus, optionally skipping files that are unchanged remotely."""
+    print("\nUploading to Nexus...")
 
-    for json_file in work_dir.glob("*.json"):
-        remote_url = urljoin(nexus_url, json_file.name)
-        if not upload_file(json_file, remote_url):
-            sys.exit(1)
+    phases = collect_upload_phases(work_dir, architectures)
+    files = [path for _, phase_files in phases for path in phase_files]
+
+    def manifest_key(path: Path) -> str:
+        return path.relative_to(work_dir).as_posix()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        manifest = {}
+        unchanged = set()
+        if skip_unchanged:
+            print("\nChecking for unchanged files...")
+            sha256s = dict(zip(files, executor.map(lambda path: file_digests(path, ("sha256",))["sha256"], files)))
+            manifest = fetch_upload_manifest(session, nexus_url)
+            checks = {
+                path: executor.submit(
+                    remote_is_identical,
+                    session,
+                    urljoin(nexus_url, manifest_key(path)),
+                    path,
+                    sha256s[path],
+                    manifest.get(manifest_key(path)),
+                )
+                for path in files
+            }
+            unchanged = {path for path, future in checks.items() if future.result()}
+            print(f"  {len(unchanged)} of {len(files)} file(s) unchanged")
 
-    index_html = work_dir / "index.html"
-    if index_html.exists():
-        remote_url = urljoin(nexus_url, "index.html")
-        if not upload_file(index_html, remote_url):
-            sys.exit(1)
+        if dry_run:
+            for phase, phase_files in phases:
+                print(f"\nUploading {phase}...")
+                for path in phase_files:
+                    if path in unchanged:
+                        print(f"  [DRY RUN] Would skip unchanged {manifest_key(path)}")
+                    else:
+                        remote_url = urljoin(nexus_url, manifest_key(path))
+                        print(f"  [DRY RUN] Would upload {manifest_key(path)} to {remote_url}")
+            return
+
+        # Drop the manifest entries of files about to change before touching them,
+        # so an interrupted upload never leaves the manifest claiming stale content
+        changed_keys = {manifest_key(path) for path in files if path not in unchanged}
+        if changed_keys & manifest.keys():
+            manifest = {key: entry for key, entry in manifest.items() if key not in changed_keys}
+            publish_upload_manifest(session, nexus_url, manifest)
+
+        results = []
+        for phase, phase_files in phases:
+            print(f"\nUploading {phase}...")
+            futures = []
+            for path in phase_files:
+                if path in unchanged:
+                    results.append(UploadResult(manifest_key(path), True, 0, 0.0, path.stat().st_size, skipped=True))
+                    continue
+                remote_url = urljoin(nexus_url, manifest_key(path))
+                futures.append(executor.submit(upload_file, session, path, remote_url, work_dir, retries))
+            phase_results = [future.result() for future in futures]
+            results.extend(phase_results)
+            if metrics is not None:
+                metrics.record_retries(sum(max(result.attempts - 1, 0) for result in phase_results))
+
+            if not all(result.ok for result in phase_results):
+                print_upload_report(results)
+                print(f"\nError: Failed to upload {phase}, aborting before later phases", file=sys.stderr)
+                sys.exit(1)
+
+        if skip_unchanged:
+            for path in files:
+                manifest[manifest_key(path)] = {"sha256": sha256s[path], "size": path.stat().st_size}
+            publish_upload_manifest(session, nexus_url, manifest)
 
+    print_upload_report(results)
     print("\n✓ All files uploaded successfully!")
 
 
@@ -279,8 +804,54 @@ def main():
         action="store_true",
         help="Do not upload files to Nexus",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only index the new packages and merge them into the existing remote index",
+    )
+    parser.add_argument(
+        "--staging",
+        choices=["auto", *STAGING_STRATEGIES],
+        default="auto",
+        help="How to stage packages into the work dir (default: auto, tries hardlink, reflink then copy)",
+    )
+    parser.add_argument(
+        "--native-cache",
+        action="store_true",
+        help="Write cache.db rows for new packages directly and run conda_index only once",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=8,
+        help="Size of the HTTP connection pool used to talk to Nexus (default: 8)",
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=8,
+        help="Number of concurrent uploads to Nexus (default: 8)",
+    )
+    parser.add_argument(
+        "--upload-retries",
+        type=int,
+        default=3,
+        help="Number of retries for each failed upload (default: 3)",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Skip uploading files that Nexus confirms are unchanged, checked with a HEAD request per file",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="Write per-step metrics (time, CPU, requests, bytes) to this file as JSON",
+    )
 
     args = parser.parse_args()
+    if args.incremental and args.native_cache:
+        parser.error("--incremental and --native-cache are mutually exclusive")
 
     print(f"Searching for packages in: {args.package_dir}")
     if not args.package_dir.exists():
@@ -303,40 +874,119 @@ def main():
         work_dir.mkdir(parents=True, exist_ok=True)
         cleanup = False
     else:
-        work_dir = Path(tempfile.mkdtemp(prefix="conda-index-"))
+        # Prefer the filesystem of the package dir, so packages can be hardlinked
+        try:
+            work_dir = Path(tempfile.mkdtemp(prefix="conda-index-", dir=args.package_dir.resolve().parent))
+        except OSError:
+            work_dir = Path(tempfile.mkdtemp(prefix="conda-index-"))
         cleanup = not args.keep_work_dir
 
     auth_tuple = parse_auth(args.nexus_token or "")
+    session = create_session(auth_tuple, max(args.max_connections, args.upload_workers))
+    metrics = Metrics()
+    session.hooks["response"].append(metrics.record_response)
+    mode = "incremental" if args.incremental else "native-cache" if args.native_cache else "legacy"
+    succeeded = False
 
     try:
-        print(f"Working directory: {work_dir}\n")
-
-        print("=== Step 1: Preparing directory structure ===")
-        architectures = prepare_directory_structure(packages, nexus_url, auth_tuple, work_dir)
-
-        print("\n=== Step 2: First conda_index run (update cache) ===")
-        run_conda_index(work_dir, update_cache=True)
-
-        print("\n=== Step 3: Removing generated index files ===")
-        remove_index_files(work_dir)
-
-        print("\n=== Step 4: Second conda_index run (update cache) ===")
-        run_conda_index(work_dir, update_cache=True)
-
-        print("\n=== Step 5: Updating cache.db stages ===")
-        update_cache_db_stages(work_dir, architectures)
-
-        print("\n=== Step 6: Final conda_index run (no cache update) ===")
-        run_conda_index(work_dir, update_cache=False)
-
-        print("\n=== Step 7: Uploading to Nexus ===")
-        upload_to_nexus(work_dir, nexus_url, auth_tuple, architectures, args.dry_run)
+        print(f"Working directory: {work_dir}")
+
+        if args.incremental:
+            with metrics.step("Step 1: Preparing incremental directory structure"):
+                package_architectures = prepare_incremental_structure(packages, work_dir, args.staging)
+
+            with metrics.step("Step 2: conda_index run on new packages (update cache)"):
+                run_conda_index(work_dir, update_cache=True, metrics=metrics)
+
+            with metrics.step("Step 3: Merging with remote index"):
+                architectures = merge_with_remote_index(work_dir, nexus_url, session, package_architectures)
+
+            with metrics.step("Step 4: Uploading to Nexus"):
+                upload_to_nexus(
+                    work_dir,
+                    nexus_url,
+                    session,
+                    architectures,
+                    args.dry_run,
+                    args.upload_workers,
+                    args.upload_retries,
+                    args.skip_unchanged,
+                    metrics,
+                )
+        elif args.native_cache:
+            with metrics.step("Step 1: Preparing directory structure"):
+                architectures = prepare_directory_structure(
+                    packages, nexus_url, session, work_dir, args.max_connections, args.staging
+                )
+
+            with metrics.step("Step 2: Inserting new packages into cache.db"):
+                insert_new_packages(work_dir, packages)
+
+            with metrics.step("Step 3: conda_index run (no cache update)"):
+                run_conda_index(work_dir, update_cache=False, metrics=metrics)
+
+            with metrics.step("Step 4: Compacting cache.db"):
+                compact_cache_dbs(work_dir, architectures)
+
+            with metrics.step("Step 5: Uploading to Nexus"):
+                upload_to_nexus(
+                    work_dir,
+                    nexus_url,
+                    session,
+                    architectures,
+                    args.dry_run,
+                    args.upload_workers,
+                    args.upload_retries,
+                    args.skip_unchanged,
+                    metrics,
+                )
+        else:
+            with metrics.step("Step 1: Preparing directory structure"):
+                architectures = prepare_directory_structure(
+                    packages, nexus_url, session, work_dir, args.max_connections, args.staging
+                )
+
+            with metrics.step("Step 2: First conda_index run (update cache)"):
+                run_conda_index(work_dir, update_cache=True, metrics=metrics)
+
+            with metrics.step("Step 3: Removing generated index files"):
+                remove_index_files(work_dir)
+
+            with metrics.step("Step 4: Second conda_index run (update cache)"):
+                run_conda_index(work_dir, update_cache=True, metrics=metrics)
+
+            with metrics.step("Step 5: Updating cache.db stages"):
+                update_cache_db_stages(work_dir, architectures)
+
+            with metrics.step("Step 6: Final conda_index run (no cache update)"):
+                run_conda_index(work_dir, update_cache=False, metrics=metrics)
+
+            with metrics.step("Step 7: Uploading to Nexus"):
+                upload_to_nexus(
+                    work_dir,
+                    nexus_url,
+                    session,
+                    architectures,
+                    args.dry_run,
+                    args.upload_workers,
+                    args.upload_retries,
+                    args.skip_unchanged,
+                    metrics,
+                )
+
+        succeeded = True
+        metrics.print_summary()
 
         print(f"\n{'=' * 50}")
         print("SUCCESS: Conda index rebuilt and uploaded!")
         print(f"{'=' * 50}")
 
     finally:
+        session.close()
+        # Written on failure too, to see which step a failed publish got stuck in
+        if args.metrics_file:
+            metrics.write_json(args.metrics_file, mode=mode, succeeded=succeeded, packages=len(packages))
+        metrics.write_step_summary(f"Conda index metrics ({mode})")
         if cleanup:
             print(f"\nCleaning up working directory: {work_dir}")
             shutil.rmtree(work_dir)
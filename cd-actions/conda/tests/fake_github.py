@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Local stand-in for the GitHub Actions API used by the conda index lock scripts"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+COLLECT_JOB = "Collect Queued Requests"
+# Same format as the run-name of conda-index-lock.yml
+RUN_NAME = (
+    "Conda index [{correlation_id}] {caller_repo}#{caller_run_id} -> {nexus_url} ({mode}): {package_artifact_name}"
+)
+
+
+def run_mode(inputs: dict) -> str:
+    """The mode shown in the run-name, evaluated like the expression in conda-index-lock.yml."""
+
+    def enabled(name):
+        return str(inputs.get(name, "false")).lower() == "true"
+
+    mode = "incremental" if enabled("incremental") else "native-cache" if enabled("native_cache") else "full"
+    return mode + ("+skip-unchanged" if enabled("skip_unchanged") else "")
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@dataclass
+class FakeRun:
+    """A workflow run, stepping through states as its status is polled.
+
+    Every GET of the run returns the next entry of states, then keeps
+    returning the last one. A state is a (status, conclusion) pair.
+    """
+
+    id: int
+    display_title: str
+    inputs: dict
+    created_at: float
+    states: list[tuple[str, str | None]] = field(default_factory=lambda: [("completed", "success")])
+    run_started_at: float | None = None
+    updated_at: float | None = None
+    collect_finished: float | None = None  # when the collect job finished, None while it runs
+    polls: int = 0
+    hidden_lists: int = 0  # list requests that do not show the run yet
+
+    @property
+    def state(self) -> tuple[str, str | None]:
+        return self.states[min(self.polls, len(self.states) - 1)]
+
+    def to_json(self, repo: str) -> dict:
+        status, conclusion = self.state
+        started = self.run_started_at if status != "queued" else None
+        return {
+            "id": self.id,
+            "name": "Conda Index Lock",
+            "display_title": self.display_title,
+            "event": "workflow_dispatch",
+            "status": status,
+            "conclusion": conclusion,
+            "created_at": format_time(self.created_at),
+            "run_started_at": format_time(started) if started else None,
+            "updated_at": format_time(self.updated_at or time.time()),
+            "html_url": f"https://github.com/{repo}/actions/runs/{self.id}",
+        }
+
+    def jobs_json(self) -> list[dict]:
+        """The collect job, once the run started. Runs cancelled before they started have no jobs."""
+        status, _ = self.state
+        if status == "queued" or (status == "completed" and self.collect_finished is None):
+            return []
+        return [
+            {
+                "name": COLLECT_JOB,
+                "status": "completed" if self.collect_finished is not None else "in_progress",
+                "completed_at": format_time(self.collect_finished) if self.collect_finished is not None else None,
+            }
+        ]
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    """HTTP server answering the workflow dispatch, run and artifact endpoints.
+
+    Dispatched runs follow dispatch_states and stay invisible to the first
+    dispatch_lag list requests, like runs that take a while to show up in
+    the real API.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, dispatch_states=None, dispatch_lag=0):
+        super().__init__(address, FakeGitHubHandler)
+        self.dispatch_states = dispatch_states or [("completed", "success")]
+        self.dispatch_lag = dispatch_lag
+        self.lock = threading.Lock()
+        self.runs: dict[int, FakeRun] = {}
+        self.artifacts: dict[str, int] = {}  # artifact name -> run ID
+        self.dispatches: list[dict] = []
+        self.cancelled: list[int] = []
+        self.requests = Counter()
+        self._ids = itertools.count(1000)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_run(
+        self, inputs: dict, states=None, created_at=None, started_after=0.0, duration=None, collect_finished=None
+    ) -> FakeRun:
+        """Add a run as if it had been dispatched with inputs."""
+        with self.lock:
+            created = time.time() if created_at is None else created_at
+            run = FakeRun(
+                id=next(self._ids),
+                display_title=RUN_NAME.format_map({"correlation_id": "", **inputs, "mode": run_mode(inputs)}),
+                inputs=inputs,
+                created_at=created,
+                states=list(states or [("completed", "success")]),
+                run_started_at=created + started_after,
+                updated_at=created + started_after + duration if duration is not None else None,
+                collect_finished=collect_finished,
+            )
+            self.runs[run.id] = run
+            return run
+
+    def add_artifact(self, name: str, run_id: int) -> None:
+        with self.lock:
+            self.artifacts[name] = run_id
+
+    def record(self, endpoint: str) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    server: FakeGitHub
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body=None) -> None:
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self) -> tuple[list[str], dict]:
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return url.path.strip("/").split("/"), query
+
+    def do_GET(self):
+        parts, query = self.route()
+        repo = "/".join(parts[1:3])
+        if parts[3:5] == ["actions", "workflows"] and parts[6:] == ["runs"]:
+            self.server.record("list_runs")
+            self.send_json(200, {"workflow_runs": self.list_runs(repo, query)})
+        elif parts[3:5] == ["actions", "runs"] and parts[6:] == ["jobs"]:
+            self.server.record("list_jobs")
+            with self.server.lock:
+                run = self.server.runs.get(int(parts[5]))
+                jobs = run.jobs_json() if run is not None else None
+            if jobs is None:
+                self.send_json(404, {"message": "Not Found"})
+                return
+            self.send_json(200, {"total_count": len(jobs), "jobs": jobs})
+        elif parts[3:5] == ["actions", "runs"] and len(parts) == 6:
+            self.server.record("get_run")
+            with self.server.lock:
+                run = self.server.runs.get(int(parts[5]))
+                if run is None:
+                    self.send_json(404, {"message": "Not Found"})
+                    return
+                body = run.to_json(repo)
+                run.polls += 1
+            self.send_json(200, body)
+        elif parts[3:5] == ["actions", "artifacts"]:
+            self.server.record("list_artifacts")
+            with self.server.lock:
+                artifacts = [
+                    {"name": name, "workflow_run": {"id": run_id}}
+                    for name, run_id in self.server.artifacts.items()
+                    if name == query.get("name", name)
+                ]
+            self.send_json(200, {"total_count": len(artifacts), "artifacts": artifacts})
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+    def list_runs(self, repo: str, query: dict) -> list[dict]:
+        created_after = None
+        if query.get("created", "").startswith(">="):
+            created_after = datetime.fromisoformat(query["created"][2:].replace("Z", "+00:00")).timestamp()
+
+        runs = []
+        with self.server.lock:
+            # Newest first, like the real API
+            for run in sorted(self.server.runs.values(), key=lambda run: run.created_at, reverse=True):
+                if run.hidden_lists > 0:
+                    run.hidden_lists -= 1
+                    continue
+                body = run.to_json(repo)
+                if created_after is not None and run.created_at < created_after:
+                    continue
+                if query.get("status") == "success" and body["conclusion"] != "success":
+                    continue
+                runs.append(body)
+        return runs[: int(query.get("per_page", 30))]
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if parts[3:5] == ["actions", "workflows"] and parts[6:] == ["dispatches"]:
+            self.server.record("dispatch")
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.server.dispatches.append(payload)
+            run = self.server.add_run(payload["inputs"], self.server.dispatch_states)
+            run.hidden_lists = self.server.dispatch_lag
+            self.send_json(204)
+        elif parts[3:5] == ["actions", "runs"] and parts[6:] == ["cancel"]:
+            self.server.record("cancel")
+            self.server.cancelled.append(int(parts[5]))
+            self.send_json(202, {})
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+
+def start_server(port=0, dispatch_states=None, dispatch_lag=0) -> FakeGitHub:
+    """Start a FakeGitHub in a background thread."""
+    server = FakeGitHub(("127.0.0.1", port), dispatch_states, dispatch_lag)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake GitHub Actions API for acquire_lock.py")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--dispatch-lag", type=int, default=2, help="List requests before a dispatched run shows up")
+    parser.add_argument("--polls", type=int, default=5, help="Status checks a dispatched run stays in progress for")
+    args = parser.parse_args()
+
+    states = [("queued", None)] + [("in_progress", None)] * args.polls + [("completed", "success")]
+    server = start_server(args.port, states, args.dispatch_lag)
+    print(f"Serving a fake GitHub API at {server.url}, use it with acquire_lock.py --github-api {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
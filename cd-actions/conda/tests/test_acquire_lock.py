@@ -0,0 +1,305 @@
+"""Tests for acquire_lock.py against a local fake GitHub API.
+
+Sleeps go through a fake clock, which also drives the current time seen by
+acquire_lock.py, so the polling schedule can be checked without waiting.
+"""
+
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import acquire_lock  # noqa: E402
+from fake_github import start_server  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = float(int(time.time()))
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(clock.now, tz)
+
+    monkeypatch.setattr(acquire_lock, "time", clock)
+    monkeypatch.setattr(acquire_lock, "datetime", FakeDatetime)
+    return clock
+
+
+@pytest.fixture
+def github():
+    server = start_server()
+    yield server
+    server.shutdown()
+
+
+NEXUS_URL = "https://nexus.example/repository/conda/"
+
+
+def lock_inputs(correlation_id, caller_repo="ecmwf/eckit", caller_run_id="1"):
+    return {
+        "correlation_id": correlation_id,
+        "caller_repo": caller_repo,
+        "caller_run_id": caller_run_id,
+        "nexus_url": NEXUS_URL,
+        "package_artifact_name": f"{caller_run_id}-conda",
+    }
+
+
+def test_find_dispatched_run_matches_correlation_id(clock, github):
+    ours = github.add_run(lock_inputs("aaaa", "ecmwf/eckit", "1"), created_at=clock.now)
+    ours.hidden_lists = 2
+    # Dispatched by other repositories at the same time, and listed first
+    github.add_run(lock_inputs("bbbb", "ecmwf/atlas", "2"), created_at=clock.now + 1)
+    github.add_run(lock_inputs("cccc", "ecmwf/fckit", "3"), created_at=clock.now + 2)
+
+    run_id = acquire_lock.find_dispatched_run("aaaa", clock.now, None, github.url)
+
+    assert run_id == ours.id
+    assert github.requests["list_runs"] == 3
+    assert clock.sleeps == [acquire_lock.DISPATCH_POLL_INTERVAL] * 2
+
+
+def test_find_dispatched_run_ignores_runs_from_before_dispatch(clock, github):
+    github.add_run(lock_inputs("aaaa"), created_at=clock.now - 3600)
+
+    assert acquire_lock.find_dispatched_run("aaaa", clock.now, None, github.url) is None
+    assert sum(clock.sleeps) >= acquire_lock.DISPATCH_TIMEOUT
+
+
+def test_expected_duration_is_median_of_successful_runs(clock, github):
+    for duration in (100, 200, 600):
+        github.add_run(lock_inputs(f"{duration:04x}"), created_at=clock.now - 7200, duration=duration)
+    github.add_run(lock_inputs("ffff"), states=[("completed", "failure")], created_at=clock.now - 7200, duration=5)
+
+    assert acquire_lock.expected_duration(None, github.url) == 200
+
+
+def test_expected_duration_without_history(clock, github):
+    assert acquire_lock.expected_duration(None, github.url) is None
+
+
+@pytest.mark.parametrize(
+    "running_for, expected, interval, sleep",
+    [
+        (10, 300, 10, acquire_lock.MAX_POLL_INTERVAL),  # far from the expected finish, capped
+        (50, 100, 10, 20),  # sleep until the tight window starts
+        (69, 100, 10, 2),  # never sleep less than the tight interval
+        (90, 100, 10, 2),  # inside the tight window
+        (200, 100, 10, 15),  # overrunning, back off
+        (None, 100, 40, 60),  # no start time, back off up to the maximum
+        (50, None, 10, 15),  # no history, back off
+    ],
+)
+def test_next_poll_interval(running_for, expected, interval, sleep):
+    assert acquire_lock.next_poll_interval(running_for, expected, interval, 2, 30) == sleep
+
+
+def test_wait_for_completion_polls_tightly_around_expected_finish(clock, github):
+    states = [("in_progress", None)] * 6 + [("completed", "success")]
+    run = github.add_run(lock_inputs("aaaa"), states=states, created_at=clock.now - 50)
+
+    conclusion = acquire_lock.wait_for_completion(run.id, 100, None, github.url, 2, 30)
+
+    assert conclusion == "success"
+    # One long sleep until 30s before the expected finish, then tight polling
+    assert clock.sleeps == [20, 2, 2, 2, 2, 2]
+    assert github.requests["get_run"] == 7
+
+
+def test_wait_for_completion_backs_off_without_history(clock, github):
+    states = [("in_progress", None)] * 6 + [("completed", "failure")]
+    run = github.add_run(lock_inputs("aaaa"), states=states, created_at=clock.now)
+
+    conclusion = acquire_lock.wait_for_completion(run.id, None, None, github.url, 2, 30)
+
+    assert conclusion == "failure"
+    assert clock.sleeps == [15, 22, 33, 49, 60, 60]
+
+
+def test_wait_for_completion_polls_steadily_while_queued(clock, github):
+    states = [("queued", None)] * 3 + [("completed", "success")]
+    run = github.add_run(lock_inputs("aaaa"), states=states, created_at=clock.now)
+
+    assert acquire_lock.wait_for_completion(run.id, 100, None, github.url, 2, 30) == "success"
+    assert clock.sleeps == [acquire_lock.POLL_INTERVAL] * 3
+
+
+def test_wait_for_completion_times_out(clock, github):
+    run = github.add_run(lock_inputs("aaaa"), states=[("queued", None)], created_at=clock.now)
+
+    assert acquire_lock.wait_for_completion(run.id, None, None, github.url, 2, 30) is None
+    assert sum(clock.sleeps) >= acquire_lock.MAX_WAIT
+
+
+def run_main(monkeypatch, github, *extra_args):
+    monkeypatch.delenv("GITHUB_STEP_SUMMARY", raising=False)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "acquire_lock.py",
+            "--nexus-url",
+            NEXUS_URL,
+            "--nexus-token",
+            "user:token",
+            "--artifact-name",
+            "1-conda",
+            "--caller-run-id",
+            "1",
+            "--caller-repo",
+            "ecmwf/eckit",
+            "--gh-pat",
+            "token",
+            "--github-api",
+            github.url,
+            *extra_args,
+        ],
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        acquire_lock.main()
+    return exit_info.value.code
+
+
+def test_main_follows_the_dispatched_run(clock, monkeypatch, github):
+    github.dispatch_states = [("queued", None), ("in_progress", None), ("completed", "success")]
+    github.dispatch_lag = 1
+    github.add_run(lock_inputs("bbbb", "ecmwf/atlas", "2"), states=[("completed", "failure")], created_at=clock.now)
+
+    assert run_main(monkeypatch, github, "--incremental") == 0
+
+    [dispatch] = github.dispatches
+    correlation_id = dispatch["inputs"]["correlation_id"]
+    assert len(correlation_id) == 32
+    assert dispatch["inputs"]["incremental"] == "true"
+    assert dispatch["inputs"]["native_cache"] == "false"
+    assert dispatch["inputs"]["skip_unchanged"] == "false"
+    [ours] = [run for run in github.runs.values() if correlation_id in run.display_title]
+    assert ours.polls >= 3
+
+
+def test_main_fails_when_the_dispatched_run_fails(clock, monkeypatch, github):
+    github.dispatch_states = [("in_progress", None), ("completed", "failure")]
+
+    assert run_main(monkeypatch, github) == 1
+
+
+def find_claimer(clock, github, timeout=1800):
+    """Cancel run aaaa now and look for the run that took it over."""
+    run = github.add_run(lock_inputs("aaaa"), states=[("completed", "cancelled")], created_at=clock.now)
+    run = run.to_json(acquire_lock.LOCK_REPO)
+    return acquire_lock.find_coalescing_run(run, "aaaa", NEXUS_URL, "full", None, github.url, timeout)
+
+
+def test_find_coalescing_run_follows_claim(clock, github):
+    holder = github.add_run(lock_inputs("bbbb"), states=[("in_progress", None)], created_at=clock.now - 20)
+    github.add_artifact(f"{acquire_lock.COALESCED_ARTIFACT_PREFIX}aaaa", holder.id)
+
+    assert find_claimer(clock, github) == holder.id
+    assert clock.sleeps == []
+
+
+def test_find_coalescing_run_waits_for_runs_still_collecting(clock, github):
+    # Dispatched after ours, still waiting for the lock
+    github.add_run(lock_inputs("bbbb"), states=[("queued", None)], created_at=clock.now + 5)
+
+    assert find_claimer(clock, github, timeout=300) is None
+    assert sum(clock.sleeps) >= 300
+
+
+def test_find_coalescing_run_gives_up_shortly_after_collect(clock, github):
+    github.add_run(
+        lock_inputs("bbbb"), states=[("in_progress", None)], created_at=clock.now + 5, collect_finished=clock.now + 30
+    )
+
+    assert find_claimer(clock, github) is None
+    grace = 30 + acquire_lock.CLAIM_GRACE
+    assert grace <= sum(clock.sleeps) < grace + 2 * acquire_lock.POLL_INTERVAL
+
+
+@pytest.mark.parametrize(
+    "nexus_url, state, offset, collect_finished",
+    [
+        # Cancelled ours in favour of another Nexus repository
+        ("https://nexus.example/repository/other/", ("in_progress", None), 5, None),
+        # Collected before ours was dispatched
+        (NEXUS_URL, ("in_progress", None), -60, -40),
+        # Cancelled before it started
+        (NEXUS_URL, ("completed", "cancelled"), 5, None),
+    ],
+)
+def test_find_coalescing_run_fails_fast_without_possible_claimer(
+    clock, github, nexus_url, state, offset, collect_finished
+):
+    github.add_run(
+        {**lock_inputs("bbbb"), "nexus_url": nexus_url},
+        states=[state],
+        created_at=clock.now + offset,
+        collect_finished=clock.now + collect_finished if collect_finished is not None else None,
+    )
+
+    assert find_claimer(clock, github) is None
+    assert clock.sleeps == []
+
+
+def test_find_coalescing_run_ignores_runs_with_another_mode(clock, github):
+    github.add_run({**lock_inputs("bbbb"), "incremental": "true"}, states=[("queued", None)], created_at=clock.now + 5)
+
+    assert find_claimer(clock, github) is None
+    assert clock.sleeps == []
+
+
+@pytest.mark.parametrize(
+    "flags",
+    [
+        {},
+        {"incremental": "true"},
+        {"native_cache": "true"},
+        {"incremental": "true", "native_cache": "true", "skip_unchanged": "true"},
+        {"native_cache": "true", "skip_unchanged": "true"},
+    ],
+)
+def test_index_mode_matches_run_name(github, flags):
+    run = github.add_run({**lock_inputs("aaaa"), **flags})
+    names = ["incremental", "native_cache", "skip_unchanged"]
+    mode = acquire_lock.index_mode(*(flags.get(name) == "true" for name in names))
+
+    assert acquire_lock.RUN_NAME_RE.match(run.display_title)["mode"] == mode
+
+
+def test_main_fails_fast_when_cancelled_without_coalescing(clock, monkeypatch, github):
+    github.dispatch_states = [("queued", None), ("completed", "cancelled")]
+
+    assert run_main(monkeypatch, github) == 1
+    assert github.dispatches[0]["inputs"]["coalesce_window"] == "0"
+    assert github.requests["list_artifacts"] == 0
+    assert sum(clock.sleeps) == acquire_lock.POLL_INTERVAL
+
+
+def test_main_fails_fast_when_nobody_claims_the_cancelled_run(clock, monkeypatch, github):
+    github.dispatch_states = [("queued", None), ("completed", "cancelled")]
+
+    assert run_main(monkeypatch, github, "--coalesce-window", "15") == 1
+    assert github.requests["list_artifacts"] == 1
+    assert sum(clock.sleeps) == acquire_lock.POLL_INTERVAL
@@ -0,0 +1,154 @@
+"""Tests for coalesce_queue.py against a local fake GitHub API."""
+
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import coalesce_queue  # noqa: E402
+from acquire_lock import COALESCED_ARTIFACT_PREFIX  # noqa: E402
+from fake_github import start_server  # noqa: E402
+
+NEXUS_URL = "https://nexus.example/repository/conda/"
+OTHER_NEXUS_URL = "https://nexus.example/repository/other/"
+WAITING = [("queued", None)]
+CANCELLED = [("completed", "cancelled")]
+
+
+@pytest.fixture
+def github():
+    server = start_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(coalesce_queue, "time", SimpleNamespace(time=time.time, sleep=sleeps.append))
+    return sleeps
+
+
+def lock_inputs(correlation_id, caller_repo="ecmwf/eckit", caller_run_id="1", nexus_url=NEXUS_URL, **flags):
+    return {
+        "correlation_id": correlation_id,
+        "caller_repo": caller_repo,
+        "caller_run_id": caller_run_id,
+        "nexus_url": nexus_url,
+        "package_artifact_name": f"{caller_run_id}-conda",
+        **flags,
+    }
+
+
+def run_main(monkeypatch, tmp_path, github, *extra_args):
+    output = tmp_path / "github_output"
+    monkeypatch.setenv("GH_TOKEN", "token")
+    monkeypatch.setenv("GITHUB_OUTPUT", str(output))
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "coalesce_queue.py",
+            "--run-id",
+            "1",
+            "--correlation-id",
+            "aaaa",
+            "--nexus-url",
+            NEXUS_URL,
+            "--artifact-name",
+            "1-conda",
+            "--caller-run-id",
+            "1",
+            "--caller-repo",
+            "ecmwf/eckit",
+            "--github-api",
+            github.url,
+            *extra_args,
+        ],
+    )
+    coalesce_queue.main()
+    return dict(line.split("=", 1) for line in output.read_text().splitlines())
+
+
+def test_collect_queued_requests_finds_waiting_and_cancelled_runs(github):
+    ours = github.add_run(lock_inputs("aaaa"), states=[("in_progress", None)])
+    waiting = github.add_run(lock_inputs("bbbb", "ecmwf/atlas", "2"), states=WAITING)
+    cancelled = github.add_run(lock_inputs("cccc", "ecmwf/fckit", "3", incremental="true"), states=CANCELLED)
+    github.add_run(lock_inputs("dddd", "ecmwf/metkit", "4"), states=[("completed", "success")])
+
+    requests = coalesce_queue.collect_queued_requests(ours.id, NEXUS_URL, None, github.url)
+
+    assert sorted((request["run_id"], request["waiting"], request["mode"]) for request in requests) == [
+        (waiting.id, True, "full"),
+        (cancelled.id, False, "incremental"),
+    ]
+    [atlas] = [request for request in requests if request["run_id"] == waiting.id]
+    assert atlas["caller_repo"] == "ecmwf/atlas"
+    assert atlas["caller_run_id"] == "2"
+    assert atlas["artifact_name"] == "2-conda"
+
+
+def test_collect_queued_requests_skips_other_nexus_repositories(github):
+    github.add_run(lock_inputs("bbbb", nexus_url=OTHER_NEXUS_URL), states=WAITING)
+    github.add_run(lock_inputs("cccc", nexus_url=OTHER_NEXUS_URL), states=CANCELLED)
+
+    assert coalesce_queue.collect_queued_requests(1, NEXUS_URL, None, github.url) == []
+
+
+def test_collect_queued_requests_skips_claimed_runs(github):
+    holder = github.add_run(lock_inputs("bbbb"), states=[("in_progress", None)])
+    github.add_run(lock_inputs("cccc"), states=CANCELLED)
+    github.add_artifact(f"{COALESCED_ARTIFACT_PREFIX}cccc", holder.id)
+
+    assert coalesce_queue.collect_queued_requests(1, NEXUS_URL, None, github.url) == []
+
+
+def test_main_without_window_indexes_only_its_own_request(monkeypatch, tmp_path, github, sleeps):
+    github.add_run(lock_inputs("bbbb"), states=WAITING)
+
+    outputs = run_main(monkeypatch, tmp_path, github)
+
+    assert json.loads(outputs["batch"]) == [
+        {"correlation_id": "aaaa", "caller_repo": "ecmwf/eckit", "caller_run_id": "1", "artifact_name": "1-conda"}
+    ]
+    assert json.loads(outputs["absorbed"]) == []
+    assert sleeps == []
+    assert github.requests["list_runs"] == 0
+
+
+def test_main_cancels_waiting_runs_it_coalesces(monkeypatch, tmp_path, github, sleeps):
+    waiting = github.add_run(lock_inputs("bbbb", "ecmwf/atlas", "2"), states=WAITING)
+    github.add_run(lock_inputs("cccc", "ecmwf/fckit", "3"), states=CANCELLED)
+    github.add_run(lock_inputs("dddd", "ecmwf/metkit", "4", nexus_url=OTHER_NEXUS_URL), states=WAITING)
+
+    outputs = run_main(monkeypatch, tmp_path, github, "--window", "15.0")
+
+    assert sleeps == [15]
+    # Already cancelled runs are claimed without cancelling them again
+    assert github.cancelled == [waiting.id]
+    assert sorted(json.loads(outputs["absorbed"])) == ["bbbb", "cccc"]
+    batch = json.loads(outputs["batch"])
+    assert batch[0]["correlation_id"] == "aaaa"
+    assert sorted((request["caller_repo"], request["artifact_name"]) for request in batch[1:]) == [
+        ("ecmwf/atlas", "2-conda"),
+        ("ecmwf/fckit", "3-conda"),
+    ]
+
+
+def test_main_only_coalesces_requests_with_the_same_mode(monkeypatch, tmp_path, github, sleeps, capsys):
+    github.add_run(lock_inputs("bbbb", "ecmwf/atlas", "2"), states=WAITING)
+    github.add_run(lock_inputs("cccc", "ecmwf/fckit", "3", native_cache="true"), states=CANCELLED)
+    same = github.add_run(lock_inputs("dddd", "ecmwf/metkit", "4", incremental="true"), states=WAITING)
+
+    outputs = run_main(monkeypatch, tmp_path, github, "--window", "5", "--incremental")
+
+    assert github.cancelled == [same.id]
+    assert json.loads(outputs["absorbed"]) == ["dddd"]
+    out = capsys.readouterr().out
+    assert "Leaving ecmwf/atlas#2 queued, it uses mode full and this run incremental" in out
+    assert "::warning::Not coalescing cancelled request ecmwf/fckit#3 (3-conda)" in out
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Benchmark README.txt generation from large synthetic build logs.
+
+Synthetic logs mimic a staged build: coloured compiler output with ecbuild
+package lines and stage markers sprinkled in. Each log is processed by the
+former inline implementation of finalize.jinja, which read the whole log into
+memory, and by scripts/readme.py, plain and gzip compressed. Every run happens
+in a child process so its peak RSS can be measured. The READMEs of both
+implementations are checked to be identical, and timings are written as JSON.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import readme  # noqa: E402
+
+PACKAGES = ["ecbuild", "eckit", "fckit", "eccodes", "metkit", "fdb5", "atlas", "odc", "multio", "mir"]
+STAGES = ["dependencies", "main", "tests"]
+
+
+def legacy_readme(build_log: Path, install_prefix: Path) -> list[str]:
+    """README generation as formerly inlined in finalize.jinja."""
+    with open(build_log, "r", errors="replace") as f:
+        log_content = f.read()
+    log_content = re.sub(r"\x1b\[[0-9;]*m", "", log_content)
+
+    seen = set()
+    readme_lines = []
+    current_stage = None
+    for line in log_content.splitlines():
+        if "::STAGE_MARKER::" in line:
+            stage_match = re.search(r"::STAGE_MARKER::(\S+)", line)
+            if stage_match:
+                current_stage = stage_match.group(1)
+            continue
+        if re.match(r"^--\s+\[", line):
+            match = re.search(r"\[([^\]]+)\]", line)
+            if match:
+                pkg = match.group(1)
+                if pkg not in seen:
+                    seen.add(pkg)
+                    readme_lines.append(line.strip())
+        elif line.startswith("-- system"):
+            system_line = line.strip()
+            if current_stage:
+                system_line += f" [stage: {current_stage}]"
+            readme_lines.append(system_line)
+
+    if readme_lines:
+        (install_prefix / "README.txt").write_text("\n".join(readme_lines) + "\n")
+    return readme_lines
+
+
+def streaming_readme(build_log: Path, install_prefix: Path) -> list[str]:
+    with readme.open_log(str(build_log)) as lines:
+        readme_lines, manifest = readme.scan_log(lines)
+    (install_prefix / "build-manifest.json").write_text(json.dumps(manifest, indent=2))
+    if readme_lines:
+        (install_prefix / "README.txt").write_text("\n".join(readme_lines) + "\n")
+    return readme_lines
+
+
+IMPLEMENTATIONS = {"legacy": legacy_readme, "streaming": streaming_readme}
+
+
+def write_synthetic_log(path: Path, size_mib: int, seed: int = 0) -> None:
+    """Write a build log of about size_mib MiB, gzip compressed if path ends in .gz."""
+    rng = random.Random(seed)
+    target = size_mib * 1024 * 1024
+    opener = gzip.open if path.suffix == ".gz" else open
+    written = 0
+    stage = 0
+    with opener(path, "wt") as f:
+        while written < target:
+            if rng.random() < 0.0005 and stage < len(STAGES):
+                chunk = f"::STAGE_MARKER::{STAGES[stage]}\n"
+                stage += 1
+            elif rng.random() < 0.002:
+                package = rng.choice(PACKAGES)
+                chunk = f"-- [{package}] ({rng.randint(1, 9)}.{rng.randint(0, 40)}.0) [{rng.getrandbits(28):07x}]\n"
+            elif rng.random() < 0.0005:
+                chunk = "-- system: Linux-5.14 x86_64\n"
+            else:
+                percent = rng.randint(0, 100)
+                target_name = rng.choice(PACKAGES)
+                chunk = (
+                    f"\x1b[32m[{percent:3d}%] \x1b[0mBuilding CXX object src/{target_name}/CMakeFiles/"
+                    f"{target_name}.dir/source_{rng.randint(0, 99999)}.cc.o\n"
+                )
+            f.write(chunk)
+            written += len(chunk)
+
+
+def run_child(implementation: str, build_log: Path, install_prefix: Path) -> dict:
+    """Run one implementation in a fresh process, reporting its duration and peak RSS."""
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", implementation, str(build_log), str(install_prefix)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def child_main(implementation: str, build_log: str, install_prefix: str) -> None:
+    start = time.perf_counter()
+    lines = IMPLEMENTATIONS[implementation](Path(build_log), Path(install_prefix))
+    seconds = time.perf_counter() - start
+    peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": seconds, "peak_rss_kib": peak_rss_kib, "entries": len(lines)}))
+
+
+def summarize(runs: list[dict]) -> dict:
+    seconds = [run["seconds"] for run in runs]
+    return {
+        "median_s": statistics.median(seconds),
+        "min_s": min(seconds),
+        "peak_rss_mib": max(run["peak_rss_kib"] for run in runs) / 1024,
+        "entries": runs[0]["entries"],
+        "samples": len(runs),
+    }
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        child_main(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark README.txt generation from HPC build logs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500], help="Log sizes in MiB")
+    parser.add_argument("--repeats", type=int, default=3, help="Measurements per log and implementation")
+    parser.add_argument("--output", type=Path, default=Path("bench-readme.json"), help="JSON results file")
+    args = parser.parse_args()
+
+    scratch = Path(tempfile.mkdtemp(prefix="hpc-readme-bench-"))
+    results = {}
+    try:
+        for size in args.sizes:
+            print(f"\n=== {size} MiB log ===")
+            plain_log = scratch / f"build-{size}.log"
+            write_synthetic_log(plain_log, size)
+            gzip_log = scratch / f"build-{size}.log.gz"
+            write_synthetic_log(gzip_log, size)
+
+            readmes = {}
+            results[f"{size}MiB"] = {}
+            for mode, implementation, log in [
+                ("legacy", "legacy", plain_log),
+                ("streaming", "streaming", plain_log),
+                ("streaming-gzip", "streaming", gzip_log),
+            ]:
+                install_prefix = scratch / mode
+                install_prefix.mkdir(exist_ok=True)
+                runs = [run_child(implementation, log, install_prefix) for _ in range(args.repeats)]
+                results[f"{size}MiB"][mode] = summarize(runs)
+                readmes[mode] = (install_prefix / "README.txt").read_text()
+                timing = results[f"{size}MiB"][mode]
+                print(f"  ✓ {mode}: {timing['median_s']:.2f} s median, {timing['peak_rss_mib']:.0f} MiB peak RSS")
+
+            if len(set(readmes.values())) != 1:
+                print("  ✗ READMEs differ between implementations")
+                sys.exit(1)
+            print("  ✓ READMEs are identical")
+            for path in (plain_log, gzip_log):
+                os.remove(path)
+    finally:
+        shutil.rmtree(scratch)
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": args.repeats,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Benchmark the start up of generate_template.py with and without precompiled templates.
+
+Template loading is timed in process for every job template, and
+generate_template.py is run end to end with canned inputs, once rendering
+from source and once loading templates compiled into a tool cache. Timings
+are written as JSON.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from job_templates import TEMPLATE_DIR, compile_templates, create_environment, templates_digest  # noqa: E402
+
+# Inputs of a typical build with a few dependencies, as set by action.yml and parse_config.py
+CANNED_INPUTS = {
+    "GITHUB_ACTION_PATH": str(SCRIPTS_DIR.parent),
+    "GITHUB_REPOSITORY": "ecmwf/mypkg",
+    "INPUT_NAME": "gnu-14.2.0",
+    "INPUT_REF_NAME": "develop",
+    "INPUT_DEPENDENCIES": "ecmwf/ecbuild@develop\necmwf/eckit@develop\necmwf/eccodes@develop needs: ecbuild",
+    "INPUT_CMAKE_OPTIONS": "-DENABLE_TESTS=ON",
+    "STEP_CONFIG_COMPILER": "gnu-14.2.0",
+    "STEP_CONFIG_COMPILER_MODULES": "prgenv/gnu,gcc/14.2.0",
+    "STEP_CONFIG_INSTALL_PREFIX": "/usr/local/apps/mypkg/develop",
+    "STEP_CONFIG_BASE_INSTALL_PREFIX": "/usr/local/apps/mypkg/develop",
+}
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "samples": len(samples),
+    }
+
+
+def time_template_loading(cache_dir: Path | None, repeats: int) -> dict:
+    """Time creating an environment and loading every template, as a fresh process would."""
+    names = sorted(path.name for path in TEMPLATE_DIR.glob("*.jinja"))
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        env = create_environment(TEMPLATE_DIR, cache_dir)
+        for name in names:
+            env.get_template(name)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def time_generate_template(tool_cache: Path | None, repeats: int, scratch: Path) -> dict:
+    """Time generate_template.py end to end in a child process."""
+    env = {**os.environ, **CANNED_INPUTS}
+    env.pop("RUNNER_TOOL_CACHE", None)
+    if tool_cache is not None:
+        env["RUNNER_TOOL_CACHE"] = str(tool_cache)
+    samples = []
+    for _ in range(repeats):
+        output = scratch / "github-output"
+        output.write_text("")
+        env["GITHUB_OUTPUT"] = str(output)
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(SCRIPTS_DIR / "generate_template.py")],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HPC job template loading")
+    parser.add_argument("--repeats", type=int, default=20, help="Measurements per mode")
+    parser.add_argument("--output", type=Path, default=Path("bench-templates.json"), help="JSON results file")
+    args = parser.parse_args()
+
+    scratch = Path(tempfile.mkdtemp(prefix="hpc-templates-bench-"))
+    try:
+        tool_cache = scratch / "tool-cache"
+        tool_cache.mkdir()
+        compile_templates(TEMPLATE_DIR, tool_cache / f"hpc-templates-{templates_digest(TEMPLATE_DIR)}")
+
+        results = {}
+        for mode, cache in [("source", None), ("compiled", tool_cache)]:
+            print(f"\n=== {mode} ===")
+            results[mode] = {
+                "load_templates": time_template_loading(cache, args.repeats),
+                "generate_template": time_generate_template(cache, args.repeats, scratch),
+            }
+            for name, timing in results[mode].items():
+                print(f"  ✓ {name}: {timing['median_ms']:.1f} ms median, {timing['min_ms']:.1f} ms min")
+    finally:
+        shutil.rmtree(scratch)
+
+    speedup = results["source"]["load_templates"]["median_ms"] / results["compiled"]["load_templates"]["median_ms"]
+    print(f"\nPrecompiled templates load {speedup:.1f}x faster")
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": args.repeats,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
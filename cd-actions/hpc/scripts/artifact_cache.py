@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""Content-addressed cache of dependency installs on the HPC scratch filesystem.
+
+This script is embedded into the generated job script and runs on the HPC
+node with the system python3, so it must stay compatible with Python 3.6 and
+must not contain Jinja delimiters.
+
+Archives live in $ARTIFACT_CACHE_DIR next to an index.json recording their
+codec, size and last access time. Archives are streamed through the
+compressor into a temporary file in the cache directory that is renamed
+into place, the index is updated under an flock, and the least recently
+used entries are evicted once the cache grows past its size limit or an
+entry has not been used for too long.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+INDEX = "index.json"
+INDEX_LOCK = "index.lock"
+TMP_PREFIX = ".tmp-"
+STALE_TMP_SECONDS = 24 * 3600
+
+# Archive suffix of each codec. Entries without a recorded codec are gzip archives.
+CODECS = {"zstd": ".tar.zst", "pigz": ".tar.gz", "gzip": ".tar.gz", "none": ".tar"}
+SUFFIX_CODECS = [(".tar.zst", "zstd"), (".tar.gz", "gzip"), (".tar", "none")]
+FALLBACK_CODECS = {"zstd": "pigz", "pigz": "gzip", "gzip": "none"}
+
+
+def cache_dir():
+    return os.environ["ARTIFACT_CACHE_DIR"]
+
+
+def entry_path(key, entry):
+    return os.path.join(cache_dir(), entry.get("file", key + ".tar.gz"))
+
+
+def available_codec(codec):
+    """Fall back to the next best codec while the tool for the requested one is missing."""
+    while codec != "none" and not shutil.which(codec):
+        print("Warning: {} not found, falling back to {}".format(codec, FALLBACK_CODECS[codec]))
+        codec = FALLBACK_CODECS[codec]
+    return codec
+
+
+def compress_command(codec, threads):
+    return {
+        "zstd": ["zstd", "-q", "-T{}".format(threads)],
+        "pigz": ["pigz", "-p", str(threads)],
+        "gzip": ["gzip"],
+    }.get(codec)
+
+
+def decompress_command(codec, path):
+    if codec == "zstd":
+        return ["zstd", "-q", "-d", "-c", path]
+    if codec in ("pigz", "gzip"):
+        # Any gzip stream can be read by pigz, which decompresses faster
+        return ["pigz" if shutil.which("pigz") else "gzip", "-d", "-c", path]
+    return None
+
+
+def run_pipeline(first, second, stdout=None):
+    """Run first | second, raising CalledProcessError if either fails."""
+    producer = subprocess.Popen(first, stdout=subprocess.PIPE)
+    consumer = subprocess.Popen(second, stdin=producer.stdout, stdout=stdout)
+    producer.stdout.close()
+    consumer.wait()
+    producer.wait()
+    for process, cmd in ((producer, first), (consumer, second)):
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def find_archive(index, key):
+    """Return the path and codec of the archive stored for key, or (None, None)."""
+    entry = index.get(key)
+    if entry is not None and os.path.exists(entry_path(key, entry)):
+        return entry_path(key, entry), entry.get("codec", "gzip")
+    for suffix, codec in SUFFIX_CODECS:
+        path = os.path.join(cache_dir(), key + suffix)
+        if os.path.exists(path):
+            return path, codec
+    return None, None
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+@contextlib.contextmanager
+def index_lock():
+    """Hold an exclusive lock on the cache index, where the filesystem supports it."""
+    os.makedirs(cache_dir(), exist_ok=True)
+    with open(os.path.join(cache_dir(), INDEX_LOCK), "a") as f:
+        locked = False
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                locked = True
+            except OSError as e:
+                print("Warning: could not lock the cache index ({}), continuing unlocked".format(e))
+        try:
+            yield
+        finally:
+            if locked:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_index():
+    try:
+        with open(os.path.join(cache_dir(), INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(index):
+    path = os.path.join(cache_dir(), INDEX)
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def format_size(size):
+    if size < 1024:
+        return "{} B".format(size)
+    for unit in ["KiB", "MiB", "GiB"]:
+        size /= 1024.0
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+    return "{:.1f} TiB".format(size)
+
+
+def record_stats(**counters):
+    """Accumulate the statistics of this job in $ARTIFACT_CACHE_STATS.
+
+    Dependencies built in parallel update the file concurrently, so it is locked.
+    """
+    path = os.environ.get("ARTIFACT_CACHE_STATS")
+    if not path:
+        return
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            stats = json.loads(f.read() or "{}")
+        except ValueError:
+            stats = {}
+        for name, value in counters.items():
+            stats[name] = stats.get(name, 0) + value
+        f.seek(0)
+        f.truncate()
+        json.dump(stats, f)
+
+
+def record_timeline(result, key):
+    """Record a cache hit or miss in the build timeline of the job, see timeline.py."""
+    path = os.environ.get("BUILD_TIMELINE")
+    if not path:
+        return
+    event = {"event": "cache", "result": result, "key": key, "shell": os.getppid(), "time": time.time()}
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+    except OSError:
+        pass
+
+
+def adopt_untracked(index, now):
+    """Track archives the index does not know about, so they can be evicted too.
+
+    These are left over from older cache layouts or from jobs that died before
+    updating the index. Stale temporary files are removed outright.
+    """
+    for name in os.listdir(cache_dir()):
+        path = os.path.join(cache_dir(), name)
+        if name.startswith(TMP_PREFIX):
+            with contextlib.suppress(OSError):
+                if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    os.remove(path)
+            continue
+        for suffix, codec in SUFFIX_CODECS:
+            if not name.endswith(suffix):
+                continue
+            key = name[: -len(suffix)]
+            if key not in index:
+                stat = os.stat(path)
+                index[key] = {
+                    "file": name,
+                    "codec": codec,
+                    "size": stat.st_size,
+                    "created": stat.st_mtime,
+                    "last_access": stat.st_mtime,
+                }
+            break
+
+
+def evict(index, max_size, max_age, now, keep):
+    """Drop expired entries, then the least recently used ones until the cache fits in max_size."""
+    evicted = []
+    for key, entry in sorted(index.items(), key=lambda item: item[1]["last_access"]):
+        if key == keep:
+            continue
+        total = sum(e["size"] for e in index.values())
+        expired = max_age and now - entry["last_access"] > max_age
+        if not expired and (not max_size or total <= max_size):
+            continue
+        with contextlib.suppress(OSError):
+            os.remove(entry_path(key, entry))
+        del index[key]
+        evicted.append((key, entry["size"]))
+    return evicted
+
+
+def cmd_key(args):
+    """Print the cache key of a package checked out in args.source."""
+    commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=args.source, universal_newlines=True).strip()
+    modules = sorted(m for m in os.environ.get("LOADEDMODULES", "").split(":") if m)
+    upstream = sorted(k for k in args.upstream.split() if k)
+    key_data = json.dumps(
+        {"config": args.config, "commit": commit, "modules": modules, "upstream": upstream}, sort_keys=True
+    )
+    print("{}-{}".format(args.name, hashlib.sha256(key_data.encode()).hexdigest()[:16]))
+    return 0
+
+
+def cmd_restore(args):
+    """Extract the cached install for args.key into args.dest. Exits 1 on a cache miss."""
+    path, codec = find_archive(load_index(), args.key)
+    if path is None:
+        print("Cache miss: {}".format(args.key))
+        record_stats(misses=1)
+        record_timeline("miss", args.key)
+        return 1
+
+    start = time.time()
+    os.makedirs(args.dest, exist_ok=True)
+    decompress = decompress_command(codec, path)
+    try:
+        if decompress is None:
+            subprocess.check_call(["tar", "-xf", path, "-C", args.dest])
+        else:
+            run_pipeline(decompress, ["tar", "-xf", "-", "-C", args.dest])
+    except (OSError, subprocess.CalledProcessError):
+        # Treat a corrupt or concurrently evicted archive, or a missing tool, as a miss
+        print("Cache miss: {} (could not extract {} archive)".format(args.key, codec))
+        record_stats(misses=1)
+        record_timeline("miss", args.key)
+        return 1
+    seconds = time.time() - start
+
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    with index_lock():
+        index = load_index()
+        entry = index.setdefault(
+            args.key, {"file": os.path.basename(path), "codec": codec, "size": size, "created": start}
+        )
+        entry["last_access"] = time.time()
+        save_index(index)
+
+    print("Cache hit: {} ({}, {}, restored in {:.1f}s)".format(args.key, codec, format_size(size), seconds))
+    record_stats(hits=1, bytes_restored=size, seconds_restoring=seconds)
+    record_timeline("hit", args.key)
+    return 0
+
+
+def cmd_save(args):
+    """Archive args.src as args.key with the requested codec, then evict old entries."""
+    start = time.time()
+    codec = available_codec(args.codec)
+    name = args.key + CODECS[codec]
+    os.makedirs(cache_dir(), exist_ok=True)
+    # Stream into the cache directory so the rename below is atomic
+    tmp = os.path.join(cache_dir(), "{}{}.{}.{}".format(TMP_PREFIX, name, os.uname()[1], os.getpid()))
+    compress = compress_command(codec, args.threads)
+    try:
+        if compress is None:
+            subprocess.check_call(["tar", "-cf", tmp, "-C", args.src, "."])
+        else:
+            with open(tmp, "wb") as f:
+                run_pipeline(["tar", "-cf", "-", "-C", args.src, "."], compress, stdout=f)
+        os.replace(tmp, os.path.join(cache_dir(), name))
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    seconds = time.time() - start
+
+    size = os.path.getsize(os.path.join(cache_dir(), name))
+    unpacked = directory_size(args.src)
+    now = time.time()
+    with index_lock():
+        index = load_index()
+        previous = index.get(args.key)
+        if previous is not None and previous.get("file", name) != name:
+            # Saved again with another codec, drop the old archive
+            with contextlib.suppress(OSError):
+                os.remove(entry_path(args.key, previous))
+        index[args.key] = {
+            "file": name,
+            "codec": codec,
+            "size": size,
+            "unpacked_size": unpacked,
+            "created": now,
+            "last_access": now,
+        }
+        adopt_untracked(index, now)
+        evicted = evict(index, args.max_size * 1024**3, args.max_age * 86400, now, keep=args.key)
+        save_index(index)
+
+    print(
+        "Saved cache: {} ({}, {} -> {}, in {:.1f}s)".format(
+            args.key, codec, format_size(unpacked), format_size(size), seconds
+        )
+    )
+    for key, evicted_size in evicted:
+        print("Evicted cache: {} ({})".format(key, format_size(evicted_size)))
+    record_stats(
+        saves=1,
+        bytes_saved=size,
+        seconds_saving=seconds,
+        evictions=len(evicted),
+        bytes_evicted=sum(s for _, s in evicted),
+    )
+    return 0
+
+
+def cmd_stats(args):
+    """Print the statistics of this job and the state of the shared cache."""
+    try:
+        with open(os.environ.get("ARTIFACT_CACHE_STATS", "")) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    index = load_index() if os.path.isdir(cache_dir()) else {}
+
+    print("Artifact cache statistics:")
+    print("  Hits: {}, misses: {}".format(stats.get("hits", 0), stats.get("misses", 0)))
+    print(
+        "  Restored: {} in {:.1f}s".format(
+            format_size(stats.get("bytes_restored", 0)), stats.get("seconds_restoring", 0)
+        )
+    )
+    print(
+        "  Saved: {} ({} archive(s)) in {:.1f}s".format(
+            format_size(stats.get("bytes_saved", 0)), stats.get("saves", 0), stats.get("seconds_saving", 0)
+        )
+    )
+    print(
+        "  Evicted: {} ({} archive(s))".format(
+            format_size(stats.get("bytes_evicted", 0)), stats.get("evictions", 0)
+        )
+    )
+    print(
+        "  Cache size: {} in {} archive(s)".format(
+            format_size(sum(e["size"] for e in index.values())), len(index)
+        )
+    )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    key = subparsers.add_parser("key", help="Compute the cache key of a checked out package")
+    key.add_argument("--name", required=True)
+    key.add_argument("--config", required=True, help="Hash of the build configuration")
+    key.add_argument("--source", required=True, help="Git checkout of the package")
+    key.add_argument("--upstream", default="", help="Space separated cache keys of upstream dependencies")
+    key.set_defaults(func=cmd_key)
+
+    restore = subparsers.add_parser("restore", help="Restore a cached install")
+    restore.add_argument("--key", required=True)
+    restore.add_argument("--dest", required=True)
+    restore.set_defaults(func=cmd_restore)
+
+    save = subparsers.add_parser("save", help="Save an install to the cache")
+    save.add_argument("--key", required=True)
+    save.add_argument("--src", required=True)
+    save.add_argument("--codec", choices=sorted(CODECS), default="zstd", help="Compression of the archive")
+    save.add_argument("--threads", type=int, default=1, help="Compression threads for zstd and pigz")
+    save.add_argument("--max-size", type=float, default=500, help="Cache size limit in GiB (0: unlimited)")
+    save.add_argument("--max-age", type=float, default=30, help="Evict entries unused for this many days (0: never)")
+    save.set_defaults(func=cmd_save)
+
+    stats = subparsers.add_parser("stats", help="Print cache statistics")
+    stats.set_defaults(func=cmd_stats)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("a command is required")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,20 @@ import contextlib
 import hashlib
 import json
 import os
+import sys
 from pathlib import Path
 
 import yaml
-from jinja2 import Environment, FileSystemLoader
+from job_templates import create_environment, render_job
+
+# Scripts installed by the job, to run on the HPC node
+HELPER_SCRIPTS = ["artifact_cache.py", "git_mirror.py", "readme.py", "redact.py", "timeline.py"]
+# Linux limit on the size of one environment string (MAX_ARG_STRLEN). ci-hpc-generic passes the job
+# script and the template data to its step as the TEMPLATE_INPUT and TEMPLATE_DATA variables.
+MAX_ENV_STRING = 128 * 1024
+CACHE_CODECS = ["zstd", "pigz", "gzip", "none"]
+# Fetched alongside the packages of ecbundle builds
+ECBUNDLE_TOOL = {"name": "ecbundle", "owner": "ecmwf", "repo": "ecbundle", "ref": "HEAD", "type": "tool", "depth": 1}
 
 
 def cmake_value(v):
@@ -18,34 +28,123 @@ def cmake_value(v):
 
 
 def cache_key(name, ref, compiler, cmake_opts):
+    """Hash of the build configuration. The job adds the resolved commit, modules and upstream keys."""
     key_data = f"{name}:{ref}:{compiler}:{':'.join(cmake_opts or [])}"
     return f"{name}-{hashlib.sha256(key_data.encode()).hexdigest()[:12]}"
 
 
-def main():
-    # Load shared defaults and HPC config
-    action_dir = Path(os.environ["GITHUB_ACTION_PATH"])
+def dependency_levels(dependencies):
+    """Group dependencies into levels that can be built in parallel.
+
+    Every dependency is placed one level after the deepest dependency it needs,
+    so each level only needs packages from earlier levels.
+    """
+    by_name = {dep["name"]: dep for dep in dependencies}
+    levels = {}
+
+    def level(name, path):
+        if name in path:
+            raise ValueError(f"Dependency cycle: {' -> '.join([*path, name])}")
+        if name not in levels:
+            needs = by_name[name]["needs"]
+            levels[name] = 1 + max((level(need, [*path, name]) for need in needs), default=-1)
+        return levels[name]
+
+    for dep in dependencies:
+        unknown = [need for need in dep["needs"] if need not in by_name]
+        if unknown:
+            raise ValueError(f"Dependency {dep['name']} needs unknown dependencies: {', '.join(unknown)}")
+
+    grouped = []
+    for dep in dependencies:
+        n = level(dep["name"], [])
+        while len(grouped) <= n:
+            grouped.append([])
+        grouped[n].append(dep)
+    return grouped
+
+
+def sets_ctest_parallelism(ctest_options, env_list):
+    """Whether the user already chose how many tests ctest runs in parallel."""
+    if any(var.startswith("CTEST_PARALLEL_LEVEL=") for var in env_list):
+        return True
+    return any(opt.startswith(("-j", "--parallel")) for opt in ctest_options)
+
+
+def load_helper_scripts(scripts_dir):
+    """Read the helper scripts installed by the job.
+
+    Their sources reach ci-hpc-generic in the template data rather than in
+    the job script, see helper_scripts_data. The job script is rendered again
+    as a template by ci-hpc-generic, so the scripts are kept free of Jinja
+    delimiters all the same, in case one is ever written into it directly.
+    """
+    scripts = {}
+    for name in HELPER_SCRIPTS:
+        source = (scripts_dir / name).read_text()
+        for delimiter in ["{{", "{%", "{#"]:
+            if delimiter in source:
+                raise ValueError(f"Helper script {name} must not contain '{delimiter}'")
+        scripts[name] = source.rstrip("\n")
+    return scripts
+
+
+def helper_scripts_data(scripts):
+    """YAML for the template data of ci-hpc-generic, mapping helper_scripts to the script sources.
+
+    The job script only refers to the sources, so its size does not grow with
+    the helpers, and the sources take up one environment string of a fixed size.
+    """
+
+    class Dumper(yaml.SafeDumper):
+        pass
+
+    def represent_str(dumper, value):
+        return dumper.represent_scalar("tag:yaml.org,2002:str", value, style="|" if "\n" in value else None)
+
+    Dumper.add_representer(str, represent_str)
+    return yaml.dump({"helper_scripts": scripts}, Dumper=Dumper, allow_unicode=True, width=float("inf"))
+
+
+def check_env_size(variable, value, description):
+    """Raise ValueError if value cannot be passed to ci-hpc-generic as the environment variable variable."""
+    size = len(f"{variable}={value}".encode()) + 1
+    if size > MAX_ENV_STRING:
+        raise ValueError(
+            f"The {description} is {size} bytes, over the limit of {MAX_ENV_STRING} bytes of one environment "
+            f"variable, and ci-hpc-generic would fail with 'Argument list too long' passing it as {variable}. "
+            "Reduce the number of dependencies or stages of the build"
+        )
+
+
+def load_configs(action_dir):
+    """Load the configuration shared by every build: defaults, HPC config and helper scripts."""
     with open(action_dir.parent / "defaults.yml") as f:
         shared_defaults = yaml.safe_load(f)
-    defaults = shared_defaults["hpc"]
-
-    config_dir = action_dir / "config"
-    with open(config_dir / "hpc.yml") as f:
+    with open(action_dir / "config" / "hpc.yml") as f:
         hpc_config = yaml.safe_load(f)
-    sync_clusters_map = hpc_config["sync_clusters"]
+    return {
+        "defaults": shared_defaults["hpc"],
+        "hpc": hpc_config,
+        "helper_scripts": load_helper_scripts(action_dir / "scripts"),
+    }
 
-    # Load Jinja templates
-    template_dir = action_dir / "templates"
-    jinja_env = Environment(
-        loader=FileSystemLoader(template_dir),
-        trim_blocks=True,
-        lstrip_blocks=True,
-    )
-    # ecbundle-build adds its own -D prefix, so we need to strip ours
-    jinja_env.filters["strip_d_prefix"] = lambda s: s[2:] if s.startswith("-D") else s
+
+def generate(inputs, configs, jinja_env):
+    """Render the job script and sbatch options of one build.
+
+    inputs maps the INPUT_*, STEP_CONFIG_* and GITHUB_REPOSITORY variables set
+    by action.yml to their values. Returns (job script, sbatch options, site).
+    Raises ValueError for invalid inputs.
+    """
+    defaults = configs["defaults"]
+    hpc_config = configs["hpc"]
+    sync_clusters_map = hpc_config["sync_clusters"]
+    artifact_cache_config = hpc_config["artifact_cache"]
+    git_mirror_config = hpc_config["git_mirror"]
 
     # Check if staged build (parse JSON to check for actual stages)
-    stages_input = os.environ.get("INPUT_STAGES", "").strip()
+    stages_input = inputs.get("INPUT_STAGES", "").strip()
     stages = []
     if stages_input:
         with contextlib.suppress(json.JSONDecodeError):
@@ -53,52 +152,56 @@ def main():
     use_staged = bool(stages)
 
     # Parse inputs from environment variables
-    cmake_options_input = os.environ.get("INPUT_CMAKE_OPTIONS", "").strip()
-    ctest_options_input = os.environ.get("INPUT_CTEST_OPTIONS", "").strip()
-    dependencies_input = os.environ.get("INPUT_DEPENDENCIES", "").strip()
-    dep_cmake_options_input = os.environ.get("INPUT_DEPENDENCY_CMAKE_OPTIONS", "").strip()
-    python_deps_input = os.environ.get("INPUT_PYTHON_DEPENDENCIES", "").strip()
-    modules_input = os.environ.get("INPUT_MODULES", "").strip()
-    env_vars_input = os.environ.get("INPUT_ENV_VARS", "").strip()
-    install_lib_dir = os.environ.get("INPUT_INSTALL_LIB_DIR", "").strip()
-
-    repository = os.environ["GITHUB_REPOSITORY"]
+    cmake_options_input = inputs.get("INPUT_CMAKE_OPTIONS", "").strip()
+    ctest_options_input = inputs.get("INPUT_CTEST_OPTIONS", "").strip()
+    dependencies_input = inputs.get("INPUT_DEPENDENCIES", "").strip()
+    dep_cmake_options_input = inputs.get("INPUT_DEPENDENCY_CMAKE_OPTIONS", "").strip()
+    dep_parallel_input = inputs.get("INPUT_DEPENDENCY_PARALLEL", "").strip()
+    python_deps_input = inputs.get("INPUT_PYTHON_DEPENDENCIES", "").strip()
+    modules_input = inputs.get("INPUT_MODULES", "").strip()
+    env_vars_input = inputs.get("INPUT_ENV_VARS", "").strip()
+    install_lib_dir = inputs.get("INPUT_INSTALL_LIB_DIR", "").strip()
+
+    repository = inputs["GITHUB_REPOSITORY"]
     repo_owner, repo_name = repository.split("/")
-    ref_name = os.environ["INPUT_REF_NAME"]
-    sha = os.environ.get("INPUT_SHA", "")
-    compiler = os.environ["STEP_CONFIG_COMPILER"]
-    compiler_modules = os.environ["STEP_CONFIG_COMPILER_MODULES"]
-    install_prefix = os.environ["STEP_CONFIG_INSTALL_PREFIX"]
-    base_install_prefix = os.environ["STEP_CONFIG_BASE_INSTALL_PREFIX"]
-    module_name = os.environ.get("INPUT_MODULE_NAME", "").strip() or repo_name
-    parallel = os.environ.get("INPUT_PARALLEL", "").strip() or str(defaults["parallel"])
-    ntasks = os.environ.get("INPUT_NTASKS", "").strip() or str(defaults["ntasks"])
-    gpus = os.environ.get("INPUT_GPUS", "").strip()
-    queue = os.environ.get("INPUT_QUEUE", "").strip() or defaults["queue"]
-    site = os.environ.get("INPUT_SITE", defaults["site"])
+    ref_name = inputs["INPUT_REF_NAME"]
+    sha = inputs.get("INPUT_SHA", "")
+    compiler = inputs["STEP_CONFIG_COMPILER"]
+    compiler_modules = inputs["STEP_CONFIG_COMPILER_MODULES"]
+    install_prefix = inputs["STEP_CONFIG_INSTALL_PREFIX"]
+    base_install_prefix = inputs["STEP_CONFIG_BASE_INSTALL_PREFIX"]
+    module_name = inputs.get("INPUT_MODULE_NAME", "").strip() or repo_name
+    parallel = inputs.get("INPUT_PARALLEL", "").strip() or str(defaults["parallel"])
+    ntasks = inputs.get("INPUT_NTASKS", "").strip() or str(defaults["ntasks"])
+    gpus = inputs.get("INPUT_GPUS", "").strip()
+    queue = inputs.get("INPUT_QUEUE", "").strip() or defaults["queue"]
+    site = inputs.get("INPUT_SITE", defaults["site"])
     sync_clusters = sync_clusters_map.get(site, sync_clusters_map.get("aa-batch", []))
-    do_sync = os.environ.get("STEP_CONFIG_DO_SYNC", "false") == "true"
+    do_sync = inputs.get("STEP_CONFIG_DO_SYNC", "false") == "true"
     if not sync_clusters:
         do_sync = False
-    lock_permissions = os.environ.get("INPUT_LOCK_PERMISSIONS", "true") == "true"
-    use_ninja = os.environ.get("INPUT_USE_NINJA", "true") == "true"
-    self_test = os.environ.get("INPUT_SELF_TEST", "true") == "true"
-    force_build = os.environ.get("INPUT_FORCE_BUILD", "false") == "true"
-    ecbundle = os.environ.get("INPUT_ECBUNDLE", "false") == "true"
-    clean_before_install = os.environ.get("INPUT_CLEAN_BEFORE_INSTALL", "false") == "true"
-    python_version = os.environ.get("INPUT_PYTHON_VERSION", "").strip()
-    requirements_path = os.environ.get("INPUT_PYTHON_REQUIREMENTS", "").strip() or "requirements.txt"
-    toml_opt_dep_sections_raw = os.environ.get("INPUT_PYTHON_TOML_OPT_DEP_SECTIONS", "").strip()
+    lock_permissions = inputs.get("INPUT_LOCK_PERMISSIONS", "true") == "true"
+    use_ninja = inputs.get("INPUT_USE_NINJA", "true") == "true"
+    self_test = inputs.get("INPUT_SELF_TEST", "true") == "true"
+    force_build = inputs.get("INPUT_FORCE_BUILD", "false") == "true"
+    cache_codec = inputs.get("INPUT_CACHE_CODEC", "").strip() or defaults["cache_codec"]
+    if cache_codec not in CACHE_CODECS:
+        raise ValueError(f"Unknown cache_codec '{cache_codec}', expected one of: {', '.join(CACHE_CODECS)}")
+    ecbundle = inputs.get("INPUT_ECBUNDLE", "false") == "true"
+    clean_before_install = inputs.get("INPUT_CLEAN_BEFORE_INSTALL", "false") == "true"
+    python_version = inputs.get("INPUT_PYTHON_VERSION", "").strip()
+    requirements_path = inputs.get("INPUT_PYTHON_REQUIREMENTS", "").strip() or "requirements.txt"
+    toml_opt_dep_sections_raw = inputs.get("INPUT_PYTHON_TOML_OPT_DEP_SECTIONS", "").strip()
     toml_opt_dep_sections_list = [s.strip() for s in toml_opt_dep_sections_raw.splitlines() if s.strip()]
     toml_opt_dep_sections = ",".join(toml_opt_dep_sections_list)
-    conda_deps_raw = os.environ.get("INPUT_CONDA_DEPS", "").strip()
+    conda_deps_raw = inputs.get("INPUT_CONDA_DEPS", "").strip()
     conda_deps_list = [d.strip() for d in conda_deps_raw.splitlines() if d.strip()]
     conda_deps = " ".join(conda_deps_list)
-    post_script = os.environ.get("INPUT_POST_SCRIPT", "").strip() or None
-    bundle_yml_input = os.environ.get("INPUT_BUNDLE_YML", "").strip()
-    install_command = os.environ.get("INPUT_INSTALL_COMMAND", "").strip()
-    mkdir_input = os.environ.get("INPUT_MKDIR", "").strip()
-    pytest_cmd_input = os.environ.get("INPUT_PYTEST_CMD", "").strip()
+    post_script = inputs.get("INPUT_POST_SCRIPT", "").strip() or None
+    bundle_yml_input = inputs.get("INPUT_BUNDLE_YML", "").strip()
+    install_command = inputs.get("INPUT_INSTALL_COMMAND", "").strip()
+    mkdir_input = inputs.get("INPUT_MKDIR", "").strip()
+    pytest_cmd_input = inputs.get("INPUT_PYTEST_CMD", "").strip()
 
     # Parse mkdir (line-separated)
     mkdir_list = [d.strip() for d in mkdir_input.splitlines() if d.strip()]
@@ -130,6 +233,14 @@ def main():
             key, value = line.split("=", 1)
             dep_cmake_map[key.strip()] = value.strip()
 
+    # Parse dependency build jobs (line-separated repo=jobs pairs)
+    dep_parallel_map = {}
+    for line in dep_parallel_input.splitlines():
+        line = line.strip()
+        if "=" in line:
+            key, value = line.split("=", 1)
+            dep_parallel_map[key.strip()] = int(value)
+
     # Parse modules (line-separated)
     package_modules = [m.strip() for m in modules_input.splitlines() if m.strip()]
 
@@ -172,11 +283,19 @@ def main():
             }
         ]
     else:
-        # Parse dependencies
+        # Parse dependencies, each optionally followed by "needs: <name>, <name>".
+        # Without needs, a dependency needs the one declared before it.
+        previous_dep = None
         for dep in dependencies_input.splitlines():
             dep = dep.strip()
             if not dep:
                 continue
+            if "needs:" in dep:
+                dep, needs_input = dep.split("needs:", 1)
+                dep = dep.strip()
+                dep_needs = [need.strip().split("/")[-1] for need in needs_input.split(",") if need.strip()]
+            else:
+                dep_needs = [previous_dep] if previous_dep else []
             if "@" in dep:
                 dep_repo, dep_ref = dep.rsplit("@", 1)
             else:
@@ -207,8 +326,11 @@ def main():
                     "modules": [],
                     "cache_key": cache_key(dep_name, dep_ref, compiler, dep_cmake_list),
                     "subdir": "",
+                    "needs": dep_needs,
+                    "jobs_override": dep_parallel_map.get(dep_repo),
                 }
             )
+            previous_dep = dep_name
 
         # Add main package (CMake) - always add for staged builds, or when no python_version
         if use_staged or not python_version:
@@ -278,14 +400,35 @@ def main():
                 }
             )
 
+    # Every package builds with all CPUs of the task, and ctest uses the CPUs of all tasks,
+    # unless overridden. Dependencies built side by side split the CPUs between them.
+    for package in packages:
+        package["jobs"] = int(parallel)
+        package["test_jobs"] = int(ntasks) * int(parallel)
+        if sets_ctest_parallelism(package["ctest_options"], env_list):
+            package["test_jobs"] = None
+    levels = dependency_levels([p for p in packages if p["type"] == "dependency"])
+    for level in levels:
+        for dep in level:
+            dep["jobs"] = dep.pop("jobs_override") or max(1, int(parallel) // len(level))
+        if len(level) > 1:
+            print(f"Building in parallel: {', '.join(dep['name'] for dep in level)}")
+    for package in packages:
+        print(f"{package['name']}: {package['jobs']} build job(s)")
+
+    # All sources are fetched concurrently at the start of the job
+    sources = [*packages, ECBUNDLE_TOOL] if use_ecbundle else packages
+
     # Build name for logging
-    build_name = os.environ.get("INPUT_NAME", "").strip()
+    build_name = inputs.get("INPUT_NAME", "").strip()
+    fingerprint = inputs.get("INPUT_FINGERPRINT", "").strip()
 
-    dry_run = os.environ.get("INPUT_DRY_RUN", "false") == "true"
-    dry_run_install = os.environ.get("INPUT_DRY_RUN_INSTALL", "false") == "true"
+    dry_run = inputs.get("INPUT_DRY_RUN", "false") == "true"
+    dry_run_install = inputs.get("INPUT_DRY_RUN_INSTALL", "false") == "true"
     # Build ci_options dict
     ci_options = {
         "build_name": build_name,
+        "fingerprint": fingerprint,
         "parallel": int(parallel),
         "cpus_per_task": int(parallel),
         "ntasks": int(ntasks),
@@ -296,6 +439,7 @@ def main():
         "dry_run_install": dry_run_install,
         "skip_install": dry_run and not dry_run_install,
         "workdir": "${TMPDIR}",
+        "helper_dir": "${TMPDIR}/.ci",
         "output_path": "",  # Set by generic.jinja wrapper
         "python_version": python_version or defaults["python_version"],
         "requirements_path": requirements_path,
@@ -308,7 +452,7 @@ def main():
         "ecbundle": ecbundle,
         "use_ecbundle": use_ecbundle,
         "pytest_cmd": pytest_cmd_input or None,
-        "prefix_compiler_specific": os.environ.get("INPUT_PREFIX_COMPILER_SPECIFIC", "false") == "true",
+        "prefix_compiler_specific": inputs.get("INPUT_PREFIX_COMPILER_SPECIFIC", "false") == "true",
         "clean_before_install": clean_before_install,
         "install_prefix": install_prefix,
         "base_install_prefix": base_install_prefix,
@@ -317,7 +461,13 @@ def main():
         "module_name": module_name,
         "queue": queue,
         "hpc": "lumi" if site == "lumi" else "atos",
-        "hpc_config": {"enable_cache": True},
+        "hpc_config": {
+            "enable_cache": True,
+            "cache_max_size_gb": artifact_cache_config["max_size_gb"],
+            "cache_max_age_days": artifact_cache_config["max_age_days"],
+            "cache_codec": cache_codec,
+            "git_mirror_max_age_days": git_mirror_config["max_age_days"],
+        },
         "lock_permissions": lock_permissions,
     }
 
@@ -328,8 +478,6 @@ def main():
     }
 
     # === RENDER TEMPLATE ===
-    template = jinja_env.get_template("build-job.jinja")
-
     # Normalize stages to ensure required fields
     for i, stage in enumerate(stages):
         stage.setdefault("name", f"stage-{i}")
@@ -343,27 +491,39 @@ def main():
         stage.setdefault("test_command", "")
         stage.setdefault("install_command", "")
 
-    # Render template (stages list is empty for standard builds)
-    rendered = template.render(
+    # Render the job script and sbatch options (stages list is empty for standard builds)
+    rendered, sbatch = render_job(
+        jinja_env,
+        {"site": site, "queue": queue, "ntasks": ntasks, "parallel": parallel, "gpus": gpus},
         packages=packages,
         ci_options=ci_options,
         generic_modules=generic_modules,
         env=env_list,
         github=github,
         stages=stages,
+        dependency_levels=levels,
+        sources=sources,
+        helper_scripts=list(configs["helper_scripts"]),
     )
+    check_env_size("TEMPLATE_INPUT", rendered, "rendered job script")
+    return rendered, sbatch, site
 
-    # Generate sbatch options using the macro from sbatch.jinja
-    sbatch_template = jinja_env.from_string(
-        "{% from 'sbatch.jinja' import sbatch_options with context %}{{ sbatch_options() }}"
-    )
-    sbatch = sbatch_template.render(
-        site=site,
-        queue=queue,
-        ntasks=ntasks,
-        parallel=parallel,
-        gpus=gpus,
-    ).strip()
+
+def main():
+    action_dir = Path(os.environ["GITHUB_ACTION_PATH"])
+    configs = load_configs(action_dir)
+
+    # Load Jinja templates, compiled once per version into the runner tool cache
+    tool_cache = os.environ.get("RUNNER_TOOL_CACHE")
+    jinja_env = create_environment(action_dir / "templates", Path(tool_cache) if tool_cache else None)
+
+    try:
+        rendered, sbatch, site = generate(os.environ, configs, jinja_env)
+        helper_data = helper_scripts_data(configs["helper_scripts"])
+        check_env_size("TEMPLATE_DATA", helper_data, "template data of the helper scripts")
+    except ValueError as e:
+        print(f"::error::{e}")
+        sys.exit(1)
 
     # Write outputs
     with open(os.environ["GITHUB_OUTPUT"], "a", encoding="utf-8") as f:
@@ -373,6 +533,9 @@ def main():
         f.write("sbatch_options<<SBATCH_EOF\n")
         f.write(sbatch)
         f.write("\nSBATCH_EOF\n")
+        f.write("helper_scripts<<HELPER_SCRIPTS_EOF\n")
+        f.write(helper_data)
+        f.write("HELPER_SCRIPTS_EOF\n")
 
     print(f"Site: {site}")
     print("Generated template:")
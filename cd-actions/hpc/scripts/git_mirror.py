@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Shared cache of shallow git mirrors on the HPC scratch filesystem.
+
+This script is embedded into the generated job script and runs on the HPC
+node with the system python3, so it must stay compatible with Python 3.6 and
+must not contain Jinja delimiters.
+
+Every owner/repo has a bare mirror in $GIT_MIRROR_DIR that is updated
+incrementally from GitHub, so only the commits pushed since the last job are
+downloaded. Checkouts borrow the mirror objects through git alternates
+instead of copying them. Updates and checkouts of a mirror hold an flock on
+it, so concurrent jobs share the mirrors safely, and mirrors that have not
+been used for too long are removed.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LAST_USED = "ci-last-used"
+
+
+def git(*args, cwd=None):
+    subprocess.check_call(["git"] + list(args), cwd=cwd)
+
+
+def git_output(*args, cwd=None):
+    return subprocess.check_output(["git"] + list(args), cwd=cwd).decode().strip()
+
+
+@contextlib.contextmanager
+def mirror_lock(mirror, blocking=True):
+    """Hold an exclusive flock on a mirror. Yields False if non-blocking and already locked."""
+    os.makedirs(os.path.dirname(mirror), exist_ok=True)
+    with open(mirror + ".lock", "w") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def mirror_ref(ref):
+    """Local ref keeping the fetched commit of ref alive in the mirror."""
+    if ref.startswith("refs/"):
+        ref = ref[len("refs/"):]
+    return "refs/ci/" + ref
+
+
+def update_mirror(mirror, url, ref, depth):
+    """Fetch ref and all tags into the mirror, creating it if needed. Returns the fetched commit."""
+    if not os.path.isdir(mirror):
+        git("init", "-q", "--bare", mirror)
+        # Checkouts of running jobs borrow objects from the mirror, which must never be pruned under them
+        git("config", "gc.auto", "0", cwd=mirror)
+    local_ref = mirror_ref(ref)
+    git("fetch", "-q", "--depth", str(depth), "--tags", "--force", url, "+{}:{}".format(ref, local_ref), cwd=mirror)
+    with open(os.path.join(mirror, LAST_USED), "w"):
+        pass
+    return git_output("rev-parse", local_ref + "^{commit}", cwd=mirror)
+
+
+def checkout_from_mirror(mirror, url, ref, dest):
+    """Check out the fetched commit of ref into dest, borrowing the mirror objects."""
+    local_ref = mirror_ref(ref)
+    commit = git_output("rev-parse", local_ref + "^{commit}", cwd=mirror)
+    git("init", "-q", dest)
+    with open(os.path.join(dest, ".git", "objects", "info", "alternates"), "w") as f:
+        f.write(os.path.join(os.path.abspath(mirror), "objects") + "\n")
+    # The checkout shares the history boundary of the mirror
+    if os.path.exists(os.path.join(mirror, "shallow")):
+        shutil.copy(os.path.join(mirror, "shallow"), os.path.join(dest, ".git", "shallow"))
+    git("remote", "add", "origin", url, cwd=dest)
+    # All objects are already reachable through the alternates, so this only copies refs
+    git("fetch", "-q", "--tags", mirror, "+{}:{}".format(local_ref, local_ref), cwd=dest)
+    git("checkout", "-q", commit, cwd=dest)
+    return commit
+
+
+def fetch_direct(url, ref, dest, depth):
+    """Fetch straight from GitHub, as done before mirrors existed."""
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    git("init", "-q", dest)
+    git("remote", "add", "origin", url, cwd=dest)
+    git("fetch", "-q", "--depth", str(depth), "--tags", "origin", ref, cwd=dest)
+    git("checkout", "-q", "FETCH_HEAD", cwd=dest)
+
+
+def prune(mirror_dir, max_age, now):
+    """Remove mirrors unused for max_age days that no other job is using."""
+    if not max_age:
+        return
+    for owner in os.listdir(mirror_dir):
+        owner_dir = os.path.join(mirror_dir, owner)
+        if not os.path.isdir(owner_dir):
+            continue
+        for name in os.listdir(owner_dir):
+            mirror = os.path.join(owner_dir, name)
+            last_used = os.path.join(mirror, LAST_USED)
+            if not name.endswith(".git") or not os.path.exists(last_used):
+                continue
+            if now - os.path.getmtime(last_used) < max_age * 86400:
+                continue
+            with mirror_lock(mirror, blocking=False) as locked:
+                if locked:
+                    print("Removing unused mirror {}/{}".format(owner, name))
+                    shutil.rmtree(mirror)
+
+
+def cmd_checkout(args):
+    mirror_dir = os.environ.get("GIT_MIRROR_DIR")
+    start = time.time()
+    if mirror_dir:
+        mirror = os.path.join(mirror_dir, args.owner, args.repo + ".git")
+        try:
+            with mirror_lock(mirror):
+                existed = os.path.isdir(mirror)
+                update_mirror(mirror, args.url, args.ref, args.depth)
+                commit = checkout_from_mirror(mirror, args.url, args.ref, args.dest)
+            print(
+                "Checked out {}/{}@{} ({}) from {} mirror in {:.1f}s".format(
+                    args.owner, args.repo, args.ref, commit[:12], "cached" if existed else "new", time.time() - start
+                )
+            )
+            prune(mirror_dir, args.max_age, time.time())
+            return 0
+        except subprocess.CalledProcessError as e:
+            # The command holds the authenticated URL, so only its exit status is reported
+            print("Warning: git mirror failed with exit status {}, fetching directly".format(e.returncode))
+        except OSError as e:
+            print("Warning: git mirror failed ({}), fetching directly".format(e))
+
+    fetch_direct(args.url, args.ref, args.dest, args.depth)
+    print("Fetched {}/{}@{} in {:.1f}s".format(args.owner, args.repo, args.ref, time.time() - start))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    checkout = subparsers.add_parser("checkout", help="Check out a ref through the mirror cache")
+    checkout.add_argument("--owner", required=True)
+    checkout.add_argument("--repo", required=True)
+    checkout.add_argument("--ref", required=True, help="Branch, tag or commit to check out")
+    checkout.add_argument("--url", required=True, help="Authenticated URL of the repository")
+    checkout.add_argument("--dest", required=True, help="Directory of the checkout")
+    checkout.add_argument("--depth", type=int, default=20, help="History depth to fetch")
+    checkout.add_argument("--max-age", type=float, default=30, help="Remove mirrors unused for this many days (0: never)")
+    checkout.set_defaults(func=cmd_checkout)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("a command is required")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
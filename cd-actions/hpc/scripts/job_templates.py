@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Jinja environment and rendering of the HPC job templates.
+
+Compiling build-job.jinja and the macro files it imports dominates the start
+up of generate_template.py. When a cache directory is given (the runner tool
+cache, which persists on self-hosted runners), the templates are compiled to
+Python modules once per version of the templates and of jinja2, and loaded
+through a ModuleLoader afterwards.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import jinja2
+from jinja2 import Environment, FileSystemLoader, ModuleLoader
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates"
+
+
+def strip_d_prefix(option):
+    """ecbundle-build adds its own -D prefix, so we need to strip ours."""
+    return option[2:] if option.startswith("-D") else option
+
+
+def make_environment(loader):
+    env = Environment(loader=loader, trim_blocks=True, lstrip_blocks=True)
+    env.filters["strip_d_prefix"] = strip_d_prefix
+    return env
+
+
+def templates_digest(template_dir):
+    """Hash of everything the compiled modules depend on."""
+    digest = hashlib.sha256(jinja2.__version__.encode())
+    digest.update(Path(__file__).read_bytes())
+    for path in sorted(template_dir.glob("*.jinja")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def compile_templates(template_dir, target):
+    """Compile the templates to Python modules in target, atomically."""
+    staging = target.with_name(f"{target.name}.tmp-{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    make_environment(FileSystemLoader(template_dir)).compile_templates(
+        staging, zip=None, ignore_errors=False, log_function=None
+    )
+    try:
+        staging.rename(target)
+    except OSError:
+        # Another job compiled the same version first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not target.is_dir():
+            raise
+
+
+def create_environment(template_dir=TEMPLATE_DIR, cache_dir=None):
+    """Jinja environment for the job templates, loading precompiled modules from cache_dir if given."""
+    if cache_dir is None:
+        return make_environment(FileSystemLoader(template_dir))
+
+    compiled = cache_dir / f"hpc-templates-{templates_digest(template_dir)}"
+    if not compiled.is_dir():
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            compile_templates(template_dir, compiled)
+            print(f"Compiled job templates to {compiled}")
+        except OSError as e:
+            print(f"Warning: could not compile job templates ({e}), rendering from source")
+            return make_environment(FileSystemLoader(template_dir))
+    return make_environment(ModuleLoader(compiled))
+
+
+def render_job(jinja_env, sbatch_context, **context):
+    """Render the job script and its sbatch options. Returns both as strings."""
+    script = jinja_env.get_template("build-job.jinja").render(**context)
+    sbatch = jinja_env.get_template("sbatch.jinja").make_module(sbatch_context).sbatch_options()
+    return script, str(sbatch).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile the HPC job templates")
+    parser.add_argument("cache_dir", type=Path, help="Directory holding the compiled templates")
+    parser.add_argument("--template-dir", type=Path, default=TEMPLATE_DIR)
+    args = parser.parse_args()
+
+    target = args.cache_dir / f"hpc-templates-{templates_digest(args.template_dir)}"
+    if target.is_dir():
+        print(f"✓ Templates already compiled in {target}")
+        return
+    args.cache_dir.mkdir(parents=True, exist_ok=True)
+    compile_templates(args.template_dir, target)
+    print(f"✓ Templates compiled to {target}")
+
+
+if __name__ == "__main__":
+    main()
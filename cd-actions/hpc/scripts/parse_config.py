@@ -11,46 +11,45 @@ from pathlib import Path
 import yaml
 
 
-def main():
-    # Load shared defaults
-    action_path = Path(os.environ["GITHUB_ACTION_PATH"])
-    with open(action_path.parent / "defaults.yml") as f:
-        shared_defaults = yaml.safe_load(f)
+def load_platforms(action_path):
+    with open(action_path / "config" / "platforms.yml") as f:
+        return yaml.safe_load(f)
 
-    # Load platform map from config file
-    config_dir = action_path / "config"
-    with open(config_dir / "platforms.yml") as f:
-        platform_map = yaml.safe_load(f)
 
-    platform = os.environ["INPUT_PLATFORM"]
+def resolve_config(inputs, shared_defaults, platform_map):
+    """Resolve the platform, install prefixes and build mode of one build.
+
+    inputs maps the INPUT_* and GITHUB_REPOSITORY variables set by action.yml
+    to their values. Returns the step outputs as strings. Raises ValueError
+    for invalid inputs.
+    """
+    platform = inputs["INPUT_PLATFORM"]
     if platform not in platform_map:
-        print(f"::error::Unknown platform '{platform}'")
-        print(f"Available platforms: {', '.join(platform_map.keys())}")
-        sys.exit(1)
+        raise ValueError(f"Unknown platform '{platform}'. Available platforms: {', '.join(platform_map.keys())}")
 
     compiler_info = platform_map[platform]
 
     # Check if staged build (parse JSON to check for actual stages)
-    stages_input = os.environ.get("INPUT_STAGES", "").strip()
+    stages_input = inputs.get("INPUT_STAGES", "").strip()
     stages_list = []
     if stages_input:
         with contextlib.suppress(json.JSONDecodeError):
             stages_list = json.loads(stages_input)
     use_staged = bool(stages_list)
 
-    dry_run = os.environ.get("INPUT_DRY_RUN", "false") == "true"
-    dry_run_install = os.environ.get("INPUT_DRY_RUN_INSTALL", "false") == "true"
-    sync_module_input = os.environ.get("INPUT_SYNC_MODULE", "true") == "true"
-    site = os.environ.get("INPUT_SITE", shared_defaults["hpc"]["site"])
+    dry_run = inputs.get("INPUT_DRY_RUN", "false") == "true"
+    dry_run_install = inputs.get("INPUT_DRY_RUN_INSTALL", "false") == "true"
+    sync_module_input = inputs.get("INPUT_SYNC_MODULE", "true") == "true"
+    site = inputs.get("INPUT_SITE", shared_defaults["hpc"]["site"])
     do_sync = not dry_run and sync_module_input and site != "ag-batch"
 
-    install_prefix_input = os.environ.get("INPUT_INSTALL_PREFIX", "").strip()
-    dry_run_install_prefix_input = os.environ.get("INPUT_DRY_RUN_INSTALL_PREFIX", "").strip()
-    repository = os.environ["GITHUB_REPOSITORY"]
-    module_name = os.environ.get("INPUT_MODULE_NAME", "").strip() or repository.split("/")[-1]
-    ref_name = os.environ["INPUT_REF_NAME"]
+    install_prefix_input = inputs.get("INPUT_INSTALL_PREFIX", "").strip()
+    dry_run_install_prefix_input = inputs.get("INPUT_DRY_RUN_INSTALL_PREFIX", "").strip()
+    repository = inputs["GITHUB_REPOSITORY"]
+    module_name = inputs.get("INPUT_MODULE_NAME", "").strip() or repository.split("/")[-1]
+    ref_name = inputs["INPUT_REF_NAME"]
     safe_ref_name = ref_name.replace("/", "-")  # Sanitize for use in paths
-    prefix_compiler_specific = os.environ.get("INPUT_PREFIX_COMPILER_SPECIFIC", "false") == "true"
+    prefix_compiler_specific = inputs.get("INPUT_PREFIX_COMPILER_SPECIFIC", "false") == "true"
 
     if install_prefix_input:
         install_prefix = install_prefix_input
@@ -59,11 +58,9 @@ def main():
 
     if dry_run and dry_run_install:
         if not module_name:
-            print("::error::dry_run_install requires a non-empty module_name")
-            sys.exit(1)
+            raise ValueError("dry_run_install requires a non-empty module_name")
         if not safe_ref_name:
-            print("::error::dry_run_install requires a non-empty ref_name")
-            sys.exit(1)
+            raise ValueError("dry_run_install requires a non-empty ref_name")
         if dry_run_install_prefix_input:
             install_prefix = dry_run_install_prefix_input
         else:
@@ -85,11 +82,10 @@ def main():
         if path.startswith("/usr/local/apps/"):
             resolved = os.path.realpath(path)
             if not re.match(r"^/usr/local/apps/[^/]+/.+$", resolved):
-                print(
-                    f"::error::{label}: resolved path '{resolved}' (from '{path}') "
+                raise ValueError(
+                    f"{label}: resolved path '{resolved}' (from '{path}') "
                     "is not deep enough — must be at least /usr/local/apps/<app>/<version>"
                 )
-                sys.exit(1)
     install_prefix = (
         os.path.realpath(install_prefix) if install_prefix.startswith("/usr/local/apps/") else install_prefix
     )
@@ -99,20 +95,38 @@ def main():
         else base_install_prefix
     )
 
+    return {
+        "use_staged": "true" if use_staged else "false",
+        "do_sync": "true" if do_sync else "false",
+        "install_prefix": install_prefix,
+        "base_install_prefix": base_install_prefix,
+        **compiler_info,
+    }
+
+
+def main():
+    # Load shared defaults and the platform map
+    action_path = Path(os.environ["GITHUB_ACTION_PATH"])
+    with open(action_path.parent / "defaults.yml") as f:
+        shared_defaults = yaml.safe_load(f)
+    platform_map = load_platforms(action_path)
+
+    try:
+        outputs = resolve_config(os.environ, shared_defaults, platform_map)
+    except ValueError as e:
+        print(f"::error::{e}")
+        sys.exit(1)
+
     # Write outputs
     with open(os.environ["GITHUB_OUTPUT"], "a", encoding="utf-8") as f:
-        f.write(f"use_staged={'true' if use_staged else 'false'}\n")
-        f.write(f"do_sync={'true' if do_sync else 'false'}\n")
-        f.write(f"install_prefix={install_prefix}\n")
-        f.write(f"base_install_prefix={base_install_prefix}\n")
-        for key, value in compiler_info.items():
+        for key, value in outputs.items():
             f.write(f"{key}={value}\n")
 
-    print(f"Platform: {platform}")
-    print(f"Compiler: {compiler_info['compiler']}")
-    print(f"Build mode: {'staged' if use_staged else 'standard'}")
-    print(f"Install prefix: {install_prefix}")
-    print(f"Do sync: {do_sync}")
+    print(f"Platform: {os.environ['INPUT_PLATFORM']}")
+    print(f"Compiler: {outputs['compiler']}")
+    print(f"Build mode: {'staged' if outputs['use_staged'] == 'true' else 'standard'}")
+    print(f"Install prefix: {outputs['install_prefix']}")
+    print(f"Do sync: {outputs['do_sync'] == 'true'}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Generate README.txt and a manifest of package versions from an HPC build log.
+
+This script is embedded into the generated job script and runs on the HPC
+node with the system python3, so it must stay compatible with Python 3.6 and
+must not contain Jinja delimiters.
+
+The log is processed as a stream of lines, so memory use does not grow with
+the size of the log, and may be gzip compressed. README.txt lists the
+package lines printed by ecbuild (first occurrence of each package) and the
+"-- system" lines, tagged with the stage of staged builds. build-manifest.json
+records the packages and versions detected in every stage, and the
+fingerprint of the build inputs from the load-config matrix.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+import sys
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+STAGE_RE = re.compile(r"::STAGE_MARKER::(\S+)")
+PACKAGE_LINE_RE = re.compile(r"^--\s+\[")
+PACKAGE_NAME_RE = re.compile(r"\[([^\]]+)\]")
+VERSION_RE = re.compile(r"\(([^)]*)\)")
+STAGE_MARKER = "::STAGE_MARKER::"
+GZIP_MAGIC = b"\x1f\x8b"
+README_PREVIEW = 10
+
+
+def open_log(path):
+    """Open a plain or gzip compressed log as text, replacing undecodable bytes."""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if compressed:
+        return io.TextIOWrapper(gzip.open(path, "rb"), errors="replace")
+    return open(path, "r", errors="replace")
+
+
+def parse_package_line(line, name_match):
+    """Package name and version of an ecbuild line like "-- [eckit] (1.28.0) [a1b2c3d]"."""
+    version = VERSION_RE.search(line, name_match.end())
+    return {"name": name_match.group(1), "version": version.group(1) if version else None, "line": line.strip()}
+
+
+def scan_log(lines):
+    """Collect the README lines and the per stage manifest from the lines of a build log."""
+    seen = set()
+    readme_lines = []
+    stages = [{"name": None, "packages": [], "system": []}]
+
+    for line in lines:
+        if "\x1b" in line:
+            line = ANSI_RE.sub("", line)
+
+        # Track stage markers for staged builds
+        if STAGE_MARKER in line:
+            stage_match = STAGE_RE.search(line)
+            if stage_match:
+                stages.append({"name": stage_match.group(1), "packages": [], "system": []})
+            continue
+
+        if line.startswith("--") and PACKAGE_LINE_RE.match(line):
+            name_match = PACKAGE_NAME_RE.search(line)
+            if not name_match:
+                continue
+            package = parse_package_line(line, name_match)
+            stages[-1]["packages"].append(package)
+            if package["name"] not in seen:
+                seen.add(package["name"])
+                readme_lines.append(package["line"])
+        elif line.startswith("-- system"):
+            system_line = line.strip()
+            stages[-1]["system"].append(system_line)
+            if stages[-1]["name"]:
+                system_line += " [stage: {}]".format(stages[-1]["name"])
+            readme_lines.append(system_line)
+
+    # Builds without stages have only the unnamed stage, which staged builds leave empty
+    stages = [stage for stage in stages if stage["name"] or stage["packages"] or stage["system"]]
+    return readme_lines, {"stages": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", required=True, help="Build log, optionally gzip compressed")
+    parser.add_argument("--install-prefix", required=True, help="Directory receiving README.txt and the manifest")
+    parser.add_argument("--manifest", default="build-manifest.json", help="File name of the JSON manifest")
+    parser.add_argument("--fingerprint", default="", help="Fingerprint of the build inputs, recorded in the manifest")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.install_prefix):
+        print("Install prefix {} not found, skipping README generation".format(args.install_prefix))
+        return 0
+    if not os.path.exists(args.log):
+        print("Build log not found at {}, skipping README generation".format(args.log))
+        return 0
+
+    with open_log(args.log) as lines:
+        readme_lines, manifest = scan_log(lines)
+
+    if args.fingerprint:
+        manifest["fingerprint"] = args.fingerprint
+    with open(os.path.join(args.install_prefix, args.manifest), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if not readme_lines:
+        print("No package version info found in build log")
+        return 0
+
+    with open(os.path.join(args.install_prefix, "README.txt"), "w") as f:
+        f.write("\n".join(readme_lines) + "\n")
+    print("Generated README.txt with {} entries:".format(len(readme_lines)))
+    print("\n".join(readme_lines[:README_PREVIEW]))
+    if len(readme_lines) > README_PREVIEW:
+        print("... and {} more entries".format(len(readme_lines) - README_PREVIEW))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
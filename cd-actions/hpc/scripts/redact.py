@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Redact secrets from the output of an HPC build job as it streams.
+
+This script is embedded into the generated job script and runs on the HPC
+node with the system python3, so it must stay compatible with Python 3.6 and
+must not contain Jinja delimiters.
+
+The job output is piped through it for the whole build: standard input is
+copied to standard output, to a log file and to a gzip compressed copy of the
+log, with every occurrence of the secrets replaced by [REDACTED], so
+unredacted output never lands on disk. Secrets are read from the environment
+variables starting with REDACT_SECRET rather than from the command line,
+where other users of the node could see them. They are matched together by a
+single alternation of literals, in one pass over the stream. On SIGTERM
+the logs are completed as if the input had ended.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import signal
+import sys
+
+SECRET_PREFIX = "REDACT_SECRET"
+REPLACEMENT = b"[REDACTED]"
+CHUNK_SIZE = 64 * 1024
+
+
+def load_secrets(environ):
+    """Secrets from the environment, ignoring empty and multi-line values."""
+    secrets = set()
+    for name, value in environ.items():
+        if name.startswith(SECRET_PREFIX) and value and "\n" not in value:
+            secrets.add(value.encode())
+    return secrets
+
+
+def compile_matcher(secrets):
+    """One regex matching any of the secrets, preferring the longest at each position."""
+    if not secrets:
+        return None
+    return re.compile(b"|".join(re.escape(secret) for secret in sorted(secrets, key=len, reverse=True)))
+
+
+class Redactor:
+    """Redact a stream fed in arbitrary chunks, holding back bytes that may start a secret."""
+
+    def __init__(self, secrets):
+        self.matcher = compile_matcher(secrets)
+        self.keep = max((len(secret) for secret in secrets), default=1) - 1
+        self.pending = b""
+
+    def feed(self, chunk):
+        """Return the redacted bytes of the stream that are final once chunk is added."""
+        data = self.pending + chunk
+        if self.matcher is None:
+            self.pending = b""
+            return data
+        # A secret starting before limit is complete in data, and secrets never span lines
+        limit = max(len(data) - self.keep, data.rfind(b"\n") + 1)
+        return self._redact(data, limit)
+
+    def flush(self):
+        data = self.pending
+        if self.matcher is None:
+            self.pending = b""
+            return data
+        return self._redact(data, len(data))
+
+    def _redact(self, data, limit):
+        parts = []
+        position = 0
+        for match in self.matcher.finditer(data):
+            if match.start() >= limit:
+                break
+            parts.append(data[position : match.start()])
+            parts.append(REPLACEMENT)
+            position = match.end()
+        boundary = max(position, limit)
+        parts.append(data[position:boundary])
+        self.pending = data[boundary:]
+        return b"".join(parts)
+
+
+class Stopped(Exception):
+    """Raised by the SIGTERM handler, to complete the logs instead of leaving them truncated."""
+
+
+def stop(signum, frame):
+    raise Stopped()
+
+
+class Outputs:
+    """Standard output, the log and its compressed copy. Standard output going away does not stop logging."""
+
+    def __init__(self, log, compressed, compress_level):
+        self.stdout = sys.stdout.buffer
+        self.log = open(log, "wb") if log else None
+        self.compressed = gzip.open(compressed, "wb", compresslevel=compress_level) if compressed else None
+
+    def write(self, data):
+        if not data:
+            return
+        if self.stdout is not None:
+            try:
+                self.stdout.write(data)
+                self.stdout.flush()
+            except BrokenPipeError:
+                self.stdout = None
+        if self.log is not None:
+            self.log.write(data)
+            self.log.flush()
+        if self.compressed is not None:
+            self.compressed.write(data)
+
+    def close(self):
+        for stream in (self.log, self.compressed):
+            if stream is not None:
+                stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", help="Redacted log to write")
+    parser.add_argument("--compressed", help="Gzip compressed copy of the redacted log to write")
+    parser.add_argument("--compress-level", type=int, default=6, help="Gzip compression level")
+    args = parser.parse_args()
+
+    redactor = Redactor(load_secrets(os.environ))
+    outputs = Outputs(args.log, args.compressed, args.compress_level)
+    stdin = sys.stdin.buffer.fileno()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        try:
+            while True:
+                chunk = os.read(stdin, CHUNK_SIZE)
+                if not chunk:
+                    break
+                outputs.write(redactor.feed(chunk))
+        except Stopped:
+            pass
+        outputs.write(redactor.flush())
+    finally:
+        outputs.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Render the HPC job scripts of a whole build matrix in one process.
+
+Takes the matrix generated by load-config and renders the job script and
+sbatch options of every hpc build, as parse_config.py and
+generate_template.py do in each action invocation, but sharing the loaded
+configuration and Jinja environment. Outputs are written as <name>.sh and
+<name>.sbatch. With --check, they are compared with previously generated
+files instead, and the differences are printed.
+"""
+
+import argparse
+import contextlib
+import difflib
+import io
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+import yaml
+from generate_template import generate, load_configs
+from job_templates import create_environment
+from parse_config import load_platforms, resolve_config
+
+ACTION_DIR = Path(__file__).resolve().parent.parent
+# Matrix fields that select the runner rather than configure the build
+RUNNER_FIELDS = {"name", "runner", "type", "container"}
+
+
+def output_name(build_name):
+    return re.sub(r"[^A-Za-z0-9._@+-]", "_", build_name)
+
+
+def build_inputs(item, args):
+    """Environment variables action.yml would set for one matrix entry."""
+    inputs = {f"INPUT_{key.upper()}": str(value) for key, value in item.items() if key not in RUNNER_FIELDS}
+    inputs.update(
+        {
+            "GITHUB_REPOSITORY": args.repository,
+            "INPUT_NAME": item["name"],
+            "INPUT_REF_NAME": args.ref_name,
+            "INPUT_SHA": args.sha,
+            "INPUT_DRY_RUN": "true" if args.dry_run else "false",
+        }
+    )
+    return inputs
+
+
+def render_matrix(matrix, args):
+    """Render every hpc build of the matrix. Returns {output name: (script, sbatch)} and the errors."""
+    with open(ACTION_DIR.parent / "defaults.yml") as f:
+        shared_defaults = yaml.safe_load(f)
+    platform_map = load_platforms(ACTION_DIR)
+    configs = load_configs(ACTION_DIR)
+    jinja_env = create_environment(ACTION_DIR / "templates", args.tool_cache)
+
+    rendered = {}
+    errors = []
+    for item in matrix["include"]:
+        if item.get("type") != "hpc":
+            continue
+        inputs = build_inputs(item, args)
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                step_config = resolve_config(inputs, shared_defaults, platform_map)
+                inputs.update({f"STEP_CONFIG_{key.upper()}": value for key, value in step_config.items()})
+                script, sbatch, _ = generate(inputs, configs, jinja_env)
+        except (ValueError, KeyError) as e:
+            errors.append(f"{item['name']}: {e}")
+            print(log.getvalue(), end="")
+            continue
+        rendered[output_name(item["name"])] = (script, sbatch)
+    return rendered, errors
+
+
+def check_outputs(rendered, output_dir):
+    """Print the differences with previously generated outputs. Returns the number of files that differ."""
+    differences = 0
+    expected_files = set()
+    for name, (script, sbatch) in rendered.items():
+        for suffix, text in [(".sh", script), (".sbatch", sbatch)]:
+            path = output_dir / f"{name}{suffix}"
+            expected_files.add(path.name)
+            current = path.read_text() if path.exists() else ""
+            if current == text + "\n":
+                continue
+            differences += 1
+            print(f"✗ {path} differs")
+            sys.stdout.writelines(
+                difflib.unified_diff(
+                    current.splitlines(keepends=True),
+                    (text + "\n").splitlines(keepends=True),
+                    fromfile=str(path),
+                    tofile=f"{path} (rendered)",
+                )
+            )
+    if output_dir.is_dir():
+        for path in sorted(output_dir.iterdir()):
+            if path.suffix in (".sh", ".sbatch") and path.name not in expected_files:
+                differences += 1
+                print(f"✗ {path} is not generated by any build")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the HPC job scripts of a build matrix")
+    parser.add_argument("matrix", type=Path, help="JSON build matrix from load-config ('-' for stdin)")
+    parser.add_argument("--repository", default=os.environ.get("GITHUB_REPOSITORY"), help="owner/repo being built")
+    parser.add_argument("--ref-name", default="develop", help="Git ref being built")
+    parser.add_argument("--sha", default="", help="Commit being built")
+    parser.add_argument("--dry-run", action="store_true", help="Render dry run jobs")
+    parser.add_argument("--output-dir", type=Path, default=Path("hpc-jobs"), help="Directory of the outputs")
+    parser.add_argument("--check", action="store_true", help="Compare with the outputs instead of writing them")
+    parser.add_argument(
+        "--tool-cache",
+        type=Path,
+        default=os.environ.get("RUNNER_TOOL_CACHE"),
+        help="Directory for precompiled templates",
+    )
+    args = parser.parse_args()
+    if not args.repository:
+        parser.error("--repository is required when GITHUB_REPOSITORY is not set")
+
+    matrix_text = sys.stdin.read() if str(args.matrix) == "-" else args.matrix.read_text()
+    rendered, errors = render_matrix(json.loads(matrix_text), args)
+    for error in errors:
+        print(f"::error::{error}")
+
+    if args.check:
+        differences = check_outputs(rendered, args.output_dir)
+        if differences or errors:
+            print(f"✗ {differences} file(s) differ, {len(errors)} build(s) failed")
+            sys.exit(1)
+        print(f"✓ {len(rendered)} build(s) match {args.output_dir}")
+        return
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for name, (script, sbatch) in rendered.items():
+        (args.output_dir / f"{name}.sh").write_text(script + "\n")
+        (args.output_dir / f"{name}.sbatch").write_text(sbatch + "\n")
+    print(f"✓ Rendered {len(rendered)} build(s) to {args.output_dir}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Machine-readable timeline of the groups of an HPC build job.
+
+This script is embedded into the generated job script and runs on the HPC
+node with the system python3, so it must stay compatible with Python 3.6 and
+must not contain Jinja delimiters. It also works as a standalone tool to
+summarise and compare timelines of different runs.
+
+The job script appends one JSON event per line to $BUILD_TIMELINE: group
+starts and ends (from start_group/end_group), commands run through
+"timeline.py exec" with their exit code, CPU time and peak RSS, and artifact
+cache hits and misses. Events carry the PID of the shell that emitted them,
+so groups of dependencies built side by side are told apart. "finish" turns
+the events into a JSON timeline next to build.log and prints a summary.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+VERSION = 1
+
+
+def append_event(path, event):
+    """Append an event to the timeline file, never failing the build."""
+    if not path:
+        return
+    event.setdefault("time", time.time())
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+    except OSError:
+        pass
+
+
+def load_events(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    events.sort(key=lambda event: event.get("time", 0))
+    return events
+
+
+def new_group(name, package, start):
+    return {
+        "name": name,
+        "package": package,
+        "start": start,
+        "end": None,
+        "duration": None,
+        "status": "incomplete",
+        "exit_code": None,
+        "cache": None,
+        "peak_rss_kib": None,
+        "cpu_seconds": 0.0,
+        "commands": [],
+    }
+
+
+def build_timeline(events, status, now):
+    """Assemble events into groups. Groups never ended are closed at now."""
+    groups = []
+    open_groups = {}  # shell PID -> stack of open groups
+    for event in events:
+        kind = event.get("event")
+        stack = open_groups.setdefault(event.get("shell"), [])
+        if kind == "start":
+            group = new_group(event.get("group", ""), event.get("package") or None, event["time"])
+            groups.append(group)
+            stack.append(group)
+            continue
+        if not stack:
+            continue
+        group = stack[-1]
+        if kind == "end":
+            stack.pop()
+            group["end"] = event["time"]
+            if group["status"] == "incomplete":
+                group["status"] = "ok"
+                group["exit_code"] = 0
+        elif kind == "command":
+            group["commands"].append({key: event[key] for key in event if key not in ("event", "shell")})
+            group["cpu_seconds"] += event.get("user", 0) + event.get("sys", 0)
+            if event.get("peak_rss_kib") is not None:
+                group["peak_rss_kib"] = max(group["peak_rss_kib"] or 0, event["peak_rss_kib"])
+            if event.get("exit_code"):
+                group["status"] = "failed"
+                group["exit_code"] = event["exit_code"]
+        elif kind == "cache":
+            group["cache"] = event.get("result")
+
+    for group in groups:
+        end = group["end"] if group["end"] is not None else now
+        group["duration"] = round(end - group["start"], 3)
+
+    start = events[0]["time"] if events else now
+    return {
+        "version": VERSION,
+        "status": status,
+        "start": datetime.datetime.utcfromtimestamp(start).isoformat() + "Z",
+        "duration": round(now - start, 3),
+        "groups": [dict(group, start=round(group["start"] - start, 3)) for group in groups],
+    }
+
+
+def format_rss(kib):
+    if kib is None:
+        return "-"
+    if kib < 1024 * 1024:
+        return "{:.0f} MiB".format(kib / 1024)
+    return "{:.1f} GiB".format(kib / 1024 / 1024)
+
+
+def group_label(group):
+    if group["package"] and group["package"] not in group["name"]:
+        return "{} [{}]".format(group["name"], group["package"])
+    return group["name"]
+
+
+def print_summary(timeline, top=10):
+    print("Build timeline: {}, {:.1f}s".format(timeline["status"], timeline["duration"]))
+    print("  {:>8}  {:>9}  {:<10}  {:<5}  {:>9}  {}".format("start", "duration", "status", "cache", "peak RSS", "group"))
+    for group in timeline["groups"]:
+        print(
+            "  {:>7.1f}s  {:>8.1f}s  {:<10}  {:<5}  {:>9}  {}".format(
+                group["start"],
+                group["duration"],
+                group["status"],
+                group["cache"] or "-",
+                format_rss(group["peak_rss_kib"]),
+                group_label(group),
+            )
+        )
+
+    slowest = sorted(timeline["groups"], key=lambda group: group["duration"], reverse=True)[:top]
+    print("\nSlowest groups:")
+    for group in slowest:
+        print("  {:>8.1f}s  {}".format(group["duration"], group_label(group)))
+
+    # Groups of dependencies built side by side overlap, so these are not wall time shares
+    packages = {}
+    for group in timeline["groups"]:
+        if group["package"]:
+            packages[group["package"]] = packages.get(group["package"], 0) + group["duration"]
+    if packages:
+        print("\nTime per package:")
+        for package, duration in sorted(packages.items(), key=lambda item: item[1], reverse=True):
+            print("  {:>8.1f}s  {}".format(duration, package))
+
+
+def group_keys(timeline):
+    """Key groups by package, name and occurrence, so the same group matches across runs."""
+    seen = {}
+    keyed = {}
+    for group in timeline["groups"]:
+        base = (group["package"] or "", group["name"])
+        seen[base] = seen.get(base, 0) + 1
+        keyed[base + (seen[base],)] = group
+    return keyed
+
+
+def print_comparison(before, after, top=20):
+    print(
+        "Build duration: {:.1f}s -> {:.1f}s ({:+.1f}s)".format(
+            before["duration"], after["duration"], after["duration"] - before["duration"]
+        )
+    )
+    old, new = group_keys(before), group_keys(after)
+    rows = []
+    for key in list(old) + [key for key in new if key not in old]:
+        old_duration = old[key]["duration"] if key in old else None
+        new_duration = new[key]["duration"] if key in new else None
+        delta = (new_duration or 0) - (old_duration or 0)
+        rows.append((abs(delta), delta, old_duration, new_duration, old.get(key) or new.get(key)))
+    rows.sort(key=lambda row: row[0], reverse=True)
+
+    def seconds(value):
+        return "-" if value is None else "{:.1f}s".format(value)
+
+    print("  {:>9}  {:>9}  {:>9}  {}".format("before", "after", "change", "group"))
+    for _, delta, old_duration, new_duration, group in rows[:top]:
+        print(
+            "  {:>9}  {:>9}  {:>+8.1f}s  {}".format(seconds(old_duration), seconds(new_duration), delta, group_label(group))
+        )
+
+
+def cmd_exec(args):
+    """Run a command like the bash time keyword, recording it in the timeline."""
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    start = time.time()
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - start
+    if os.WIFSIGNALED(status):
+        exit_code = 128 + os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+
+    sys.stderr.write(
+        "\nreal {:.2f}s  user {:.2f}s  sys {:.2f}s  peak RSS {}\n".format(
+            wall, usage.ru_utime, usage.ru_stime, format_rss(usage.ru_maxrss)
+        )
+    )
+    append_event(
+        os.environ.get("BUILD_TIMELINE"),
+        {
+            "event": "command",
+            "shell": os.getppid(),
+            "command": " ".join(command),
+            "time": start,
+            "duration": round(wall, 3),
+            "exit_code": exit_code,
+            "user": round(usage.ru_utime, 3),
+            "sys": round(usage.ru_stime, 3),
+            "peak_rss_kib": usage.ru_maxrss,
+        },
+    )
+    return exit_code
+
+
+def cmd_finish(args):
+    timeline = build_timeline(load_events(args.events), args.status, time.time())
+    with open(args.output, "w") as f:
+        json.dump(timeline, f, indent=2)
+    print_summary(timeline)
+    print("\nTimeline written to {}".format(args.output))
+    return 0
+
+
+def cmd_summary(args):
+    with open(args.timeline) as f:
+        print_summary(json.load(f), args.top)
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print_comparison(before, after, args.top)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("exec", help="Run and time a command, recording it in $BUILD_TIMELINE")
+    run.add_argument("command", nargs=argparse.REMAINDER)
+    run.set_defaults(func=cmd_exec)
+
+    finish = subparsers.add_parser("finish", help="Write the JSON timeline of the job events and summarise it")
+    finish.add_argument("--events", required=True, help="Events appended by the job")
+    finish.add_argument("--status", required=True, help="Outcome of the job")
+    finish.add_argument("--output", required=True, help="JSON timeline to write")
+    finish.set_defaults(func=cmd_finish)
+
+    summary = subparsers.add_parser("summary", help="Summarise a JSON timeline")
+    summary.add_argument("timeline")
+    summary.add_argument("--top", type=int, default=10, help="Number of slowest groups to list")
+    summary.set_defaults(func=cmd_summary)
+
+    compare = subparsers.add_parser("compare", help="Compare the JSON timelines of two runs")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--top", type=int, default=20, help="Number of groups to list")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("a command is required")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
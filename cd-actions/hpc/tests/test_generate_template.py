@@ -0,0 +1,62 @@
+"""Tests for how generate_template.py hands the helper scripts to ci-hpc-generic."""
+
+import sys
+from pathlib import Path
+
+import jinja2
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import generate_template  # noqa: E402
+from job_templates import create_environment  # noqa: E402
+
+ACTION_DIR = Path(__file__).resolve().parent.parent
+
+
+def inputs(**extra):
+    return {
+        "GITHUB_REPOSITORY": "ecmwf/mypkg",
+        "INPUT_REF_NAME": "develop",
+        "STEP_CONFIG_COMPILER": "gnu-14.2.0",
+        "STEP_CONFIG_COMPILER_MODULES": "prgenv/gnu,gcc/14.2.0",
+        "STEP_CONFIG_INSTALL_PREFIX": "/usr/local/apps/mypkg/develop",
+        "STEP_CONFIG_BASE_INSTALL_PREFIX": "/usr/local/apps/mypkg/develop",
+        "INPUT_DEPENDENCIES": "ecmwf/ecbuild@develop\necmwf/eckit@develop",
+        **extra,
+    }
+
+
+@pytest.fixture(scope="module")
+def configs():
+    return generate_template.load_configs(ACTION_DIR)
+
+
+def test_helper_scripts_data_round_trips(configs):
+    data = yaml.safe_load(generate_template.helper_scripts_data(configs["helper_scripts"]))
+
+    assert data == {"helper_scripts": configs["helper_scripts"]}
+
+
+def test_job_script_installs_helpers_from_template_data(configs):
+    script, _, _ = generate_template.generate(inputs(), configs, create_environment())
+
+    for name, source in configs["helper_scripts"].items():
+        assert source not in script
+        assert f"{{{{ helper_scripts['{name}'] }}}}" in script
+
+    # Rendered again by ci-hpc-generic with the template data, the helpers are written out in full
+    data = yaml.safe_load(
+        "github_user: user\ngithub_token: token\n" + generate_template.helper_scripts_data(configs["helper_scripts"])
+    )
+    final = jinja2.Template(script).render(**data)
+    redact = configs["helper_scripts"]["redact.py"]
+    assert f"/redact.py << 'HELPER_SCRIPT'\n{redact}\nHELPER_SCRIPT\n" in final
+
+
+def test_oversized_job_script_is_rejected(configs):
+    dependencies = "\n".join(f"ecmwf/package{i}@develop" for i in range(100))
+
+    with pytest.raises(ValueError, match="over the limit of 131072 bytes.*TEMPLATE_INPUT"):
+        generate_template.generate(inputs(INPUT_DEPENDENCIES=dependencies), configs, create_environment())
@@ -0,0 +1,177 @@
+"""Tests for readme.py, checking the README.txt and manifest it writes for small build logs."""
+
+import gzip
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import readme  # noqa: E402
+
+PLAIN_LOG = """\
+Loading modules
+-- [ecbuild] (3.8.0)
+-- [eckit] (1.28.0) [a1b2c3d]
+-- system: Linux x86_64
+-- The C compiler identification is GNU 12.2.0
+-- [eckit] (1.28.0) [a1b2c3d]
+"""
+
+STAGED_LOG = """\
+::STAGE_MARKER::single
+-- [eckit] (1.28.0)
+-- [atlas] (0.40.0) [deadbee]
+-- system: Linux x86_64
+::STAGE_MARKER::double
+-- [eckit] (1.28.0)
+-- [atlas] (0.41.0)
+-- system: Linux aarch64
+"""
+
+
+def run_readme(monkeypatch, log, install_prefix, *extra_args):
+    monkeypatch.setattr(
+        sys, "argv", ["readme.py", "--log", str(log), "--install-prefix", str(install_prefix), *extra_args]
+    )
+    return readme.main()
+
+
+@pytest.fixture
+def prefix(tmp_path):
+    prefix = tmp_path / "install"
+    prefix.mkdir()
+    return prefix
+
+
+def test_readme_lists_first_occurrence_of_each_package(monkeypatch, tmp_path, prefix):
+    log = tmp_path / "build.log"
+    log.write_text(PLAIN_LOG)
+
+    assert run_readme(monkeypatch, log, prefix) == 0
+
+    assert (prefix / "README.txt").read_text().splitlines() == [
+        "-- [ecbuild] (3.8.0)",
+        "-- [eckit] (1.28.0) [a1b2c3d]",
+        "-- system: Linux x86_64",
+    ]
+
+
+def test_readme_strips_ansi_colours(monkeypatch, tmp_path, prefix):
+    log = tmp_path / "build.log"
+    log.write_text("\x1b[1;32m-- [eckit]\x1b[0m (\x1b[33m1.28.0\x1b[0m)\n\x1b[0m-- system: Linux\n")
+
+    assert run_readme(monkeypatch, log, prefix) == 0
+
+    assert (prefix / "README.txt").read_text() == "-- [eckit] (1.28.0)\n-- system: Linux\n"
+    manifest = json.loads((prefix / "build-manifest.json").read_text())
+    assert manifest["stages"][0]["packages"] == [{"name": "eckit", "version": "1.28.0", "line": "-- [eckit] (1.28.0)"}]
+
+
+def test_manifest_records_versions_per_stage(monkeypatch, tmp_path, prefix):
+    log = tmp_path / "build.log"
+    log.write_text(STAGED_LOG)
+
+    assert run_readme(monkeypatch, log, prefix, "--fingerprint", "f00d") == 0
+
+    manifest = json.loads((prefix / "build-manifest.json").read_text())
+    assert manifest == {
+        "stages": [
+            {
+                "name": "single",
+                "packages": [
+                    {"name": "eckit", "version": "1.28.0", "line": "-- [eckit] (1.28.0)"},
+                    {"name": "atlas", "version": "0.40.0", "line": "-- [atlas] (0.40.0) [deadbee]"},
+                ],
+                "system": ["-- system: Linux x86_64"],
+            },
+            {
+                "name": "double",
+                "packages": [
+                    {"name": "eckit", "version": "1.28.0", "line": "-- [eckit] (1.28.0)"},
+                    {"name": "atlas", "version": "0.41.0", "line": "-- [atlas] (0.41.0)"},
+                ],
+                "system": ["-- system: Linux aarch64"],
+            },
+        ],
+        "fingerprint": "f00d",
+    }
+    # README.txt keeps the first version of each package, and tags system lines with their stage
+    assert (prefix / "README.txt").read_text().splitlines() == [
+        "-- [eckit] (1.28.0)",
+        "-- [atlas] (0.40.0) [deadbee]",
+        "-- system: Linux x86_64 [stage: single]",
+        "-- system: Linux aarch64 [stage: double]",
+    ]
+
+
+def test_manifest_of_unstaged_build_has_one_unnamed_stage(monkeypatch, tmp_path, prefix):
+    log = tmp_path / "build.log"
+    log.write_text(PLAIN_LOG + "-- [fckit]\n")
+
+    assert run_readme(monkeypatch, log, prefix, "--manifest", "versions.json") == 0
+
+    manifest = json.loads((prefix / "versions.json").read_text())
+    assert "fingerprint" not in manifest
+    [stage] = manifest["stages"]
+    assert stage["name"] is None
+    assert [(package["name"], package["version"]) for package in stage["packages"]] == [
+        ("ecbuild", "3.8.0"),
+        ("eckit", "1.28.0"),
+        ("eckit", "1.28.0"),
+        ("fckit", None),
+    ]
+    assert stage["system"] == ["-- system: Linux x86_64"]
+
+
+def test_gzip_log_gives_same_output_as_plain_log(monkeypatch, tmp_path):
+    plain = tmp_path / "build.log"
+    plain.write_text(STAGED_LOG)
+    compressed = tmp_path / "build.log.gz"
+    with gzip.open(compressed, "wt") as f:
+        f.write(STAGED_LOG)
+
+    outputs = []
+    for log in (plain, compressed):
+        prefix = tmp_path / log.name.replace(".", "-")
+        prefix.mkdir()
+        assert run_readme(monkeypatch, log, prefix) == 0
+        outputs.append(((prefix / "README.txt").read_text(), (prefix / "build-manifest.json").read_text()))
+
+    assert outputs[0] == outputs[1]
+
+
+def test_undecodable_bytes_are_replaced(monkeypatch, tmp_path, prefix):
+    log = tmp_path / "build.log"
+    log.write_bytes(b"\xff\xfe garbage\n-- [eckit] (1.28.0)\n")
+
+    assert run_readme(monkeypatch, log, prefix) == 0
+    assert (prefix / "README.txt").read_text() == "-- [eckit] (1.28.0)\n"
+
+
+def test_missing_log_is_skipped(monkeypatch, tmp_path, prefix, capsys):
+    assert run_readme(monkeypatch, tmp_path / "missing.log", prefix) == 0
+
+    assert "Build log not found" in capsys.readouterr().out
+    assert list(prefix.iterdir()) == []
+
+
+def test_missing_install_prefix_is_skipped(monkeypatch, tmp_path, capsys):
+    log = tmp_path / "build.log"
+    log.write_text(PLAIN_LOG)
+
+    assert run_readme(monkeypatch, log, tmp_path / "missing") == 0
+    assert "Install prefix" in capsys.readouterr().out
+
+
+def test_log_without_packages_writes_manifest_only(monkeypatch, tmp_path, prefix, capsys):
+    log = tmp_path / "build.log"
+    log.write_text("make: Nothing to be done\n")
+
+    assert run_readme(monkeypatch, log, prefix) == 0
+
+    assert not (prefix / "README.txt").exists()
+    assert json.loads((prefix / "build-manifest.json").read_text()) == {"stages": []}
+    assert "No package version info found" in capsys.readouterr().out
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Benchmark build matrix generation for large cd-configs.
+
+A synthetic monorepo-style cd-config with common config, overrides and
+builds of every type is expanded by generate_matrix() in process, and by
+generate_matrix.py end to end as action.yml runs it. deep_merge() is also
+timed against its former implementation, which filtered the override list
+at every nested dict, on a large common config with deep override lists.
+Timings are written as JSON.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import yaml
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from generate_matrix import deep_merge, generate_matrix, load_action_config  # noqa: E402
+
+BUILD_TYPES = ["hpc", "hpc", "hpc", "system-package", "conda", "python-pypi", "tarball"]
+SYSTEM_PACKAGE_PLATFORMS = ["rocky-8", "rocky-9", "debian-12", "ubuntu-24.04"]
+
+
+def synthetic_config(builds: int) -> dict:
+    """A cd-config with the given number of builds, cycling through the build types."""
+    config = {
+        "common_config": {
+            "hpc": {
+                "cmake_options": {f"ENABLE_FEATURE_{i}": i % 2 == 0 for i in range(20)},
+                "dependencies": [f"ecmwf/dep{i}@develop" for i in range(8)],
+                "modules": ["python3", "ninja", "cmake"],
+                "env_vars": {"OMP_NUM_THREADS": 1},
+            },
+            "system-package": {"cmake_options": {"ENABLE_TESTS": False}, "package_deps": ["libaec", "libpng"]},
+        },
+        "builds": [],
+    }
+    for i in range(builds):
+        build_type = BUILD_TYPES[i % len(BUILD_TYPES)]
+        build = {"name": f"{build_type}-{i}", "type": build_type, "config": {}}
+        if build_type == "hpc":
+            build["config"] = {
+                "platform": "gnu-14.2.0",
+                "cmake_options": {"ENABLE_MPI": True, f"EXTRA_{i}": i},
+                "dependency_cmake_options": {"ecmwf/dep0": ["-DA=1", "-DB=2"]},
+                "stages": [{"name": "main", "cmake_options": ["-DX=1"]}],
+            }
+            if i % 2:
+                build["common_config_overrides"] = ["modules", "cmake_options.ENABLE_FEATURE_0"]
+        elif build_type == "system-package":
+            build["config"] = {"os": SYSTEM_PACKAGE_PLATFORMS[i % len(SYSTEM_PACKAGE_PLATFORMS)]}
+        config["builds"].append(build)
+    return config
+
+
+def legacy_deep_merge(common, specific, overrides=None, path=""):
+    """deep_merge as it was before override tries."""
+    if overrides is None:
+        overrides = []
+    if "*" in overrides:
+        return specific.copy()
+    result = {}
+    all_keys = set(common.keys()) | set(specific.keys())
+    for key in all_keys:
+        common_val = common.get(key)
+        specific_val = specific.get(key)
+        current_path = f"{path}.{key}" if path else key
+        is_override = key in overrides or current_path in overrides
+        if specific_val is None:
+            result[key] = common_val
+        elif common_val is None or is_override:
+            result[key] = specific_val
+        elif isinstance(common_val, dict) and isinstance(specific_val, dict):
+            nested_overrides = [o for o in overrides if o.startswith(f"{key}.") or o.startswith(f"{current_path}.")]
+            result[key] = legacy_deep_merge(common_val, specific_val, nested_overrides, current_path)
+        elif isinstance(common_val, list) and isinstance(specific_val, list):
+            result[key] = common_val + specific_val
+        else:
+            result[key] = specific_val
+    return result
+
+
+def merge_workload(builds: int, overrides: int) -> tuple[dict, list[tuple[dict, list[str]]]]:
+    """A large common config, and build configs with deep override lists that mostly leave it unchanged."""
+    common = {
+        "dependencies": [f"ecmwf/dep{i}@develop" for i in range(300)],
+        "cmake_options": {f"OPTION_{i}": i for i in range(300)},
+        "stages": [{"name": f"stage{i}", "cmake_options": [f"-DX{i}=1"]} for i in range(20)],
+        "env_vars": {f"VAR_{i}": str(i) for i in range(100)},
+        "sections": {f"s{i}": {f"t{j}": {f"u{k}": k for k in range(5)} for j in range(5)} for i in range(10)},
+    }
+    workload = []
+    for b in range(builds):
+        specific = {
+            "cmake_options": {f"OPTION_{b % 300}": "changed"},
+            "sections": {f"s{b % 10}": {"t0": {"u0": b}}},
+            "modules": ["ninja"],
+        }
+        paths = [f"sections.s{i}.t{j}.u{k}" for i in range(10) for j in range(5) for k in range(5)]
+        workload.append((specific, paths[b % 7 :][:overrides] + ["stages"]))
+    return common, workload
+
+
+def time_deep_merge(merge, common: dict, workload: list, repeats: int) -> dict:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for specific, overrides in workload:
+            merge(common, specific, overrides)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "samples": len(samples),
+    }
+
+
+def time_library(config: dict, action_config: tuple, repeats: int) -> dict:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        generate_matrix(config, *action_config)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def time_cli(config_yaml: str, repeats: int, scratch: Path) -> dict:
+    output = scratch / "github-output"
+    env = {**os.environ, "STEP_LOAD_CONFIG": config_yaml, "GITHUB_OUTPUT": str(output)}
+    samples = []
+    for _ in range(repeats):
+        output.write_text("")
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(SCRIPTS_DIR / "generate_matrix.py")], env=env, check=True)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark build matrix generation")
+    parser.add_argument("--builds", type=int, nargs="+", default=[10, 50, 200], help="Numbers of builds")
+    parser.add_argument("--repeats", type=int, default=20, help="Measurements per size")
+    parser.add_argument("--merge-builds", type=int, default=500, help="Builds merged by the deep_merge benchmark")
+    parser.add_argument("--merge-overrides", type=int, default=100, help="Override paths per build")
+    parser.add_argument("--output", type=Path, default=Path("bench-matrix.json"), help="JSON results file")
+    args = parser.parse_args()
+
+    action_config = load_action_config()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="load-config-bench-") as scratch:
+        for builds in args.builds:
+            config = synthetic_config(builds)
+            print(f"\n=== {builds} builds ===")
+            results[f"{builds}_builds"] = {
+                "generate_matrix": time_library(config, action_config, args.repeats),
+                "cli": time_cli(yaml.safe_dump(config), args.repeats, Path(scratch)),
+            }
+            for name, timing in results[f"{builds}_builds"].items():
+                print(f"  ✓ {name}: {timing['median_ms']:.2f} ms median, {timing['min_ms']:.2f} ms min")
+
+    print(f"\n=== deep_merge, {args.merge_builds} builds, {args.merge_overrides} overrides each ===")
+    common, workload = merge_workload(args.merge_builds, args.merge_overrides)
+    for specific, overrides in workload:
+        if deep_merge(common, specific, overrides) != legacy_deep_merge(common, specific, overrides):
+            print("  ✗ deep_merge differs from the former implementation")
+            sys.exit(1)
+    results["deep_merge"] = {
+        "legacy": time_deep_merge(legacy_deep_merge, common, workload, args.repeats),
+        "trie": time_deep_merge(deep_merge, common, workload, args.repeats),
+    }
+    for name, timing in results["deep_merge"].items():
+        print(f"  ✓ {name}: {timing['median_ms']:.2f} ms median, {timing['min_ms']:.2f} ms min")
+    speedup = results["deep_merge"]["legacy"]["median_ms"] / results["deep_merge"]["trie"]["median_ms"]
+    print(f"  deep_merge is {speedup:.1f}x faster")
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": args.repeats,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
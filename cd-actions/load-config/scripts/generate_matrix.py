@@ -1,35 +1,128 @@
+#!/usr/bin/env python3
+"""Generate the build matrix from a cd-config.yml.
+
+generate_matrix() expands the enabled builds of a configuration into matrix
+entries, one string field per action input. How each field is derived from
+the build config is described by a table of Field per build type, so adding
+an input is a one line change. Invalid configurations raise MatrixError,
+listing every problem with its location in the configuration.
+
+The command line wrapper reads the configuration from a file or, as in
+action.yml, from STEP_LOAD_CONFIG, and writes the matrix to GITHUB_OUTPUT or
+stdout. Warnings and errors go to stderr when the matrix goes to stdout.
+"""
+
+import argparse
+import functools
+import hashlib
+import heapq
 import json
 import os
+import statistics
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
 import yaml
 
-from pathlib import Path
+ACTION_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_RUNNER = ["self-hosted", "platform-builder"]
+SYSTEM_PACKAGE_IMAGE = "eccr.ecmwf.int/platform-builder/platform-builder:{os}"
+# Build types whose entries get a fingerprint and are deduplicated
+FINGERPRINTED_TYPES = {"hpc"}
 
-def deep_merge(common, specific, overrides=None, path=""):
-    if overrides is None:
-        overrides = []
-    if "*" in overrides:
-        return specific.copy()
-    result = {}
-    all_keys = set(common.keys()) | set(specific.keys())
-    for key in all_keys:
+
+class MatrixError(ValueError):
+    """Invalid build configuration, with every problem found."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+# === Config Merging ===
+# Overrides are dotted paths into the config. They are compiled into a trie,
+# nested dicts keyed by path component, where OVERRIDE marks a complete path.
+
+OVERRIDE = None
+OverrideTrie = dict[Any, Any]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_overrides(overrides: tuple[str, ...]) -> OverrideTrie:
+    trie: OverrideTrie = {}
+    for path in overrides:
+        node = trie
+        for part in path.split("."):
+            node = node.setdefault(part, {})
+        node[OVERRIDE] = True
+    return trie
+
+
+def merge_config(common: dict, specific: dict, trie: OverrideTrie) -> dict:
+    """Merge specific into common, sharing every value the build leaves unchanged.
+
+    common is copied only when specific changes it, so the merged configs of
+    builds share the unchanged parts of common_config. Neither input is
+    modified.
+    """
+    result = None
+    for key, specific_val in specific.items():
         common_val = common.get(key)
-        specific_val = specific.get(key)
-        current_path = f"{path}.{key}" if path else key
-        is_override = key in overrides or current_path in overrides
         if specific_val is None:
-            result[key] = common_val
-        elif common_val is None or is_override:
-            result[key] = specific_val
-        elif isinstance(common_val, dict) and isinstance(specific_val, dict):
-            nested_overrides = [o for o in overrides if o.startswith(f"{key}.") or o.startswith(f"{current_path}.")]
-            result[key] = deep_merge(common_val, specific_val, nested_overrides, current_path)
-        elif isinstance(common_val, list) and isinstance(specific_val, list):
-            result[key] = common_val + specific_val
+            if key in common:
+                continue
+            merged = None
         else:
-            result[key] = specific_val
-    return result
+            node = trie.get(key)
+            if common_val is None or (node is not None and OVERRIDE in node):
+                merged = specific_val
+            elif isinstance(common_val, dict) and isinstance(specific_val, dict):
+                merged = merge_config(common_val, specific_val, node or {})
+            elif isinstance(common_val, list) and isinstance(specific_val, list):
+                merged = common_val + specific_val if specific_val else common_val
+            else:
+                merged = specific_val
+        if merged is common_val and key in common:
+            continue
+        if result is None:
+            result = dict(common)
+        result[key] = merged
+    return common if result is None else result
+
+
+def deep_merge(common: dict, specific: dict, overrides: list[str] | None = None) -> dict:
+    """Merge the config of a build into the common config of its type.
+
+    Dicts are merged recursively and lists concatenated, except at the
+    dotted paths listed in overrides, where the build value replaces the
+    common one. "*" replaces the whole common config.
+    """
+    overrides = tuple(overrides or ())
+    if "*" in overrides:
+        return specific.copy()
+    return merge_config(common, specific, compile_overrides(overrides))
+
+
+# === Converters ===
+# Converters turn a config value into the matrix field, raising ValueError
+# with source_name, the location of the value, when its type is wrong.
 
-def list_to_str_comma_separated(source, source_name):
+
+def keep(source: Any, source_name: str) -> Any:
+    return source
+
+
+def to_str(source: Any, source_name: str) -> str:
+    return str(source)
+
+
+def to_json(source: Any, source_name: str) -> str:
+    return json.dumps(source)
+
+
+def list_to_str_comma_separated(source: Any, source_name: str) -> str:
     if isinstance(source, list):
         return ",".join(source)
     elif isinstance(source, str):
@@ -37,15 +130,52 @@ def list_to_str_comma_separated(source, source_name):
     else:
         raise ValueError(f"{source_name} must be a list, got {type(source)}")
 
-def list_to_str_line_separated(source, source_name):
+
+def list_to_str_line_separated(source: Any, source_name: str) -> str:
     if isinstance(source, list):
+        for i, item in enumerate(source):
+            if not isinstance(item, str):
+                raise ValueError(f"{source_name}[{i}] must be a string, got {type(item)}")
         return "\n".join(source)
     elif isinstance(source, str):
         return source
     else:
         raise ValueError(f"{source_name} must be a list, got {type(source)}")
 
-def bool_to_str(source, source_name):
+
+def format_dependency(source: Any, source_name: str) -> str:
+    """An hpc dependency, given as "owner/repo@ref needs: name, name" or as a mapping of repo and needs."""
+    if isinstance(source, str):
+        return source
+    if isinstance(source, dict) and "repo" in source and set(source) <= {"repo", "needs"}:
+        needs = source.get("needs", [])
+        needs = [needs] if isinstance(needs, str) else needs
+        if not isinstance(source["repo"], str) or not isinstance(needs, list):
+            raise ValueError(f"{source_name} must have a string repo and a list of needs")
+        # An empty needs list means the dependency needs nothing, not the one declared before it
+        return f"{source['repo']} needs: {', '.join(needs)}" if "needs" in source else source["repo"]
+    if isinstance(source, dict) and len(source) == 1 and str(next(iter(source))).endswith(" needs"):
+        # YAML reads an unquoted "owner/repo@ref needs: name" as a mapping
+        key, value = next(iter(source.items()))
+        raise ValueError(
+            f'{source_name} must be quoted as "{key}: {value}", or written as {{repo: ..., needs: [...]}}'
+        )
+    raise ValueError(f"{source_name} must be a string or a mapping of repo and needs, got {type(source)}")
+
+
+def dependencies_to_str(source: Any, source_name: str) -> str:
+    if isinstance(source, list):
+        return "\n".join(format_dependency(dep, f"{source_name}[{i}]") for i, dep in enumerate(source))
+    return list_to_str_line_separated(source, source_name)
+
+
+def list_to_str_comma_space_separated(source: Any, source_name: str) -> str:
+    if isinstance(source, list):
+        return ", ".join(source)
+    return str(source)
+
+
+def bool_to_str(source: Any, source_name: str) -> str:
     if isinstance(source, bool):
         return str(source).lower()
     elif isinstance(source, str):
@@ -53,183 +183,439 @@ def bool_to_str(source, source_name):
     else:
         raise ValueError(f"{source_name} must be a bool, got {type(source)}")
 
-def dict_to_str_line_separated(source, source_name):
+
+def dict_to_str_line_separated(source: Any, source_name: str) -> str:
     if isinstance(source, dict):
-        return "\n".join([f"{k}={v}" if v != '' else k for k, v in source.items()])
+        return "\n".join([f"{k}={v}" if v != "" else k for k, v in source.items()])
     elif isinstance(source, str):
         return source
     else:
         raise ValueError(f"{source_name} must be a dict, got {type(source)}")
 
-def dict_to_cmake_args(source, source_name):
+
+def format_cmake_option(k: str, v: Any) -> str:
+    if isinstance(v, bool):
+        v = "ON" if v else "OFF"
+    if not k.startswith("-"):
+        k = f"-D{k}"
+    return f"{k}={v}" if v != "" else k
+
+
+def dict_to_cmake_args(source: Any, source_name: str) -> str:
     if isinstance(source, dict):
-        def format_cmake_option(k, v):
-            if isinstance(v, bool):
-                v = "ON" if v else "OFF"
-            if not k.startswith('-'):
-                k = f"-D{k}"
-            return f"{k}={v}" if v != '' else k
         return "\n".join([format_cmake_option(k, v) for k, v in source.items()])
     elif isinstance(source, str):
         return source
     else:
         raise ValueError(f"{source_name} must be a dict, got {type(source)}")
 
-action_path = Path(os.environ["GITHUB_ACTION_PATH"])
-with open(action_path.parent / "defaults.yml") as f:
-    shared_defaults = yaml.safe_load(f)
 
-config_dir = action_path / "config"
-with open(config_dir / "runners.yml") as f:
-    runners_config = yaml.safe_load(f)
+def dependency_cmake_args(source: Any, source_name: str) -> str:
+    """Like dict_to_cmake_args, with lists of options per dependency joined by commas."""
+    if isinstance(source, dict):
+        source = {repo: ",".join(opts) if isinstance(opts, list) else opts for repo, opts in source.items()}
+    return dict_to_cmake_args(source, source_name)
+
+
+# === Field Schema ===
 
-with open(config_dir / "platforms-system-package.yml") as f:
-    sp_platforms_config = yaml.safe_load(f)
+Converter = Callable[[Any, str], Any]
 
-config_yaml = os.environ["STEP_LOAD_CONFIG"]
-config = yaml.safe_load(config_yaml)
-common_config = config.get("common_config", {})
-matrix = {"include": []}
 
-for build in config.get("builds", []):
-    if build.get("enabled", True):
+@dataclass(frozen=True)
+class Field:
+    """A matrix field taken from the build config key of the same name.
+
+    When the key is missing, the value comes from the defaults.yml section
+    of the build type if shared is set, then from default. It is then
+    passed through convert.
+    """
+
+    key: str
+    convert: Converter = keep
+    default: Any = ""
+    shared: bool = False
+
+
+def shared(key: str, convert: Converter = keep, default: Any = "") -> Field:
+    return Field(key, convert, default, shared=True)
+
+
+MATRIX_FIELDS: dict[str, tuple[Field, ...]] = {
+    "conda": (
+        shared("conda_dir", default="./.cd/conda"),
+        shared("channels", list_to_str_line_separated, ["conda-forge"]),
+        shared("conda_build_args", list_to_str_line_separated, ["--no-anaconda-upload"]),
+        shared("skip_installation_test", bool_to_str, False),
+    ),
+    "python-pypi": (
+        shared("working_directory", default="./"),
+        Field("buildargs"),
+        Field("env_vars", dict_to_str_line_separated, {}),
+    ),
+    "hpc": (
+        # Platform
+        shared("platform", default="gnu-14.2.0"),
+        # Installation
+        Field("install_prefix"),
+        shared("prefix_compiler_specific", bool_to_str, False),
+        # Build Configuration
+        Field("cmake_options", dict_to_cmake_args, {}),
+        Field("ctest_options", list_to_str_line_separated, []),
+        shared("self_test", bool_to_str, True),
+        Field("env_vars", dict_to_str_line_separated, {}),
+        Field("parallel", to_str),
+        Field("dependencies", dependencies_to_str, []),
+        Field("dependency_cmake_options", dependency_cmake_args, {}),
+        Field("python_dependencies", list_to_str_line_separated, []),
+        Field("python_version"),
+        Field("python_requirements"),
+        Field("python_toml_opt_dep_sections", list_to_str_line_separated, []),
+        Field("conda_deps", list_to_str_line_separated, []),
+        Field("stages", to_json, []),
+        Field("modules", list_to_str_line_separated, []),
+        Field("install_command"),
+        shared("lock_permissions", bool_to_str, True),
+        Field("module_name"),
+        Field("ntasks", to_str),
+        Field("gpus", to_str),
+        Field("queue"),
+        Field("post_script"),
+        shared("clean_before_install", bool_to_str, False),
+        shared("dry_run_install", bool_to_str, False),
+        Field("dry_run_install_prefix"),
+        shared("site", default="aa-batch"),
+        shared("sync_module", bool_to_str, True),
+        shared("use_ninja", bool_to_str, True),
+        shared("force_build", bool_to_str, False),
+        shared("ecbundle", bool_to_str, False),
+        Field("bundle_yml"),
+        shared("install_lib_dir", default="lib"),
+        Field("mkdir", list_to_str_line_separated, []),
+        Field("pytest_cmd"),
+        Field("workdir"),
+        Field("output_dir"),
+    ),
+    "tarball": (
+        Field("ecbuild_version"),
+        Field("cmake_options", dict_to_cmake_args, {}),
+        Field("confluence_space"),
+        shared("confluence_page_title", default="Releases"),
+    ),
+    "system-package": (
+        # os, container and the Nexus secrets come from the platform, see platform_fields()
+        Field("package_deps", list_to_str_comma_space_separated, []),
+        shared("skip_version_check", bool_to_str, False),
+        Field("description"),
+        Field("license"),
+        shared("maintainer", default="software@ecmwf.int"),
+        shared("vendor", default="ECMWF"),
+        Field("homepage_url"),
+        shared("install_prefix", default="/opt/ecmwf"),
+        shared("self_test", bool_to_str, True),
+        shared("install_test", bool_to_str, False),
+        Field("install_test_os_image"),
+        Field("install_test_command"),
+        shared("build_type", default="Release"),
+        Field("env"),
+        Field("deb_section"),
+        shared("deb_priority", default="optional"),
+        Field("rpm_group"),
+        Field("dependencies", dependencies_to_str, []),
+        Field("dependency_branch"),
+        Field("cmake_options", dict_to_cmake_args, {}),
+        Field("ctest_options", list_to_str_line_separated, []),
+        Field("dependency_cmake_options", dict_to_cmake_args, {}),
+        shared("cmake", bool_to_str, False),
+        shared("ecbundle", bool_to_str, False),
+        shared("self_build", bool_to_str, True),
+        Field("toolchain_file"),
+        shared("parallelism_factor", to_str, "2"),
+        shared("compiler_cc", default="gcc"),
+        shared("compiler_cxx", default="g++"),
+        shared("compiler_fc", default="gfortran"),
+        Field("cache_suffix"),
+        shared("save_cache", bool_to_str, True),
+        shared("recreate_cache", bool_to_str, False),
+    ),
+}
+
+CompiledFields = list[tuple[str, Any, Converter]]
+
+
+def compile_fields(fields: tuple[Field, ...], defaults: dict) -> CompiledFields:
+    """Resolve the defaults of the fields of a build type once per matrix."""
+    return [
+        (field.key, defaults.get(field.key, field.default) if field.shared else field.default, field.convert)
+        for field in fields
+    ]
+
+
+def platform_fields(build_config: dict, platforms: dict, location: str) -> dict[str, str]:
+    """Container and Nexus secrets of a system-package build, from platforms-system-package.yml."""
+    platform_name = build_config.get("os", "")
+    if platform_name not in platforms:
+        raise ValueError(f"{location}.os: unknown platform '{platform_name}', expected one of {', '.join(platforms)}")
+    platform_defaults = platforms[platform_name]
+    os_id = platform_defaults["os"]
+    return {
+        "container": SYSTEM_PACKAGE_IMAGE.format(os=os_id),
+        "os": os_id,
+        "nexus_token_secret": platform_defaults["nexus_token_secret"],
+        "nexus_url_secret": platform_defaults["nexus_url_secret"],
+    }
+
+
+def expand_build(
+    build: dict,
+    build_config: dict,
+    fields: CompiledFields,
+    runners: dict,
+    platforms: dict,
+    location: str,
+) -> tuple[dict, list[str]]:
+    """Matrix entry of one build and the errors found in its config."""
+    build_type = build["type"]
+    matrix_item = {
+        "name": build["name"],
+        "runner": runners.get(build_type, runners.get("default", DEFAULT_RUNNER)),
+        "type": build_type,
+        "container": "",
+    }
+    errors = []
+    if build_type == "system-package":
+        try:
+            matrix_item.update(platform_fields(build_config, platforms, f"{location}.config"))
+        except ValueError as e:
+            errors.append(str(e))
+    for key, default, convert in fields:
+        try:
+            matrix_item[key] = convert(build_config.get(key, default), f"{location}.config.{key}")
+        except ValueError as e:
+            errors.append(str(e))
+    if build_type in FINGERPRINTED_TYPES and not errors:
+        matrix_item["fingerprint"] = build_fingerprint(matrix_item)
+    return matrix_item, errors
+
+
+def build_fingerprint(matrix_item: dict) -> str:
+    """Hash of every input of a build but its name, equal for builds that produce the same install."""
+    inputs = {key: value for key, value in matrix_item.items() if key not in ("name", "fingerprint")}
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def deduplicate(matrix: dict) -> tuple[dict, list[tuple[str, str]]]:
+    """Drop the builds identical to an earlier one of the matrix.
+
+    Identical builds would build from scratch twice and race to install the
+    same prefix. Returns the matrix and the (duplicate, original) build
+    names.
+    """
+    first = {}
+    duplicates = []
+    include = []
+    for item in matrix["include"]:
+        fingerprint = item.get("fingerprint")
+        if fingerprint in first:
+            duplicates.append((item["name"], first[fingerprint]))
+            continue
+        if fingerprint:
+            first[fingerprint] = item["name"]
+        include.append(item)
+    return {"include": include}, duplicates
+
+
+def validate_build(build: Any, location: str) -> list[str]:
+    if not isinstance(build, dict):
+        return [f"{location} must be a mapping, got {type(build)}"]
+    errors = []
+    for key in ("name", "type"):
+        if not isinstance(build.get(key), str) or not build.get(key):
+            errors.append(f"{location}.{key} is required and must be a string")
+    if not isinstance(build.get("config") or {}, dict):
+        errors.append(f"{location}.config must be a mapping, got {type(build['config'])}")
+    if not isinstance(build.get("common_config_overrides", []), list):
+        errors.append(f"{location}.common_config_overrides must be a list")
+    return errors
+
+
+def generate_matrix(config: dict, defaults: dict, runners: dict, platforms: dict) -> dict:
+    """Expand the enabled builds of a cd-config into a GitHub Actions matrix.
+
+    defaults is the shared defaults.yml, runners and platforms the
+    runners.yml and platforms-system-package.yml of this action. Raises
+    MatrixError listing every invalid value of the configuration.
+    """
+    if not isinstance(config, dict):
+        raise MatrixError([f"configuration must be a mapping, got {type(config)}"])
+    common_config = config.get("common_config") or {}
+    builds = config.get("builds") or []
+    errors = []
+    if not isinstance(common_config, dict):
+        errors.append("common_config must be a mapping")
+        common_config = {}
+    if not isinstance(builds, list):
+        raise MatrixError(errors + ["builds must be a list"])
+
+    compiled = {}
+    matrix = {"include": []}
+    for index, build in enumerate(builds):
+        location = f"builds[{index}]"
+        if isinstance(build, dict) and not build.get("enabled", True):
+            continue
+        build_errors = validate_build(build, location)
+        if build_errors:
+            errors.extend(build_errors)
+            continue
+        location = f"{location} ({build['name']})"
+
         build_type = build["type"]
-        build_config_raw = build.get("config", {})
-        overrides = build.get("common_config_overrides", [])
-        type_common = common_config.get(build_type, {})
-        build_config = deep_merge(type_common, build_config_raw, overrides)
-
-        matrix_item = {
-            "name": build["name"],
-            "runner": runners_config.get(build_type, runners_config.get("default", ["self-hosted", "platform-builder"])),
-            "type": build_type,
-            "container": "",
+        if build_type not in compiled:
+            compiled[build_type] = compile_fields(MATRIX_FIELDS.get(build_type, ()), defaults.get(build_type, {}))
+        build_config = deep_merge(
+            common_config.get(build_type) or {}, build.get("config") or {}, build.get("common_config_overrides", [])
+        )
+        matrix_item, build_errors = expand_build(build, build_config, compiled[build_type], runners, platforms, location)
+        errors.extend(build_errors)
+        matrix["include"].append(matrix_item)
+
+    if errors:
+        raise MatrixError(errors)
+    return matrix
+
+
+# === Scheduling ===
+# Durations are the seconds previous runs of each build took, keyed by build
+# name. Builds without history are predicted to take the median duration.
+
+
+def load_durations(path: Path) -> dict[str, float]:
+    """Read a JSON object of build name to seconds. Raises MatrixError for invalid values."""
+    try:
+        durations = json.loads(path.read_text())
+    except json.JSONDecodeError as e:
+        raise MatrixError([f"{path}: {e}"]) from e
+    if not isinstance(durations, dict):
+        raise MatrixError([f"{path} must be a JSON object of build name to seconds"])
+    errors = [
+        f"{path}: duration of {name!r} must be a non-negative number, got {seconds!r}"
+        for name, seconds in durations.items()
+        if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds < 0
+    ]
+    if errors:
+        raise MatrixError(errors)
+    return {name: float(seconds) for name, seconds in durations.items()}
+
+
+def predict_durations(matrix: dict, durations: dict[str, float]) -> list[float]:
+    """Predicted seconds of each matrix entry, in matrix order."""
+    known = [durations[item["name"]] for item in matrix["include"] if item["name"] in durations]
+    fallback = statistics.median(known) if known else 0.0
+    return [durations.get(item["name"], fallback) for item in matrix["include"]]
+
+
+def order_by_duration(matrix: dict, durations: dict[str, float]) -> dict:
+    """The matrix with the longest builds first, so they start first. Ties keep the config order."""
+    predicted = predict_durations(matrix, durations)
+    order = sorted(range(len(predicted)), key=lambda index: -predicted[index])
+    return {"include": [matrix["include"][index] for index in order]}
+
+
+def shard_matrix(matrix: dict, shards: int, durations: dict[str, float]) -> list[dict]:
+    """Split the matrix into shards of balanced predicted duration.
+
+    Builds are assigned longest first to the shard predicted to finish
+    first (LPT scheduling). Returns one entry per non-empty shard, with its
+    matrix ordered longest first.
+    """
+    predicted = predict_durations(matrix, durations)
+    order = sorted(range(len(predicted)), key=lambda index: -predicted[index])
+    # (predicted seconds, builds, shard) so shards without history are filled round robin
+    heap = [(0.0, 0, shard) for shard in range(max(shards, 1))]
+    assigned: list[list[int]] = [[] for _ in heap]
+    for index in order:
+        total, count, shard = heapq.heappop(heap)
+        assigned[shard].append(index)
+        heapq.heappush(heap, (total + predicted[index], count + 1, shard))
+    return [
+        {
+            "shard": shard,
+            "predicted_seconds": round(sum(predicted[index] for index in indices)),
+            "matrix": {"include": [matrix["include"][index] for index in indices]},
         }
+        for shard, indices in enumerate(assigned)
+        if indices
+    ]
 
-        d = shared_defaults.get(build_type, {})
-
-        if build_type == "conda":
-            matrix_item["conda_dir"] = build_config.get("conda_dir", d.get("conda_dir", "./.cd/conda"))
-            matrix_item["channels"] = list_to_str_line_separated(build_config.get("channels", d.get("channels", ["conda-forge"])), "channels")
-            matrix_item["conda_build_args"] = list_to_str_line_separated(build_config.get("conda_build_args", d.get("conda_build_args", ["--no-anaconda-upload"])), "conda_build_args")
-            matrix_item["skip_installation_test"] = bool_to_str(build_config.get("skip_installation_test", d.get("skip_installation_test", False)), "skip_installation_test")
-
-        elif build_type == "python-pypi":
-            matrix_item["working_directory"] = build_config.get("working_directory", d.get("working_directory", "./"))
-            matrix_item["buildargs"] = build_config.get("buildargs", "")
-            matrix_item["env_vars"] = dict_to_str_line_separated(build_config.get("env_vars", {}), "env_vars")
-
-        elif build_type == "hpc":
-            # Platform
-            matrix_item["platform"] = build_config.get("platform", d.get("platform", "gnu-14.2.0"))
-
-            # Installation
-            matrix_item["install_prefix"] = build_config.get("install_prefix", "")
-            matrix_item["prefix_compiler_specific"] = bool_to_str(build_config.get("prefix_compiler_specific", d.get("prefix_compiler_specific", False)), "prefix_compiler_specific")
-
-            # Build Configuration
-            matrix_item["cmake_options"] = dict_to_cmake_args(build_config.get("cmake_options", {}), "cmake_options")
-            matrix_item["ctest_options"] = list_to_str_line_separated(build_config.get("ctest_options", []), "ctest_options")
-            matrix_item["self_test"] = bool_to_str(build_config.get("self_test", d.get("self_test", True)), "self_test")
-            matrix_item["env_vars"] = dict_to_str_line_separated(build_config.get("env_vars", {}), "env_vars")
-            matrix_item["parallel"] = str(build_config.get("parallel", ""))
-            matrix_item["dependencies"] = list_to_str_line_separated(build_config.get("dependencies", []), "dependencies")
-            dep_cmake_raw = build_config.get("dependency_cmake_options", {})
-            dep_cmake_processed = {}
-            for repo, opts in dep_cmake_raw.items():
-                if isinstance(opts, list):
-                    dep_cmake_processed[repo] = ",".join(opts)
-                else:
-                    dep_cmake_processed[repo] = opts
-            matrix_item["dependency_cmake_options"] = dict_to_cmake_args(dep_cmake_processed, "dependency_cmake_options")
-            matrix_item["python_dependencies"] = list_to_str_line_separated(build_config.get("python_dependencies", []), "python_dependencies")
-            matrix_item["python_version"] = build_config.get("python_version", "")
-            matrix_item["python_requirements"] = build_config.get("python_requirements", "")
-            matrix_item["python_toml_opt_dep_sections"] = list_to_str_line_separated(build_config.get("python_toml_opt_dep_sections", []), "python_toml_opt_dep_sections")
-            matrix_item["conda_deps"] = list_to_str_line_separated(build_config.get("conda_deps", []), "conda_deps")
-            matrix_item["stages"] = json.dumps(build_config.get("stages", []))
-            matrix_item["modules"] = list_to_str_line_separated(build_config.get("modules", []), "modules")
-            matrix_item["install_command"] = build_config.get("install_command", "")
-            matrix_item["lock_permissions"] = bool_to_str(build_config.get("lock_permissions", d.get("lock_permissions", True)), "lock_permissions")
-            matrix_item["module_name"] = build_config.get("module_name", "")
-            matrix_item["ntasks"] = str(build_config.get("ntasks", ""))
-            matrix_item["gpus"] = str(build_config.get("gpus", ""))
-            matrix_item["queue"] = build_config.get("queue", "")
-            matrix_item["post_script"] = build_config.get("post_script", "")
-            matrix_item["clean_before_install"] = bool_to_str(build_config.get("clean_before_install", d.get("clean_before_install", False)), "clean_before_install")
-            matrix_item["dry_run_install"] = bool_to_str(build_config.get("dry_run_install", d.get("dry_run_install", False)), "dry_run_install")
-            matrix_item["dry_run_install_prefix"] = build_config.get("dry_run_install_prefix", "")
-            matrix_item["site"] = build_config.get("site", d.get("site", "aa-batch"))
-            matrix_item["sync_module"] = bool_to_str(build_config.get("sync_module", d.get("sync_module", True)), "sync_module")
-            matrix_item["use_ninja"] = bool_to_str(build_config.get("use_ninja", d.get("use_ninja", True)), "use_ninja")
-            matrix_item["force_build"] = bool_to_str(build_config.get("force_build", d.get("force_build", False)), "force_build")
-            matrix_item["ecbundle"] = bool_to_str(build_config.get("ecbundle", d.get("ecbundle", False)), "ecbundle")
-            matrix_item["bundle_yml"] = build_config.get("bundle_yml", "")
-            matrix_item["install_lib_dir"] = build_config.get("install_lib_dir", d.get("install_lib_dir", "lib"))
-            matrix_item["mkdir"] = list_to_str_line_separated(build_config.get("mkdir", []), "mkdir")
-            matrix_item["pytest_cmd"] = build_config.get("pytest_cmd", "")
-            matrix_item["workdir"] = build_config.get("workdir", "")
-            matrix_item["output_dir"] = build_config.get("output_dir", "")
-
-        elif build_type == "tarball":
-            matrix_item["ecbuild_version"] = build_config.get("ecbuild_version", "")
-            matrix_item["cmake_options"] = dict_to_cmake_args(build_config.get("cmake_options", {}), "cmake_options")
-            matrix_item["confluence_space"] = build_config.get("confluence_space", "")
-            matrix_item["confluence_page_title"] = build_config.get("confluence_page_title", d.get("confluence_page_title", "Releases"))
-
-        elif build_type == "system-package":
-            platform_name = build_config.get("os", "")
-            if platform_name not in sp_platforms_config:
-                print(f"::error::Unknown platform: {platform_name}")
-                raise SystemExit(1)
-
-            platform_defaults = sp_platforms_config[platform_name]
-            os_id = platform_defaults["os"]
-            matrix_item["container"] = f"eccr.ecmwf.int/platform-builder/platform-builder:{os_id}"
-            matrix_item["os"] = os_id
-            matrix_item["nexus_token_secret"] = platform_defaults["nexus_token_secret"]
-            matrix_item["nexus_url_secret"] = platform_defaults["nexus_url_secret"]
-
-            raw_deps = build_config.get("package_deps", [])
-            if isinstance(raw_deps, list):
-                matrix_item["package_deps"] = ", ".join(raw_deps)
-            else:
-                matrix_item["package_deps"] = str(raw_deps)
-
-            matrix_item["skip_version_check"] = bool_to_str(build_config.get("skip_version_check", d.get("skip_version_check", False)), "skip_version_check")
-            matrix_item["description"] = build_config.get("description", "")
-            matrix_item["license"] = build_config.get("license", "")
-            matrix_item["maintainer"] = build_config.get("maintainer", d.get("maintainer", "software@ecmwf.int"))
-            matrix_item["vendor"] = build_config.get("vendor", d.get("vendor", "ECMWF"))
-            matrix_item["homepage_url"] = build_config.get("homepage_url", "")
-            matrix_item["install_prefix"] = build_config.get("install_prefix", d.get("install_prefix", "/opt/ecmwf"))
-            matrix_item["self_test"] = bool_to_str(build_config.get("self_test", d.get("self_test", True)), "self_test")
-            matrix_item["install_test"] = bool_to_str(build_config.get("install_test", d.get("install_test", False)), "install_test")
-            matrix_item["install_test_os_image"] = build_config.get("install_test_os_image", "")
-            matrix_item["install_test_command"] = build_config.get("install_test_command", "")
-            matrix_item["build_type"] = build_config.get("build_type", d.get("build_type", "Release"))
-            matrix_item["env"] = build_config.get("env", "")
-            matrix_item["deb_section"] = build_config.get("deb_section", "")
-            matrix_item["deb_priority"] = build_config.get("deb_priority", d.get("deb_priority", "optional"))
-            matrix_item["rpm_group"] = build_config.get("rpm_group", "")
-            matrix_item["dependencies"] = list_to_str_line_separated(build_config.get("dependencies", []), "dependencies")
-            matrix_item["dependency_branch"] = build_config.get("dependency_branch", "")
-            matrix_item["cmake_options"] = dict_to_cmake_args(build_config.get("cmake_options", {}), "cmake_options")
-            matrix_item["ctest_options"] = list_to_str_line_separated(build_config.get("ctest_options", []), "ctest_options")
-            matrix_item["dependency_cmake_options"] = dict_to_cmake_args(build_config.get("dependency_cmake_options", {}), "dependency_cmake_options")
-            matrix_item["cmake"] = bool_to_str(build_config.get("cmake", d.get("cmake", False)), "cmake")
-            matrix_item["ecbundle"] = bool_to_str(build_config.get("ecbundle", d.get("ecbundle", False)), "ecbundle")
-            matrix_item["self_build"] = bool_to_str(build_config.get("self_build", d.get("self_build", True)), "self_build")
-            matrix_item["toolchain_file"] = build_config.get("toolchain_file", "")
-            matrix_item["parallelism_factor"] = str(build_config.get("parallelism_factor", d.get("parallelism_factor", "2")))
-            matrix_item["compiler_cc"] = build_config.get("compiler_cc", d.get("compiler_cc", "gcc"))
-            matrix_item["compiler_cxx"] = build_config.get("compiler_cxx", d.get("compiler_cxx", "g++"))
-            matrix_item["compiler_fc"] = build_config.get("compiler_fc", d.get("compiler_fc", "gfortran"))
-            matrix_item["cache_suffix"] = build_config.get("cache_suffix", "")
-            matrix_item["save_cache"] = bool_to_str(build_config.get("save_cache", d.get("save_cache", True)), "save_cache")
-            matrix_item["recreate_cache"] = bool_to_str(build_config.get("recreate_cache", d.get("recreate_cache", False)), "recreate_cache")
 
-        matrix["include"].append(matrix_item)
+def load_action_config(action_path: Path = ACTION_DIR) -> tuple[dict, dict, dict]:
+    """Shared defaults, runners and system-package platforms of the load-config action."""
+    with open(action_path.parent / "defaults.yml") as f:
+        defaults = yaml.safe_load(f)
+    with open(action_path / "config" / "runners.yml") as f:
+        runners = yaml.safe_load(f)
+    with open(action_path / "config" / "platforms-system-package.yml") as f:
+        platforms = yaml.safe_load(f)
+    return defaults, runners, platforms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the build matrix of a cd-config.yml")
+    parser.add_argument("config", type=Path, nargs="?", help="cd-config.yml, instead of STEP_LOAD_CONFIG")
+    parser.add_argument("--action-path", type=Path, default=ACTION_DIR, help="load-config action directory")
+    parser.add_argument("--durations", default="", help="JSON object of build name to seconds from previous runs")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shards of balanced duration to output")
+    parser.add_argument(
+        "--keep-duplicates", action="store_true", help="Only warn about builds identical to an earlier one"
+    )
+    args = parser.parse_args()
+
+    if args.config:
+        config_yaml = args.config.read_text()
+    elif "STEP_LOAD_CONFIG" in os.environ:
+        config_yaml = os.environ["STEP_LOAD_CONFIG"]
+    else:
+        parser.error("a configuration file is required when STEP_LOAD_CONFIG is not set")
+
+    # Keep stdout for the matrix when there is no GITHUB_OUTPUT, e.g. piped into render_matrix.py -
+    log = sys.stdout if "GITHUB_OUTPUT" in os.environ else sys.stderr
+
+    durations = {}
+    try:
+        matrix = generate_matrix(yaml.safe_load(config_yaml), *load_action_config(args.action_path))
+        # The durations file is optional, e.g. before the first run that records it
+        if args.durations and Path(args.durations).is_file():
+            durations = load_durations(Path(args.durations))
+        elif args.durations:
+            print(f"::warning::Build durations file {args.durations} not found, keeping the config order", file=log)
+    except MatrixError as e:
+        for error in e.errors:
+            print(f"::error::{error}", file=log)
+        sys.exit(1)
+
+    deduplicated, duplicates = deduplicate(matrix)
+    for duplicate, original in duplicates:
+        action = "building both" if args.keep_duplicates else f"skipping {duplicate}"
+        print(f"::warning::Build {duplicate} is identical to {original} but for its name, {action}", file=log)
+    if not args.keep_duplicates:
+        matrix = deduplicated
+
+    if durations:
+        matrix = order_by_duration(matrix, durations)
+    shards = {"include": shard_matrix(matrix, args.shards, durations)}
+
+    if "GITHUB_OUTPUT" not in os.environ:
+        print(json.dumps(shards if args.shards > 1 else matrix, indent=2))
+        return
+    with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+        f.write(f"matrix={json.dumps(matrix)}\n")
+        f.write(f"shards={json.dumps(shards)}\n")
+    if args.shards > 1:
+        for shard in shards["include"]:
+            names = ", ".join(item["name"] for item in shard["matrix"]["include"])
+            print(f"Shard {shard['shard']}: {shard['predicted_seconds']}s predicted, {names}")
+
 
-with open(os.environ["GITHUB_OUTPUT"], "a") as f:
-    f.write(f"matrix={json.dumps(matrix)}\n")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Tests for generate_matrix.py, the build matrix of a cd-config.yml."""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import generate_matrix  # noqa: E402
+from generate_matrix import MatrixError  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+# The old script merged dicts through a set of their keys, so the order of these lines varied between runs
+UNORDERED_FIELDS = {"cmake_options", "env_vars"}
+
+
+@pytest.fixture(scope="module")
+def action_config():
+    return generate_matrix.load_action_config()
+
+
+def hpc_build(name, **config):
+    return {"name": name, "type": "hpc", "config": config}
+
+
+def matrix_of(*names):
+    return {"include": [{"name": name} for name in names]}
+
+
+def names(matrix):
+    return [item["name"] for item in matrix["include"]]
+
+
+def test_field_table_matches_legacy_output(action_config):
+    config = yaml.safe_load((DATA_DIR / "cd-config.yml").read_text())
+    legacy = json.loads((DATA_DIR / "legacy-matrix.json").read_text())
+
+    matrix = generate_matrix.generate_matrix(config, *action_config)
+
+    assert names(matrix) == names(legacy)
+    for item, legacy_item in zip(matrix["include"], legacy["include"]):
+        item = {key: value for key, value in item.items() if key != "fingerprint"}
+        assert list(item) == list(legacy_item)
+        for key, value in legacy_item.items():
+            if key in UNORDERED_FIELDS:
+                assert sorted(item[key].splitlines()) == sorted(value.splitlines()), f"{item['name']}.{key}"
+            else:
+                assert item[key] == value, f"{item['name']}.{key}"
+
+
+def test_only_hpc_builds_are_fingerprinted(action_config):
+    config = yaml.safe_load((DATA_DIR / "cd-config.yml").read_text())
+
+    matrix = generate_matrix.generate_matrix(config, *action_config)
+
+    assert {item["name"] for item in matrix["include"] if "fingerprint" in item} == {"gnu", "intel"}
+
+
+def test_matrix_error_lists_every_problem_with_its_location(action_config):
+    config = {
+        "builds": [
+            {"name": "no-type"},
+            hpc_build("gnu", cmake_options=["-DA=1"], ctest_options=[1]),
+            {"name": "rocky", "type": "system-package", "config": {"os": "rocky-42"}},
+            hpc_build("deps", dependencies=["ecmwf/eckit@develop", 3]),
+            {"name": "off", "type": "hpc", "enabled": False, "config": {"cmake_options": ["ignored"]}},
+        ]
+    }
+
+    with pytest.raises(MatrixError) as error:
+        generate_matrix.generate_matrix(config, *action_config)
+
+    errors = error.value.errors
+    assert errors[0] == "builds[0].type is required and must be a string"
+    assert any(e.startswith("builds[1] (gnu).config.cmake_options must be a dict") for e in errors)
+    assert any(e.startswith("builds[1] (gnu).config.ctest_options[0] must be a string") for e in errors)
+    assert any(e.startswith("builds[2] (rocky).config.os: unknown platform 'rocky-42'") for e in errors)
+    assert any(e.startswith("builds[3] (deps).config.dependencies[1] must be a string or a mapping") for e in errors)
+    assert len(errors) == 5
+    assert str(error.value) == "\n".join(errors)
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        ([], "configuration must be a mapping"),
+        ({"builds": {"gnu": {}}}, "builds must be a list"),
+        ({"builds": ["gnu"]}, "builds[0] must be a mapping"),
+        ({"builds": [{"name": "gnu", "type": "hpc", "config": ["a"]}]}, "builds[0].config must be a mapping"),
+    ],
+)
+def test_matrix_error_for_invalid_structure(action_config, config, message):
+    with pytest.raises(MatrixError, match=message.replace("[", r"\[")):
+        generate_matrix.generate_matrix(config, *action_config)
+
+
+@pytest.mark.parametrize(
+    "dependency, formatted",
+    [
+        ("ecmwf/atlas@develop needs: eckit", "ecmwf/atlas@develop needs: eckit"),
+        ({"repo": "ecmwf/atlas@develop"}, "ecmwf/atlas@develop"),
+        ({"repo": "ecmwf/atlas@develop", "needs": "eckit"}, "ecmwf/atlas@develop needs: eckit"),
+        ({"repo": "ecmwf/atlas@develop", "needs": ["eckit", "fckit"]}, "ecmwf/atlas@develop needs: eckit, fckit"),
+        # Needs nothing, rather than the dependency declared before it
+        ({"repo": "ecmwf/atlas@develop", "needs": []}, "ecmwf/atlas@develop needs: "),
+    ],
+)
+def test_format_dependency(dependency, formatted):
+    assert generate_matrix.format_dependency(dependency, "deps[0]") == formatted
+
+
+def test_format_dependency_rejects_unquoted_needs():
+    [dependency] = yaml.safe_load("- ecmwf/atlas@develop needs: eckit")
+
+    with pytest.raises(ValueError) as error:
+        generate_matrix.format_dependency(dependency, "deps[0]")
+
+    assert str(error.value) == (
+        'deps[0] must be quoted as "ecmwf/atlas@develop needs: eckit", or written as {repo: ..., needs: [...]}'
+    )
+
+
+@pytest.mark.parametrize(
+    "dependency",
+    [{"repo": 3}, {"repo": "ecmwf/atlas@develop", "needs": {"eckit": 1}}, {"repo": "ecmwf/atlas", "ref": "develop"}],
+)
+def test_format_dependency_rejects_invalid_mappings(dependency):
+    with pytest.raises(ValueError, match=r"^deps\[0\] must"):
+        generate_matrix.format_dependency(dependency, "deps[0]")
+
+
+COMMON = {
+    "cmake_options": {"ENABLE_TESTS": True, "ENABLE_MPI": True},
+    "modules": ["python3", "ninja"],
+    "platform": "gnu-14.2.0",
+}
+
+
+def test_deep_merge_merges_dicts_and_concatenates_lists():
+    specific = {"cmake_options": {"ENABLE_MPI": False}, "modules": ["cmake"], "queue": "nf"}
+
+    merged = generate_matrix.deep_merge(COMMON, specific)
+
+    assert merged == {
+        "cmake_options": {"ENABLE_TESTS": True, "ENABLE_MPI": False},
+        "modules": ["python3", "ninja", "cmake"],
+        "platform": "gnu-14.2.0",
+        "queue": "nf",
+    }
+    assert COMMON["cmake_options"] == {"ENABLE_TESTS": True, "ENABLE_MPI": True}
+    assert COMMON["modules"] == ["python3", "ninja"]
+
+
+def test_deep_merge_shares_unchanged_values():
+    merged = generate_matrix.deep_merge(COMMON, {"platform": "intel-2021.4.0", "modules": None})
+
+    assert merged["platform"] == "intel-2021.4.0"
+    assert merged["modules"] is COMMON["modules"]
+    assert merged["cmake_options"] is COMMON["cmake_options"]
+    assert generate_matrix.deep_merge(COMMON, {}) is COMMON
+
+
+def test_deep_merge_overrides_replace_common_values():
+    specific = {"cmake_options": {"ENABLE_TESTS": {"unit": True}, "ENABLE_OMP": False}, "modules": ["intel"]}
+
+    merged = generate_matrix.deep_merge(COMMON, specific, ["modules", "cmake_options.ENABLE_TESTS"])
+
+    assert merged["modules"] == ["intel"]
+    assert merged["cmake_options"] == {"ENABLE_TESTS": {"unit": True}, "ENABLE_MPI": True, "ENABLE_OMP": False}
+
+
+def test_deep_merge_star_override_replaces_common_config():
+    specific = {"modules": ["intel"]}
+
+    merged = generate_matrix.deep_merge(COMMON, specific, ["*"])
+
+    assert merged == {"modules": ["intel"]}
+    assert merged is not specific
+
+
+def test_common_config_overrides_of_a_build(action_config):
+    config = {
+        "common_config": {"hpc": COMMON},
+        "builds": [
+            hpc_build("merged", modules=["intel"]),
+            {**hpc_build("replaced", modules=["intel"]), "common_config_overrides": ["modules"]},
+            {**hpc_build("alone", modules=["intel"]), "common_config_overrides": ["*"]},
+        ],
+    }
+
+    matrix = generate_matrix.generate_matrix(config, *action_config)
+
+    merged, replaced, alone = matrix["include"]
+    assert merged["modules"] == "python3\nninja\nintel"
+    assert replaced["modules"] == "intel"
+    assert replaced["cmake_options"] == "-DENABLE_TESTS=ON\n-DENABLE_MPI=ON"
+    assert alone["modules"] == "intel"
+    assert alone["cmake_options"] == ""
+
+
+def test_shard_matrix_balances_predicted_durations():
+    durations = {"a": 10, "b": 9, "c": 5, "d": 4, "e": 3, "f": 1}
+
+    shards = generate_matrix.shard_matrix(matrix_of(*durations), 2, durations)
+
+    assert [(shard["shard"], shard["predicted_seconds"], names(shard["matrix"])) for shard in shards] == [
+        (0, 17, ["a", "d", "e"]),
+        (1, 15, ["b", "c", "f"]),
+    ]
+
+
+def test_shard_matrix_without_durations_is_round_robin():
+    shards = generate_matrix.shard_matrix(matrix_of("a", "b", "c", "d", "e"), 2, {})
+
+    assert [names(shard["matrix"]) for shard in shards] == [["a", "c", "e"], ["b", "d"]]
+    assert [shard["predicted_seconds"] for shard in shards] == [0, 0]
+
+
+def test_shard_matrix_drops_empty_shards():
+    shards = generate_matrix.shard_matrix(matrix_of("a", "b"), 4, {"a": 5})
+
+    assert [names(shard["matrix"]) for shard in shards] == [["a"], ["b"]]
+    assert generate_matrix.shard_matrix(matrix_of("a"), 0, {})[0]["matrix"] == matrix_of("a")
+
+
+def test_order_by_duration_puts_longest_builds_first():
+    durations = {"a": 5, "b": 30, "c": 10, "e": 30}
+
+    # d has no history and is predicted to take the median, 20s
+    assert names(generate_matrix.order_by_duration(matrix_of("a", "b", "c", "d", "e"), durations)) == [
+        "b",
+        "e",
+        "d",
+        "c",
+        "a",
+    ]
+
+
+def test_order_by_duration_without_durations_keeps_config_order():
+    matrix = matrix_of("c", "a", "b")
+
+    assert generate_matrix.order_by_duration(matrix, {}) == matrix
+
+
+def test_deduplicate_drops_builds_identical_but_for_their_name(action_config):
+    config = {
+        "builds": [
+            hpc_build("gnu", platform="gnu-14.2.0"),
+            hpc_build("gnu-copy", platform="gnu-14.2.0"),
+            hpc_build("intel", platform="intel-2021.4.0"),
+            hpc_build("gnu-again", platform="gnu-14.2.0"),
+            {"name": "conda", "type": "conda"},
+            {"name": "conda-copy", "type": "conda"},
+        ]
+    }
+    matrix = generate_matrix.generate_matrix(config, *action_config)
+
+    deduplicated, duplicates = generate_matrix.deduplicate(matrix)
+
+    assert names(deduplicated) == ["gnu", "intel", "conda", "conda-copy"]
+    assert duplicates == [("gnu-copy", "gnu"), ("gnu-again", "gnu")]
+    assert names(matrix) == ["gnu", "gnu-copy", "intel", "gnu-again", "conda", "conda-copy"]
+
+
+@pytest.mark.parametrize("keep_duplicates, expected", [(False, ["gnu", "intel"]), (True, ["gnu", "gnu-copy", "intel"])])
+def test_main_keep_duplicates(monkeypatch, tmp_path, capsys, keep_duplicates, expected):
+    config = tmp_path / "cd-config.yml"
+    config.write_text(
+        yaml.safe_dump(
+            {
+                "builds": [
+                    hpc_build("gnu", platform="gnu-14.2.0"),
+                    hpc_build("gnu-copy", platform="gnu-14.2.0"),
+                    hpc_build("intel", platform="intel-2021.4.0"),
+                ]
+            }
+        )
+    )
+    monkeypatch.delenv("GITHUB_OUTPUT", raising=False)
+    extra_args = ["--keep-duplicates"] if keep_duplicates else []
+    monkeypatch.setattr(sys, "argv", ["generate_matrix.py", str(config), *extra_args])
+
+    generate_matrix.main()
+
+    out, err = capsys.readouterr()
+    assert names(json.loads(out)) == expected
+    action = "building both" if keep_duplicates else "skipping gnu-copy"
+    assert f"::warning::Build gnu-copy is identical to gnu but for its name, {action}" in err
@@ -1,42 +1,296 @@
+"""Upload a directory tree to sites.ecmwf.int.
+
+Files are uploaded one by one through a bounded pool of workers, retrying
+transient failures with exponential backoff. Every completed upload is
+appended to a local manifest. With --resume, a rerun after a failure skips
+the files the manifest records with the same content, provided the published
+site still serves them with the same size, so only missing or changed files
+are sent. Progress and throughput are reported while uploading.
+"""
+
 import argparse
-import sys
+import hashlib
+import json
 import os
+import posixpath
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import quote
 
 from sites.sdk import SitesClient
-from sites.sdk.sites import Site, Authenticator
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--path", type=str)
-parser.add_argument("--remote-path", type=str, default=".")
-parser.add_argument("--space", type=str)
-parser.add_argument("--name", type=str)
-
-args = parser.parse_args()
-
-error = False
-for k, v in vars(args).items():
-    if not v:
-        print(f'::error::Input "{k}" not provided!')
-        error = True
-
-if error:
-    sys.exit(1)
-
-# setup authenticated content manager instance
-site_authenticator = Authenticator.from_token(token=os.environ["SITES_TOKEN"])
-client = SitesClient(authenticator=site_authenticator)
-site = Site.from_space_and_name(space=args.space, name=args.name)
-site_content_manager = client.content(site=site)
-
-# upload all the contents of a directory
-print("Uploading...")
-res = site_content_manager.upload(
-    local_path=args.path, remote_path=args.remote_path, recursive=True
-)
-print(res)
-if isinstance(res, list) and len(res):
+from sites.sdk.sites import Authenticator, Site
+
+RETRY_BACKOFF = 2
+PROGRESS_INTERVAL = 5
+CHUNK_SIZE = 1024 * 1024
+SITES_URL = "https://sites.ecmwf.int"
+REMOTE_CHECK_TIMEOUT = 10
+
+
+@dataclass
+class UploadResult:
+    """Outcome of uploading a single file."""
+
+    path: str
+    ok: bool
+    attempts: int
+    size: int = 0
+    error: str = ""
+    skipped: bool = False
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def collect_files(root: Path) -> list[Path]:
+    """Files of the tree, in a stable order."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        files.extend(Path(dirpath) / name for name in sorted(filenames))
+    return files
+
+
+class Manifest:
+    """Journal of the files uploaded to a target, one JSON object per line.
+
+    Lines are appended as uploads complete, so the journal survives the
+    upload being interrupted. A truncated last line is ignored. Unless
+    resuming, the entries of the target are dropped, and every file is
+    uploaded again. Loading keeps the latest entry of each file, so the
+    journal does not grow across runs.
+    """
+
+    def __init__(self, path: Path, target: str, resume: bool):
+        self.path = path
+        self.target = target
+        self._lock = threading.Lock()
+        entries = {}
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("target") == target and not resume:
+                        continue
+                    entries[(entry.get("target"), entry.get("path"))] = entry
+        self.uploaded: dict[str, str] = {
+            entry["path"]: entry["sha256"] for entry in entries.values() if entry["target"] == target
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries.values())
+
+    def is_uploaded(self, relative: str, digest: str) -> bool:
+        return self.uploaded.get(relative) == digest
+
+    def record(self, relative: str, digest: str) -> None:
+        with self._lock:
+            self.uploaded[relative] = digest
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"target": self.target, "path": relative, "sha256": digest}) + "\n")
+
+
+def is_published(url: str, size: int) -> bool:
+    """Whether the site serves url itself, not a redirect to a login page, with the given size."""
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=REMOTE_CHECK_TIMEOUT) as response:
+            length = response.headers.get("Content-Length")
+            return response.geturl() == url and length is not None and int(length) == size
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+class Progress:
+    """Thread safe counters, printed at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self._last_print = self.start
+        self._lock = threading.Lock()
+
+    def add(self, size: int) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            now = time.perf_counter()
+            if now - self._last_print >= PROGRESS_INTERVAL:
+                self._last_print = now
+                print(f"  {self.files}/{self.total_files} files, {self.throughput()}")
+
+    def throughput(self) -> str:
+        seconds = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            f"{self.bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB in {seconds:.1f}s, "
+            f"{self.files / seconds:.1f} files/s, {self.bytes / 1e6 / seconds:.2f} MB/s"
+        )
+
+
+def create_content_manager(token: str, space: str, name: str):
+    client = SitesClient(authenticator=Authenticator.from_token(token=token))
+    return client.content(site=Site.from_space_and_name(space=space, name=name))
+
+
+def upload_file(content_manager, local_path: Path, remote_dir: str, relative: str, retries: int) -> UploadResult:
+    """Upload a single file into remote_dir, retrying failures with exponential backoff."""
+    size = local_path.stat().st_size
+    error = ""
+    for attempt in range(1, retries + 2):
+        try:
+            res = content_manager.upload(local_path=str(local_path), remote_path=remote_dir, recursive=False)
+            if res and not (isinstance(res, list) and not len(res)):
+                return UploadResult(relative, True, attempt, size)
+            error = f"unexpected response {res!r}"
+        except Exception as e:  # the SDK does not document its exceptions
+            error = str(e) or type(e).__name__
+
+        if attempt <= retries:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            print(f"  ↻ Retrying {relative} in {delay}s ({error})")
+            time.sleep(delay)
+
+    print(f"  Error uploading {relative}: {error}", file=sys.stderr)
+    return UploadResult(relative, False, attempt, error=error)
+
+
+def upload_tree(
+    root: Path,
+    remote_path: str,
+    space: str,
+    name: str,
+    token: str,
+    manifest: Manifest,
+    workers: int,
+    retries: int,
+    site_url: str = SITES_URL,
+) -> list[UploadResult]:
+    """Upload the files of root, skipping those recorded in the manifest that the site still serves.
+
+    Returns the result of every file.
+    """
+    files = []
+    recorded = 0
+    for path in collect_files(root):
+        relative = path.relative_to(root).as_posix()
+        digest = file_digest(path)
+        uploaded = manifest.is_uploaded(relative, digest)
+        recorded += uploaded
+        files.append((path, relative, digest, uploaded))
+    if recorded:
+        print(f"ℹ {recorded} file(s) already uploaded according to {manifest.path}, checking they are published")
+    print(f"Uploading {len(files)} file(s) with {workers} worker(s)...")
+
+    progress = Progress(len(files), sum(path.stat().st_size for path, _, _, _ in files))
+    # One client per worker, as the SDK does not document whether clients are thread safe
+    local = threading.local()
+
+    def upload(path: Path, relative: str, digest: str, uploaded: bool) -> UploadResult:
+        size = path.stat().st_size
+        remote_file = posixpath.normpath(posixpath.join(remote_path, relative))
+        # The journal alone may be stale, e.g. after the site was cleaned up
+        if uploaded and is_published(f"{site_url.rstrip('/')}/{quote(f'{space}/{name}/{remote_file}')}", size):
+            progress.add(size)
+            return UploadResult(relative, True, 0, size, skipped=True)
+        if not hasattr(local, "content_manager"):
+            local.content_manager = create_content_manager(token, space, name)
+        result = upload_file(local.content_manager, path, posixpath.dirname(remote_file) or ".", relative, retries)
+        if result.ok:
+            manifest.record(relative, digest)
+            progress.add(result.size)
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(upload, *item) for item in files]
+        for future in as_completed(futures):
+            results.append(future.result())
+    skipped = sum(1 for result in results if result.skipped)
+    if skipped:
+        print(f"ℹ Skipped {skipped} file(s) already published")
+    print(f"✓ Uploaded {progress.files - skipped} file(s): {progress.throughput()}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload a directory to sites.ecmwf.int")
+    parser.add_argument("--path", type=str)
+    parser.add_argument("--remote-path", type=str, default=".")
+    parser.add_argument("--space", type=str)
+    parser.add_argument("--name", type=str)
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent uploads (default: 8)")
+    parser.add_argument("--retries", type=int, default=3, help="Number of retries for each failed upload (default: 3)")
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="Journal of uploaded files, to resume interrupted uploads (default: <path>.sites-upload.jsonl)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip files the manifest records as uploaded with the same content, if the site still serves them",
+    )
+    parser.add_argument("--site-url", default=SITES_URL, help=f"Base URL of the published sites (default: {SITES_URL})")
+    args = parser.parse_args()
+
+    error = False
+    for k in ("path", "remote_path", "space", "name"):
+        if not getattr(args, k):
+            print(f'::error::Input "{k}" not provided!')
+            error = True
+
+    if error:
+        sys.exit(1)
+
+    root = Path(args.path)
+    if not root.is_dir():
+        print(f"::error::{root} is not a directory!")
+        sys.exit(1)
+
+    target = f"{args.space}/{args.name}/{args.remote_path}"
+    manifest_path = args.manifest or root.resolve().parent / f"{root.resolve().name}.sites-upload.jsonl"
+    manifest = Manifest(manifest_path, target, args.resume)
+    results = upload_tree(
+        root,
+        args.remote_path,
+        args.space,
+        args.name,
+        os.environ["SITES_TOKEN"],
+        manifest,
+        max(args.workers, 1),
+        args.retries,
+        args.site_url,
+    )
+
+    failed = [result for result in results if not result.ok]
+    retried = sum(1 for result in results if result.attempts > 1)
+    if retried:
+        print(f"ℹ {retried} file(s) needed retries")
+    if failed:
+        for result in failed:
+            print(f"::error::Failed to upload {result.path}: {result.error}")
+        hint = "rerun" if args.resume else "rerun with resume enabled"
+        print(f"::error::Upload failed for {len(failed)} file(s), {hint} to upload only the missing files")
+        sys.exit(1)
     print(f"Successfully uploaded to sites.ecmwf.int/{args.space}/{args.name}")
-else:
-    print("::error::Upload failed!")
-    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()